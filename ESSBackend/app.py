@@ -25,27 +25,49 @@
 #    only whether the operation was successful.
 #    Finding no content is still a successful operation; no error occurs.
 
+from ESSBackend.cache import ResponseCache
+from ESSBackend.coalesce import IncrementCoalescer
 from ESSBackend.config import Config
-from bcrypt import checkpw, hashpw, gensalt
-from datetime import datetime
-from flask import Flask, jsonify, make_response, request
+from ESSBackend.encoder import content_types, negotiate
+from ESSBackend.metrics import Metrics
+from ESSBackend.passwords import PasswordPoolBusy, check_password, hash_password, needs_rehash
+from ESSBackend.profiler import Profiler
+from ESSBackend.schema import Schema, bigint, optional, string
+from ESSBackend.tokens import issue_token, revoke_token, verify_token
+from datetime import date, datetime, time, timedelta
+from flask import Flask, Response, g, json, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, cast, Date
+from sqlalchemy import create_engine, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
-from typing import NamedTuple, List, Dict
-
-import hashlib
+from sqlalchemy.util import LRUCache
+from typing import Callable, NamedTuple, List, Dict
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, convert_unicode=True)
+# compiled SQL is cached per statement object, for the statements built once and reused
+# (see resources.py and upsert.py)
+engine = create_engine(
+    Config.SQLALCHEMY_DATABASE_URI,
+    convert_unicode=True,
+    execution_options={'compiled_cache': LRUCache(500)}
+)
 db = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
 Base = declarative_base()
 Base.query = db.query_property()
 
+response_cache = ResponseCache.from_config(app.config)
+
+metrics = Metrics.from_config(app.config)
+if metrics:
+    metrics.instrument(app, engine)
+
+profiler = Profiler.from_config(app.config)
+if profiler:
+    profiler.instrument(app, engine)
+
 
 def db_init():
     import ESSBackend.models
@@ -58,722 +80,873 @@ def shutdown_session(exception=None):
     db.remove()
 
 
+# ----- Request Schemas (see schema.py)
+
+TOKEN = {'hash': str, 'expiry': str, 'email': str}
+METADATA = {'timestamp': datetime}
+
+CREDENTIALS = Schema({'email': string(128), 'password': str})  # as long as users.email
+AUTHENTICATED = Schema({'token': TOKEN})
+# `fields` picks the response fields to read (all by default)
+DAY_READ = Schema({'date': date, 'fields': optional([str]), 'token': TOKEN})
+RANGE_READ = Schema(
+    {
+        'start': date,
+        'end': date,
+        'cursor': optional(str),
+        'limit': optional(int),
+        'fields': optional([str]),
+        'token': TOKEN
+    }
+)
+# `fields` maps categories to the fields to read of them
+DAY = Schema(
+    {
+        'date': date,
+        'categories': optional([str]),
+        'fields': optional(dict),
+        'token': TOKEN
+    }
+)
+DATE_RANGE = Schema({'start': date, 'end': date, 'token': TOKEN})
+SYNC = Schema({'records': list, 'token': TOKEN})
+DELETE = Schema({'type': str, 'key': dict, 'token': TOKEN})
+KEY = Schema({'key': dict, 'token': TOKEN})
+CHANGES = Schema({'since': optional(bigint), 'limit': optional(int), 'token': TOKEN})
+SINCE = Schema({'since': bigint})  # the same, given in the query string
+SEARCH = Schema(
+    {
+        'query': str,
+        'offset': optional(int),
+        'limit': optional(int),
+        'fields': optional([str]),
+        'token': TOKEN
+    }
+)
+
+
 @app.route('/api/login', methods=['POST'])
 def login():
     from ESSBackend.models import AppUser
 
-    requirements = [('email', []), ('password', [])]
-    check = check_requirements(requirements, request)
-    if not check[0]:
-        return check[1]
+    body, error = check_schema(CREDENTIALS, request)
+    if error:
+        return error
 
-    user: AppUser = AppUser.query.filter_by(email=request.json['email']).first()
+    user: AppUser = AppUser.query.filter_by(email=body['email']).first()
     if not user:
-        return make_response(jsonify({'result': False, 'message': 'User not found'}))
-
-    if checkpw(request.json['password'].encode('utf-8'), user.password_hash.encode('utf-8')):
+        return api_response({'result': False, 'message': 'User not found'})
+
+    if check_password(body['password'], user.password_hash):
+        # migrate hashes to the configured cost as users log in
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(body['password'])
+                db.commit()
+            except PasswordPoolBusy:
+                pass
         return return_token(user.email)
     else:
-        return make_response(jsonify({'result': False, 'message': 'Incorrect Password'}))
+        return api_response({'result': False, 'message': 'Incorrect Password'})
 
 
 @app.route('/api/register', methods=['POST'])
 def register():
     from ESSBackend.models import AppUser
-    requirements = [('email', []), ('password', [])]
-    check = check_requirements(requirements, request)
-    if not check[0]:
-        return check[1]
+    body, error = check_schema(CREDENTIALS, request)
+    if error:
+        return error
 
-    user: AppUser = AppUser.query.filter_by(email=request.json['email']).first()
+    user: AppUser = AppUser.query.filter_by(email=body['email']).first()
     if user:
-        return make_response(jsonify({'result': False, 'message': 'User already exists'}))
+        return api_response({'result': False, 'message': 'User already exists'})
 
-    pwhash = (hashpw(request.json['password'].encode('utf-8'), gensalt())).decode('utf-8')
-    new_user: AppUser = AppUser(password_hash=pwhash, email=request.json['email'])
+    pwhash = hash_password(body['password'])
+    new_user: AppUser = AppUser(password_hash=pwhash, email=body['email'])
     db.add(new_user)
     db.commit()
 
     return return_token(new_user.email)
 
 
-@app.route('/api/status', methods=['GET'])
-def status():
-    return make_response(jsonify({'result': True, 'message': 'Server status normal'}))
-
-
-# ----- Food Functions
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    body, error = check_schema(AUTHENTICATED, request)
+    if error:
+        return error
 
-
-@app.route('/api/food', methods=['POST'])
-def get_food():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
-
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
-
-    token: Token = request.json['token']
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import Food
-
-    foods = Food.query.filter(
-        cast(Food.mealTime, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        Food.email == request.json['token']['email']
-    ).all()
+    revoke_token(token)
+    db.commit()
+    return api_response({'result': True, 'message': 'Logged out'})
 
-    contentList = [
-        {
-            'name': food.name,
-            'quantity': food.quantity,
-            'quantityUnits': food.quantityUnits,
-            'calories': food.calories,
-            'category': food.category,
-            'mealTime': food.mealTime.isoformat()
-        } for food in foods
-    ]
 
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning all commutes found for {request.json['date']}",
-                'list': contentList
-            }
-        )
+@app.route('/api/status', methods=['GET'])
+def status():
+    response = {'result': True, 'message': 'Server status normal'}
+    if water_coalescer:
+        response['waterCoalescing'] = water_coalescer.stats()
+    if response_cache:
+        response['responseCache'] = response_cache.stats()
+    return api_response(response)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics or not metrics.allowed(request.environ):
+        return not_found(None)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def service_counters():
+    """The /api/status counters, for /api/metrics."""
+    counters = {}
+    if response_cache:
+        stats = response_cache.stats()
+        counters['ess_response_cache_hits_total'] = stats['hits']
+        counters['ess_response_cache_misses_total'] = stats['misses']
+        counters['ess_response_cache_evictions_total'] = stats['evictions']
+    if water_coalescer:
+        stats = water_coalescer.stats()
+        counters['ess_water_increments_total'] = stats['increments']
+        counters['ess_water_flushes_total'] = stats['flushes']
+        counters['ess_water_rows_total'] = stats['rows']
+    return counters
+
+
+if metrics:
+    metrics.collect(service_counters)
+
+
+# ----- Category Functions
+
+
+def category_routes(resource, write_schema: Schema):
+    """Register a category's routes. Called for each category by the registry (resources.py).
+
+    /api/<path>         reads a day, or a start/end range
+    /api/<path>/new     writes a record
+    /api/<path>/batch   writes a list of records, as /api/sync does
+    /api/<path>/delete  deletes a record by its key, as /api/delete does
+    """
+
+    def read():
+        body, error = check_request(read_schema(request), request)
+        if error:
+            return error
+        return read_records(resource, body)
+
+    def write():
+        body, error = check_request(write_schema, request)
+        if error:
+            return error
+        return writers.get(resource.name, write_record)(resource, body)
+
+    def batch():
+        body, error = check_request(SYNC, request)
+        if error:
+            return error
+        # the type comes from the URL rather than from each record
+        records = [
+            dict(record, type=resource.name) if isinstance(record, dict) else record
+            for record in body['records']
+        ]
+        return sync_records(body['token']['email'], records)
+
+    def delete():
+        body, error = check_request(KEY, request)
+        if error:
+            return error
+        return delete_record(resource, body['token']['email'], body['key'])
+
+    app.add_url_rule(f'/api/{resource.path}', f'get_{resource.name}', read, methods=['POST'])
+    app.add_url_rule(f'/api/{resource.path}/new', f'post_{resource.name}', write, methods=['POST'])
+    app.add_url_rule(
+        f'/api/{resource.path}/batch', f'batch_{resource.name}', batch, methods=['POST']
+    )
+    app.add_url_rule(
+        f'/api/{resource.path}/delete', f'delete_{resource.name}', delete, methods=['POST']
     )
 
 
-@app.route('/api/food/new', methods=['POST'])
-def post_food():
-    requirements = [
-        ('content', ['name', 'quantity', 'quantityUnits', 'calories', 'category', 'mealTime']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
-
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
-
-    from ESSBackend.models import Food
-    food: Food = Food.query.filter_by(
-        email=request.json['token']['email'],
-        name=request.json['content']['name'],
-        mealTime=request.json['content']['mealTime']
-    ).first()
-
-    if food:
-        food.quantity = request.json['content']['quantity']
-        food.quantityUnits = request.json['content']['quantityUnits']
-        food.calories = request.json['content']['calories']
-        food.category = request.json['content']['category']
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Updated existing food.'}))
-    else:
-        new_food: Food = Food(
-            email=request.json['token']['email'],
-            name=request.json['content']['name'],
-            mealTime=request.json['content']['mealTime'],
-            quantity=request.json['content']['quantity'],
-            quantityUnits=request.json['content']['quantityUnits'],
-            calories=request.json['content']['calories'],
-            category=request.json['content']['category']
+def write_water(resource, body):
+    if body['content']['isIncrement'] and water_coalescer:
+        inserted = water_coalescer.add(
+            (body['token']['email'], body['metadata']['timestamp'].date()),
+            body['content']['cups']
         )
-        db.add(new_food)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new food.'}))
+        return api_response({'result': True, 'message': resource.inserted_message(inserted)})
 
+    return write_record(resource, body)
 
-# ----- Commute Functions
 
+def flush_water(totals):
+    from ESSBackend.changes import stamp, stamped
+    from ESSBackend.models import WaterCups
+    from ESSBackend.resources import clamp_count, increment_water, resources
+    from ESSBackend.revisions import bump
+    from ESSBackend.scorecard import refresh
+    from ESSBackend.upsert import upsert_many
 
-@app.route('/api/commute', methods=['POST'])
-def get_commute():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
+    # a batch's increments can add up to more than a new row's count can hold
+    rows = [
+        {
+            'email': email,
+            'date': date,
+            'count': clamp_count(cups)
+        } for (email, date), cups in totals.items()
     ]
+    stamp(rows)
+    inserted = upsert_many(WaterCups, rows, stamped(increment_water))
+    for email, date in totals:
+        refresh(resources['water'], email, date)
+    bump(totals)
+    db.commit()
+    return dict(zip(totals, inserted))
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
 
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
+# Set WATER_COALESCE_MS to batch concurrent increments from the same worker into one statement
+water_coalescer = IncrementCoalescer(app.config['WATER_COALESCE_MS'] / 1000, flush_water) \
+    if app.config['WATER_COALESCE_MS'] else None
 
-    from ESSBackend.models import Commute
 
-    commutes = Commute.query.filter(
-        cast(Commute.arrival, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        Commute.email == request.json['token']['email']
-    ).all()
+# categories whose writes don't go straight to write_record
+writers = {'water': write_water}
 
-    contentList = [
-        {
-            'method': commute.method,
-            'distance': commute.distance,
-            'departure': commute.departure,
-            'arrival': commute.arrival,
-        } for commute in commutes
-    ]
-
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning all commutes found for {request.json['date']}",
-                'list': contentList
-            }
-        )
-    )
 
+# ----- Day Functions
 
-@app.route('/api/commute/new', methods=['POST'])
-def post_commute():
-    requirements = [
-        ('content', ['arrival', 'departure', 'method', 'distance']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+@app.route('/api/day', methods=['POST'])
+def get_day():
+    body, error = check_schema(DAY, request)
+    if error:
+        return error
 
-    token: Token = request.json['token']
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import Commute
+    from ESSBackend.resources import resources, select_days
 
-    commute: Commute = Commute.query.filter_by(
-        email=request.json['token']['email'],
-        arrival=request.json['content']['arrival'],
-    ).first()
-
-    if commute:
-        commute.arrival = request.json['content']['arrival']
-        commute.departure = request.json['content']['departure']
-        commute.method = request.json['content']['method']
-        commute.distance = request.json['content']['distance']
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Updated existing commute.'}))
-    else:
-        new_commute: Commute = Commute(
-            email=request.json['token']['email'],
-            arrival=request.json['content']['arrival'],
-            departure=request.json['content']['departure'],
-            method=request.json['content']['method'],
-            distance=request.json['content']['distance']
+    # a category named twice is still returned once
+    names = list(dict.fromkeys(body.get('categories', list(resources))))
+    unknown = [name for name in names if name not in resources]
+    if unknown:
+        return api_response(
+            {
+                'result': False,
+                'message': f'Unknown categories: {", ".join(unknown)}'
+            }
         )
-        db.add(new_commute)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new commute.'}))
+    fields = body.get('fields', {})
+    views = {}
+    for name in names:
+        views[name], error = read_view(resources[name], fields.get(name), f'fields.{name}')
+        if error:
+            return error
 
+    # every category comes back from a single UNION ALL statement
+    grouped = {name: [] for name in names}
+    if views:  # an empty UNION ALL isn't a statement
+        for row in db.execute(select_days(list(views.values()), token['email'], body['date'])):
+            grouped[row.resource].append(views[row.resource].values(row))
 
-# ----- Journal Functions
+    response = {'result': True, 'message': f"Returning all categories for {body['date']}"}
+    for name, view in views.items():
+        response[name] = view.serialize_day(grouped[name])
 
+    return api_response(response)
 
-@app.route('/api/journal', methods=['POST'])
-def get_journal():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+# ----- Scorecard Functions
 
-    token: Token = request.json['token']
+
+@app.route('/api/scorecard', methods=['POST'])
+def get_scorecard():
+    body, error = check_schema(DATE_RANGE, request)
+    if error:
+        return error
+
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import JournalEntry
+    from ESSBackend.models import DailySummary
 
-    journals = JournalEntry.query.filter(
-        cast(JournalEntry.created, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        JournalEntry.email == request.json['token']['email']
-    ).all()
+    # one precomputed row per day, however many records the user logged
+    table = DailySummary.__table__
+    summaries = db.execute(
+        select([table]).where(
+            (table.c.email == token['email']) & (table.c.date >= body['start']) &
+            (table.c.date <= body['end'])
+        ).order_by(table.c.date)
+    )
 
     contentList = [
         {
-            'contents': journal.content,
-            'title': journal.title,
-            'created': journal.created,
-            'edited': journal.edited
-        } for journal in journals
+            'date': summary.date,
+            'calories': summary.calories,
+            'commuteDistance': summary.commuteDistance,
+            'commuteByMethod': summary.commuteByMethod or {},
+            'waterCups': summary.waterCups,
+            'showerMinutes': summary.showerMinutes,
+            'entertainmentHours': summary.entertainmentHours,
+            'cigarettes': summary.cigarettes
+        } for summary in summaries
     ]
 
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning all journals found for {request.json['date']}",
-                'list': contentList
-            }
-        )
+    return api_response(
+        {
+            'result': True,
+            'message': f"Returning scorecard from {body['start']} to {body['end']}",
+            'list': contentList
+        }
     )
 
 
-@app.route('/api/journal/new', methods=['POST'])
-def post_journal():
-    requirements = [
-        ('content', ['title', 'contents']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
+@app.route('/api/scorecard/emissions', methods=['POST'])
+def get_emissions():
+    body, error = check_schema(DATE_RANGE, request)
+    if error:
+        return error
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
-
-    token: Token = request.json['token']
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import JournalEntry
-
-    journal: JournalEntry = JournalEntry.query.filter_by(
-        email=request.json['token']['email'],
-        title=request.json['content']['title'],
-    ).first()
-
-    if journal:
-        journal.content = request.json['content']['contents']
-        journal.edited = request.json['metadata']['timestamp']
-        db.commit()
-        return make_response(
-            jsonify({
-                'result': True,
-                'message': 'Updated existing journal entry.'
-            })
-        )
-    else:
-        new_journal: JournalEntry = JournalEntry(
-            email=request.json['token']['email'],
-            created=request.json['metadata']['timestamp'],
-            title=request.json['content']['title'],
-            content=request.json['content']['contents']
-        )
-        db.add(new_journal)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new journal entry.'}))
+    from ESSBackend.emissions import footprint
 
+    return api_response(
+        {
+            'result': True,
+            'message': f"Returning emissions from {body['start']} to {body['end']}",
+            'list': footprint(token['email'], body['start'], body['end'])
+        }
+    )
 
-# ----- Water Functions
-@app.route('/api/water', methods=['POST'])
-def get_water():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+# ----- Sync Functions
 
-    token: Token = request.json['token']
+
+@app.route('/api/sync', methods=['POST'])
+def post_sync():
+    body, error = check_schema(SYNC, request)
+    if error:
+        return error
+
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import WaterCups
+    return sync_records(token['email'], body['records'])
 
-    water = WaterCups.query.filter(
-        cast(WaterCups.date, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        WaterCups.email == request.json['token']['email']
-    ).first()
-
-    if water:
-        waterContent = {'cupsCount': water.count, 'isIncrement': False}
-    else:
-        waterContent = {'cupsCount': 0, 'isIncrement': False}
 
-    return make_response(
-        jsonify(
+def sync_records(email: str, records: List):
+    if len(records) > app.config['SYNC_MAX_RECORDS']:
+        return api_response(
             {
-                'result': True,
-                'message': f"Returning water consumption for {request.json['date']}",
-                'content': waterContent
+                'result': False,
+                'message': f"Too many records; the limit is {app.config['SYNC_MAX_RECORDS']}"
             }
         )
-    )
-
 
-@app.route('/api/water/new', methods=['POST'])
-def post_water():
-    requirements = [
-        ('content', ['isIncrement', 'cups']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
+    from ESSBackend.resources import resources
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
-
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
+    statuses = [None] * len(records)
 
-    from ESSBackend.models import WaterCups
+    # Records are grouped into multi-row upserts per table. A statement can't touch the same
+    # row twice, so a repeated key (or a change of SET clause) starts the next statement,
+    # which keeps repeated writes to one row in request order.
+    statements = {}  # resource name -> [(update, {primary key: (index, row)})]
+    for i, record in enumerate(records):
+        record, errors = check_record(record, resources)
+        if errors:
+            statuses[i] = {'result': False, 'message': errors[0]['message'], 'errors': errors}
+            continue
 
-    water: WaterCups = WaterCups.query.filter_by(
-        email=request.json['token']['email'],
-        date=request.json['metadata']['timestamp'],  # TODO: timestamp equality
-    ).first()
+        resource = resources[record['type']]
+        row = resource.row(email, record['content'], record['metadata'])
+        update = resource.update(record['content'])
+        key = tuple(row[column.name] for column in resource.model.__table__.primary_key.columns)
 
-    if water:
-        if request.json['content']['isIncrement']:
-            water.count += request.json['content']['cups']
-        else:
-            water.count = request.json['content']['cups']
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Updated existing water entry.'}))
-    else:
-        new_water: WaterCups = WaterCups(
-            email=request.json['token']['email'],
-            date=request.json['metadata']['timestamp'],
-            count=request.json['content']['cups']
-        )
-        db.add(new_water)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new water entry.'}))
+        pending = statements.setdefault(resource.name, [])
+        if not pending or pending[-1][0] is not update or key in pending[-1][1]:
+            pending.append((update, {}))
+        pending[-1][1][key] = (i, row)
 
+    for i, name, inserted in write_batches(email, statements):
+        statuses[i] = {'result': True, 'message': resources[name].inserted_message(inserted)}
+    db.commit()
 
-# ----- Shower Functions
-@app.route('/api/showers', methods=['POST'])
-def get_shower():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
+    return api_response(
+        {
+            'result': True,
+            'message': f'Synced {len(records)} records',
+            'list': statuses
+        }
+    )
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
 
-    token: Token = request.json['token']
-    tok_check = check_token(token)
+def write_batches(email: str, statements: Dict[str, List]) -> List:
+    """Upsert one user's rows, grouped as {resource name: [(update, {key: (id, row)})]}.
+
+    Each (update, rows) batch is one multi-row upsert, and the summaries, search index and
+    revisions of what it touched are brought up to date. Returns (id, resource name, inserted)
+    for every row. The caller commits.
+    """
+    from ESSBackend.changes import stamp, stamped
+    from ESSBackend.resources import resources
+    from ESSBackend.revisions import bump
+    from ESSBackend.scorecard import day_of, refresh_days
+    from ESSBackend.search import index
+    from ESSBackend.upsert import upsert_many
+
+    # every row is stamped up front, so the per-user lock is taken once, before any row lock
+    batches = [batch for pending in statements.values() for _, batch in pending]
+    stamp([row for batch in batches for _, row in batch.values()])
+
+    results = []
+    touched = {}  # resource name -> days whose summaries need refreshing
+    for name, pending in statements.items():
+        resource = resources[name]
+        for update, batch in pending:
+            ids, rows = zip(*batch.values())
+            written = upsert_many(
+                resource.model, list(rows), stamped(update), [resource.day_column]
+            )
+            for i, (inserted, day) in zip(ids, written):
+                results.append((i, name, inserted))
+                touched.setdefault(name, set()).add(day_of(day))
+            index(resource, email, list(rows))
+    for name, days in touched.items():
+        refresh_days(resources[name], email, days)
+    bump((email, day) for days in touched.values() for day in days)
+    return results
+
+
+@app.route('/api/import', methods=['POST'])
+def post_import():
+    from ESSBackend.importer import FORMATS, HEADER, Progress, readers, run
+
+    try:
+        token = json.loads(request.headers.get(HEADER, ''))
+    except ValueError:
+        token = None
+    body, errors = AUTHENTICATED.validate({'token': token})
+    if errors:
+        return schema_error(errors)
+    tok_check = check_token(body['token'])
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import ShowerUsage
+    format = FORMATS.get(request.mimetype)
+    if format is None:
+        return api_response(
+            {
+                'result': False,
+                'message': f'Unsupported file type; send one of: {", ".join(FORMATS)}'
+            }, 415
+        )
 
-    shower = ShowerUsage.query.filter(
-        cast(ShowerUsage.date, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        ShowerUsage.email == request.json['token']['email']
-    ).first()
+    # the file is read as the response is sent, a list item per chunk imported
+    last = {'progress': Progress()}
 
-    if shower:
-        showerContent = {'minutes': shower.minutes, 'cold': shower.cold}
-    else:
-        showerContent = {'minutes': 0, 'cold': False}
+    def chunks():
+        for progress in run(body['token']['email'], readers[format](request.stream)):
+            last['progress'] = progress
+            yield progress.counts()
 
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning shower usage for {request.json['date']}",
-                'content': showerContent
-            }
-        )
-    )
+    def totals():
+        return dict(last['progress'].counts(), errors=last['progress'].errors)
 
+    return stream_list(f'Importing {format} records', chunks(), totals)
 
-@app.route('/api/showers/new', methods=['POST'])
-def post_shower():
-    requirements = [
-        ('content', ['cold', 'minutes']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+# ----- Delta Sync Functions
+
 
-    token: Token = request.json['token']
+@app.route('/api/delete', methods=['POST'])
+def post_delete():
+    body, error = check_schema(DELETE, request)
+    if error:
+        return error
+
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import ShowerUsage
-
-    shower: ShowerUsage = ShowerUsage.query.filter_by(
-        email=request.json['token']['email'],
-        date=request.json['metadata']['timestamp'],  # TODO: timestamp equality
-    ).first()
-
-    if shower:
-        shower.minutes = request.json['content']['minutes']
-        shower.cold = request.json['content']['cold']
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Updated existing shower entry.'}))
-    else:
-        new_shower: ShowerUsage = ShowerUsage(
-            email=request.json['token']['email'],
-            date=request.json['metadata']['timestamp'],
-            minutes=request.json['content']['minutes'],
-            cold=request.json['content']['cold']
-        )
-        db.add(new_shower)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new shower entry.'}))
+    from ESSBackend.resources import resources
+
+    resource = resources.get(body['type'])
+    if resource is None:
+        return api_response({'result': False, 'message': 'Unknown record type'})
+    return delete_record(resource, token['email'], body['key'])
+
+
+def delete_record(resource, email: str, key: Dict):
+    from ESSBackend.changes import delete
+    from ESSBackend.revisions import bump
+    from ESSBackend.scorecard import day_of, refresh
+    from ESSBackend.search import unindex
+
+    try:
+        key = resource.decode_key(key)
+    except ValueError:
+        return api_response({'result': False, 'message': 'Invalid key'})
+
+    day = delete(resource, email, key)
+    if day is None:
+        db.rollback()
+        return api_response({'result': False, 'message': f'No such {resource.label}'})
+    day = day_of(day)
+    refresh(resource, email, day)
+    unindex(resource, email, key)
+    bump([(email, day)])
+    db.commit()
 
+    return api_response({'result': True, 'message': f'Deleted {resource.label}.'})
 
-# ----- Entertainment Functions
-@app.route('/api/entertainment', methods=['POST'])
-def get_entertainment():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+@app.route('/api/changes', methods=['POST'])
+def get_changes():
+    body, error = check_schema(CHANGES, request)
+    if error:
+        return error
 
-    token: Token = request.json['token']
+    token: Token = body['token']
     tok_check = check_token(token)
     if not tok_check[0]:
         return tok_check[1]
 
-    from ESSBackend.models import EntertainmentUsage
-
-    entertainment = EntertainmentUsage.query.filter(
-        cast(EntertainmentUsage.date, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        EntertainmentUsage.email == request.json['token']['email']
-    ).first()
-
-    if entertainment:
-        entertainmentContent = {'hours': entertainment.hours}
-    else:
-        entertainmentContent = {'hours': 0}
-
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning entertainment usage for {request.json['date']}",
-                'content': entertainmentContent
-            }
-        )
+    from ESSBackend.resources import resources, select_changes
+
+    since = body.get('since', 0)
+    if 'since' in request.args:
+        # a value that isn't a number stays a string, rejected by the schema with its usual message
+        args, errors = SINCE.validate({'since': request.args.get('since', '', type=int)})
+        if errors:
+            return schema_error(errors)
+        since = args['since']
+    limit = max(min(body.get('limit', app.config['RANGE_LIMIT']), app.config['RANGE_LIMIT']), 1)
+    query = select_changes(list(resources.values()), token['email'], since, limit)
+
+    page = {'count': 0, 'since': since}
+
+    def changes():
+        for row in db.execute(query.execution_options(stream_results=True)):
+            page['count'], page['since'] = page['count'] + 1, row.changeSeq
+            change = {'type': row.resource, 'seq': row.changeSeq}
+            if row['key'] is not None:
+                change.update(key=json.loads(row['key']), deleted=True)
+            else:
+                resource = resources[row.resource]
+                content = resource.view().serialize_range(row)
+                change.update(key=resource.encode_key(row), content=content)
+            yield change
+
+    def cursor():
+        # `since` is what to pass next time; a full page may have more changes after it
+        return {'since': page['since'], 'more': page['count'] == limit}
+
+    return stream_list(f'Returning changes since {since}', changes(), cursor)
+
+
+# ----- Search Functions
+
+
+@app.route('/api/journal/search', methods=['POST'])
+def search_journals():
+    body, error = check_request(SEARCH, request)
+    if error:
+        return error
+
+    from ESSBackend.resources import resources
+    from ESSBackend.search import entries, search
+
+    view, error = read_view(resources['journal'], body.get('fields'), 'fields')
+    if error:
+        return error
+
+    email, query = body['token']['email'], body['query']
+    offset = max(body.get('offset', 0), 0)
+    limit = max(min(body.get('limit', app.config['SEARCH_LIMIT']), app.config['SEARCH_LIMIT']), 1)
+    ranked = search(email, query, offset, limit)
+    rows = entries(view, email, [title for title, _ in ranked]) if ranked else {}
+    return api_response(
+        {
+            'result': True,
+            'message': f'Returning journal entries matching "{query}"',
+            'list': [
+                dict(view.serialize(rows[title]), rank=rank)
+                for title, rank in ranked if title in rows
+            ],
+            # the offset of the next page, if this one was full
+            'offset': offset + limit if len(ranked) == limit else None
+        }
     )
 
 
-@app.route('/api/entertainment/new', methods=['POST'])
-def post_Entertainment():
-    requirements = [
-        ('content', ['hours']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
-
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+# ----- Utility Functions
 
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
 
-    from ESSBackend.models import EntertainmentUsage
-
-    entertainment: EntertainmentUsage = EntertainmentUsage.query.filter_by(
-        email=request.json['token']['email'],
-        date=request.json['metadata']['timestamp'],  # TODO: timestamp equality
-    ).first()
-
-    if entertainment:
-        entertainment.hours = request.json['content']['hours']
-        db.commit()
-        return make_response(
-            jsonify({
-                'result': True,
-                'message': 'Updated existing entertainment entry.'
-            })
-        )
-    else:
-        new_entertainment: EntertainmentUsage = EntertainmentUsage(
-            email=request.json['token']['email'],
-            date=request.json['metadata']['timestamp'],
-            hours=request.json['content']['hours'],
-        )
-        db.add(new_entertainment)
-        db.commit()
-        return make_response(
-            jsonify({
-                'result': True,
-                'message': 'Inserted new entertainment entry.'
-            })
-        )
+def parse_day(date: str):
+    return datetime.strptime(date, "%Y-%m-%d").date()
 
 
-# ----- Health Functions
-@app.route('/api/health', methods=['POST'])
-def get_health():
-    requirements = [
-        ('date', []),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
+def day_range(day: date):
+    # Half-open [day, day + 1) bounds. Comparing the bare column against these
+    # (rather than casting it to a date) lets postgres use the (email, timestamp) index.
+    start = datetime.combine(day, time())
+    return (start, start + timedelta(days=1))
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
 
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
+def check_token(token: Dict[str, str]):
+    error = verify_token(token)
+    if error:
+        return (False, api_response({'result': False, 'message': error}))
+    return (True, None)
 
-    from ESSBackend.models import Health
 
-    health = Health.query.filter(
-        cast(Health.date, Date) == datetime.strptime(request.json['date'], "%Y-%m-%d"),
-        Health.email == request.json['token']['email']
-    ).first()
+def read_schema(request) -> Schema:
+    # reads take either a single date or an inclusive start/end range
+    body = request_body(request)
+    return RANGE_READ if isinstance(body, dict) and 'start' in body else DAY_READ
+
+
+def read_records(resource, body):
+    view, error = read_view(resource, body.get('fields'), 'fields')
+    if error:
+        return error
+    if 'start' in body:
+        return read_range(view, body)
+    return read_day(view, body)
+
+
+def read_view(resource, fields, path: str):
+    """The resource's view of the requested fields (see resources.py), or a 400 response."""
+    known = ', '.join(list(resource.fields) + list(resource.constant))
+    if fields is not None and not (
+        isinstance(fields, list) and all(isinstance(f, str) for f in fields)
+    ):
+        message = f'Invalid field: {path} (expected a list of: {known})'
+        return (None, schema_error([{'field': path, 'message': message}]))
+    try:
+        return (resource.view(fields), None)
+    except ValueError as e:
+        message = f'Invalid field: {path} (unknown fields: {e}; expected some of: {known})'
+        return (None, schema_error([{'field': path, 'message': message}]))
+
+
+def read_range(view, body):
+    resource = view.resource
+    email, start, end = body['token']['email'], body['start'], body['end']
+    limit = max(min(body.get('limit', app.config['RANGE_LIMIT']), app.config['RANGE_LIMIT']), 1)
+    try:
+        after = resource.decode_cursor(body['cursor']) if 'cursor' in body else None
+    except ValueError:
+        return api_response({'result': False, 'message': 'Invalid cursor'})
+
+    page = {'count': 0, 'last': None}
+
+    def records():
+        for row in view.fetch_range(email, start, end, after, limit):
+            page['count'], page['last'] = page['count'] + 1, row
+            yield view.serialize_range(row)
+
+    def cursor():
+        # a full page may have more rows after it
+        next_cursor = resource.encode_cursor(page['last']) if page['count'] == limit else None
+        return {'cursor': next_cursor}
+
+    message = f'Returning {resource.name} records from {start} to {end}'
+    return stream_list(message, records(), cursor)
+
+
+def stream_list(message: str, items, tail: Callable[[], Dict]):
+    """A streamed {result, message, list, **tail()} response.
+
+    `items` is encoded into the list in chunks as it's consumed, so memory stays flat however
+    many there are (MessagePack, which needs the count up front, holds them encoded until
+    the end); `tail` is called once they're exhausted.
+    """
+    format = response_format()
+    head = {'result': True, 'message': message}
+    generate = format.stream(head, 'list', items, tail)
+    response = Response(stream_with_context(generate), mimetype=format.mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def response_format():
+    """The format the client asked for in its Accept header; JSON by default."""
+    return negotiate(request.accept_mimetypes)
+
+
+def api_response(value, status: int = 200, headers: Dict[str, str] = None) -> Response:
+    """A response encoded in the format the client accepts (see encoder.py)."""
+    format = response_format()
+    response = app.response_class(
+        format.dumps(value), status=status, headers=headers, mimetype=format.mimetype
+    )
+    response.vary.add('Accept')
+    return response
 
-    if health:
-        healthContent = {'cigarettes': health.cigarettes}
-    else:
-        healthContent = {'cigarettes': 0}
 
-    return make_response(
-        jsonify(
-            {
-                'result': True,
-                'message': f"Returning health  for {request.json['date']}",
-                'content': healthContent
-            }
-        )
+def request_body(request):
+    """The request's body, decoded per its Content-Type (JSON by default); None if it can't be."""
+    if 'body' not in g:
+        format = content_types.get(request.mimetype)
+        if format is None:
+            g.body = request.get_json(silent=True)
+        else:
+            try:
+                g.body = format.loads(request.get_data(cache=False))
+            except ValueError:
+                g.body = None
+    return g.body
+
+
+def read_day(view, body):
+    from ESSBackend.revisions import etag, revision
+
+    resource = view.resource
+    email, day = body['token']['email'], body['date']
+    format = response_format()
+    current = revision(email, day)
+    tag = etag(view.name, day, current, format.name)
+    if request.if_none_match.contains(tag):
+        # the client's copy is current, so no rows are loaded
+        response = app.response_class(status=304)
+        response.set_etag(tag)
+        response.vary.add('Accept')
+        return response
+
+    # keyed by revision, so a write makes older entries unreachable rather than stale
+    key = ResponseCache.key(email, view.name, day.isoformat(), current, format.name)
+    cached = response_cache.get(key) if response_cache else None
+    if cached is not None:
+        response = app.response_class(cached, mimetype=format.mimetype)
+        response.set_etag(tag)
+        response.vary.add('Accept')
+        return response
+
+    rows = view.fetch_day(email, day)
+    response = api_response(
+        {
+            'result': True,
+            'message': resource.read_message.format(date=day),
+            'list' if resource.empty is None else 'content': view.serialize_day(rows)
+        }
+    )
+    if response_cache:
+        response_cache.set(key, response.get_data())
+    response.set_etag(tag)
+    return response
+
+
+def write_record(resource, body):
+    from ESSBackend.changes import stamp, stamped
+    from ESSBackend.revisions import bump
+    from ESSBackend.scorecard import day_of, refresh
+    from ESSBackend.search import index
+    from ESSBackend.upsert import upsert
+
+    email, content = body['token']['email'], body['content']
+    row = resource.row(email, content, body['metadata'])
+    stamp([row])
+    # the stored day column, since a journal edit keeps its original creation day
+    inserted, day = upsert(
+        resource.model, row, stamped(resource.update(content)), returning=[resource.day_column]
     )
+    day = day_of(day)
+    refresh(resource, email, day)
+    index(resource, email, [row])
+    bump([(email, day)])
+    db.commit()
 
+    return api_response({'result': True, 'message': resource.inserted_message(inserted)})
 
-@app.route('/api/health/new', methods=['POST'])
-def post_health():
-    requirements = [
-        ('content', ['cigarettes']),
-        ('metadata', ['timestamp']),
-        ('token', ['hash', 'expiry', 'email']),
-    ]
 
-    req_check = check_requirements(requirements, request)
-    if not req_check[0]:
-        return req_check[1]
+def check_record(record, resources):
+    """The record's typed values, or the errors that reject it (see check_schema)."""
+    from ESSBackend.resources import record_schemas
 
-    token: Token = request.json['token']
-    tok_check = check_token(token)
-    if not tok_check[0]:
-        return tok_check[1]
+    if not isinstance(record, dict) or record.get('type') not in resources:
+        return (None, [{'field': 'type', 'message': 'Unknown record type'}])
+    return record_schemas[record['type']].validate(record)
 
-    from ESSBackend.models import Health
 
-    health: Health = Health.query.filter_by(
-        email=request.json['token']['email'],
-        date=request.json['metadata']['timestamp'],  # TODO: timestamp equality
-    ).first()
+def check_request(schema: Schema, request):
+    """The typed body of a request carrying a valid token, or the response rejecting it."""
+    body, error = check_schema(schema, request)
+    if error:
+        return (None, error)
+    tok_check = check_token(body['token'])
+    if not tok_check[0]:
+        return (None, tok_check[1])
+    return (body, None)
 
-    if health:
-        health.cigarettes = request.json['content']['cigarettes']
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Updated existing health entry.'}))
-    else:
-        new_health: Health = Health(
-            email=request.json['token']['email'],
-            date=request.json['metadata']['timestamp'],
-            cigarettes=request.json['content']['cigarettes'],
-        )
-        db.add(new_health)
-        db.commit()
-        return make_response(jsonify({'result': True, 'message': 'Inserted new health entry.'}))
 
+def check_schema(schema: Schema, request):
+    """The request's typed body, or a 400 response listing what's wrong with it."""
+    raw = request_body(request)
+    if raw is None:
+        return (None, schema_error([{'field': '', 'message': 'Where\'s the JSON?'}]))
 
-# ----- Utility Functions
+    body, errors = schema.validate(raw)
+    if errors:
+        return (None, schema_error(errors))
+    return (body, None)
 
 
-def check_token(token: Dict[str, str]):
-    # TODO: Token expiry
-    new_hash = hashlib.sha256(
-        (token['expiry'] + token['email'] + app.config['SECRET_KEY']).encode('utf-8')
-    ).hexdigest()
-
-    return (
-        token['hash'] == new_hash,
-        make_response(jsonify({
+def schema_error(errors: List[Dict[str, str]]):
+    return api_response(
+        {
             'result': False,
-            'message': f'Invalid Token Hash: {new_hash}'
-        }))
+            'message': errors[0]['message'],
+            'errors': errors
+        }, 400
     )
 
 
-def check_requirements(requirements: List[str], request):
-    if not request.json:
-        return (False, make_response(jsonify({'result': False, 'message': 'Where\'s the JSON?'})))
-
-    for req in requirements:
-        if req[0] not in request.json:
-            return (
-                False,
-                make_response(
-                    jsonify({
-                        'result': False,
-                        'message': f'Missing required field: {req}'
-                    })
-                )
-            )
-        for subreq in req[1]:
-            if subreq not in request.json[req[0]]:
-                return (False, make_response(jsonify({
-                            'result': False,
-                            'message': f'Missing required field: {req}.{subreq}'
-                        })))  # yapf:disable
-
-    return (True, None)
-
-
 def return_token(email: str):
-    now = (datetime.utcnow()).isoformat()[:-7]
-    hmac = hashlib.sha256((str(now) + email + app.config['SECRET_KEY']).encode('utf-8'))
-
-    return make_response(
-        jsonify(
-            {
-                'token': {
-                    'hash': hmac.hexdigest(),
-                    'email': email,
-                    'expiry': now  # TODO: send actual expiry
-                },
-                'result': True,
-                'message': 'Successful Login'
-            }
-        )
+    return api_response(
+        {
+            'token': issue_token(email),
+            'result': True,
+            'message': 'Successful Login'
+        }
     )
 
 
 # ----- Error Handling
 @app.errorhandler(404)
 def not_found(error):
-    return make_response(jsonify({'result': False, 'message': 'Not found'}), 404)
+    return api_response({'result': False, 'message': 'Not found'}, 404)
+
+
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(error):
+    return api_response(
+        {
+            'result': False,
+            'message': 'Server busy, try again shortly'
+        }, 503, {'Retry-After': str(app.config['BCRYPT_RETRY_AFTER'])}
+    )
+
+
+# the registry (resources.py) registers the category routes as it is imported
+import ESSBackend.resources
 
 
 def main():
@@ -0,0 +1,96 @@
+# Read-through cache for per-day read responses.
+#
+# Entries are the encoded body of a read, keyed by (email, category, date, revision, format).
+# Writers bump the day's revision (see revisions.py), so entries for older revisions are
+# never read again and just age out; nothing has to be invalidated.
+#
+# Two backends are available:
+# - 'local': an LRU inside the worker process, bounded by size and TTL.
+# - 'uwsgi': uwsgi's shared-memory cache, shared by every worker of the instance.
+#   Needs a cache configured in uwsgi (e.g. cache2 = name=responses,items=10000).
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+import time
+
+
+class LocalBackend(object):
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries: Dict[str, Tuple[float, bytes]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+class UwsgiBackend(object):
+    def __init__(self, name: str, ttl: float):
+        import uwsgi
+        self._uwsgi = uwsgi
+        self.name = name
+        self.ttl = int(ttl)
+        self.evictions = 0  # uwsgi evicts on its own; not observable from here
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._uwsgi.cache_get(key, self.name)
+
+    def set(self, key: str, value: bytes):
+        self._uwsgi.cache_update(key, value, self.ttl, self.name)
+
+
+class ResponseCache(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(email: str, category: str, date: str, revision: int, format: str) -> str:
+        return f'{email}\x1f{category}\x1f{date}\x1f{revision}\x1f{format}'
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.backend.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.backend.evictions}
+
+    @staticmethod
+    def from_config(config) -> Optional['ResponseCache']:
+        """The cache selected by RESPONSE_CACHE, or None when caching is off."""
+        if config['RESPONSE_CACHE'] == 'local':
+            backend = LocalBackend(config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_TTL'])
+        elif config['RESPONSE_CACHE'] == 'uwsgi':
+            backend = UwsgiBackend(config['RESPONSE_CACHE_NAME'], config['RESPONSE_CACHE_TTL'])
+        else:
+            return None
+        return ResponseCache(backend)
@@ -0,0 +1,118 @@
+# Change sequence numbers for delta sync.
+#
+# Every row written to a category table is stamped with the next value of the global
+# change_seq sequence, and every delete leaves a tombstone stamped the same way.
+# /api/changes then returns just what a user changed after the last sequence number
+# their client saw, read from the (email, changeSeq) index of each table.
+#
+# A client only ever asks about its own user, so sequence numbers must reach the tables
+# in order per user: a writer takes a per-user lock (held until commit) before drawing
+# them, so a later number can't commit before an earlier one and be skipped over.
+#
+# `python -m ESSBackend.changes` stamps rows written before changeSeq existed.
+
+from ESSBackend.app import db
+from ESSBackend.models import Tombstone, change_seq
+from ESSBackend.resources import Resource, resources
+from ESSBackend.upsert import upsert
+from itertools import count
+from sqlalchemy import and_, func, select
+from threading import Lock
+from typing import Any, Callable, Dict, List
+
+import json
+
+# sqlite has no sequences; it's only used by a single local process, so a counter will do
+_counter = None
+_counter_lock = Lock()
+
+
+def _postgres() -> bool:
+    return db.get_bind().dialect.name == 'postgresql'
+
+
+def next_seqs(emails: List[str], n: int) -> List[int]:
+    """`n` new sequence numbers for a write to the given users. The caller commits."""
+    global _counter
+    if _postgres():
+        for email in sorted(set(emails)):
+            db.execute(select([func.pg_advisory_xact_lock(func.hashtext(email))]))
+        query = select([change_seq.next_value()]).select_from(func.generate_series(1, n))
+        return [seq for seq, in db.execute(query)]
+
+    with _counter_lock:
+        if _counter is None:
+            _counter = count(_max_seq() + 1)
+        return [next(_counter) for _ in range(n)]
+
+
+def _max_seq() -> int:
+    tables = [r.model.__table__ for r in resources.values()] + [Tombstone.__table__]
+    return max(db.execute(select([func.max(t.c.changeSeq)])).scalar() or 0 for t in tables)
+
+
+def stamp(rows: List[Dict[str, Any]]):
+    """Set changeSeq on rows about to be upserted."""
+    for row, seq in zip(rows, next_seqs([row['email'] for row in rows], len(rows))):
+        row['changeSeq'] = seq
+
+
+_stamped = {}  # update -> its stamped version, so upsert's statement cache sees one function
+
+
+def stamped(update: Callable) -> Callable:
+    """An upsert SET clause that also takes the new changeSeq.
+
+    The default clause (None) already overwrites every column in the row.
+    """
+    if update is None:
+        return None
+    if update not in _stamped:
+        _stamped[update] = \
+            lambda table, excluded: dict(update(table, excluded), changeSeq=excluded['changeSeq'])
+    return _stamped[update]
+
+
+def delete(resource: Resource, email: str, key: Dict[str, Any]):
+    """Delete a row and leave its tombstone, returning the row's day column (None if missing).
+
+    The caller commits.
+    """
+    tombstone = {
+        'email': email,
+        'resource': resource.name,
+        'key': json.dumps(resource.encode_key(key), sort_keys=True),
+    }
+    # stamped first, so the per-user lock is taken before any row lock, as writers do
+    stamp([tombstone])
+
+    table = resource.model.__table__
+    match = and_(table.c.email == email, *[table.c[c] == value for c, value in key.items()])
+    day = db.execute(select([table.c[resource.day_column]]).where(match)).scalar()
+    if day is None:
+        return None
+
+    db.execute(table.delete().where(match))
+    upsert(Tombstone, tombstone)
+    return day
+
+
+def backfill():
+    """Stamp every row that predates changeSeq (left at 0), so a full sync returns it."""
+    for resource in resources.values():
+        table = resource.model.__table__
+        if _postgres():
+            unstamped = table.update().where(table.c.changeSeq == 0)
+            db.execute(unstamped.values(changeSeq=change_seq.next_value()))
+            continue
+
+        keys = list(table.primary_key.columns)
+        rows = db.execute(select(keys).where(table.c.changeSeq == 0)).fetchall()
+        for row, seq in zip(rows, next_seqs([], len(rows))):
+            match = and_(*[c == row[c.name] for c in keys])
+            db.execute(table.update().where(match).values(changeSeq=seq))
+    db.commit()
+
+
+if __name__ == '__main__':
+    backfill()
@@ -0,0 +1,79 @@
+# Write coalescing for rapid-fire increments (e.g. water cup taps).
+#
+# The first increment to arrive opens a batch and waits out a short window;
+# increments arriving meanwhile (from other threads in the same worker)
+# are summed per key into that batch. The opening request then flushes the
+# whole batch as a single statement, and every contributor returns once it commits.
+# This only pays off when uwsgi runs the worker with several threads.
+
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable
+
+import time
+
+
+class _Batch(object):
+    def __init__(self):
+        self.totals: Dict[Hashable, int] = {}
+        self.done = Event()
+        self.result: Dict[Hashable, bool] = None
+        self.error: Exception = None
+
+
+class IncrementCoalescer(object):
+    """Sums increments per key over `window` seconds and writes them with one `flush` call.
+
+    `flush(totals)` receives {key: summed increment} and returns {key: inserted}.
+    """
+
+    def __init__(self, window: float, flush: Callable[[Dict[Hashable, int]], Dict[Hashable, bool]]):
+        self.window = window
+        self.flush = flush
+        self._lock = Lock()
+        self._batch: _Batch = None
+
+        self.increments = 0  # increments received
+        self.flushes = 0  # statements issued
+        self.rows = 0  # rows written by those statements
+
+    def add(self, key: Hashable, amount: int) -> bool:
+        """Queue an increment and wait for it to be written.
+
+        Returns True if this increment created the row.
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            first = key not in batch.totals
+            batch.totals[key] = batch.totals.get(key, 0) + amount
+            self.increments += 1
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                self._batch = None
+                self.flushes += 1
+                self.rows += len(batch.totals)
+            try:
+                batch.result = self.flush(batch.totals)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error:
+            raise batch.error
+        # only the first increment for a key can have inserted it
+        return first and batch.result[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'increments': self.increments,
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'ratio': self.increments / self.flushes if self.flushes else 0.0
+        }
@@ -0,0 +1,172 @@
+# Compressed storage for long text columns (journal contents).
+#
+# With JOURNAL_COMPRESSION set, journals.content is stored as bytes: UTF-8, compressed with
+# zlib or zstd once it reaches JOURNAL_COMPRESSION_THRESHOLD bytes. Compressed values start
+# with a marker, b'\xff' and the codec's id, which UTF-8 text can never start with, so rows
+# written before compression was turned on (or below the threshold) are read back as they are.
+# The model column does all of this, so nothing above it sees bytes.
+#
+# `python -m ESSBackend.compressed` moves an existing table over: on postgres it changes the
+# column from text to bytea, then it compresses the rows already there, a batch at a time.
+
+from sqlalchemy import LargeBinary, Text, and_, inspect, or_, select, type_coerce
+from sqlalchemy.types import TypeDecorator
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+import argparse
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MARKER = b'\xff'
+
+
+class Codec(NamedTuple):
+    id: bytes
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    if zstandard is None:
+        raise RuntimeError('A value is zstd compressed, but zstandard is not installed')
+    # the compressor always records the content size, so no output buffer size is needed
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=9).compress(data)
+
+
+codecs: Dict[str, Codec] = {
+    'zlib': Codec(b'z', lambda data: zlib.compress(data, 6), zlib.decompress),
+    'zstd': Codec(b's', _zstd_compress, _zstd_decompress),
+}
+_by_id = {codec.id: codec for codec in codecs.values()}
+
+
+class _Stored(LargeBinary):
+    """LargeBinary, except that it reads back text as it is.
+
+    sqlite keeps values written while the column held text (before compression was turned on)
+    as text, and returns them as str, which LargeBinary would fail to convert.
+    """
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None or isinstance(value, str):
+                return value
+            return bytes(value)
+
+        return process
+
+
+class CompressedText(TypeDecorator):
+    """Text stored as UTF-8 bytes, compressed when at least `threshold` bytes long.
+
+    Any value is read back, whatever codec (if any) it was written with.
+    """
+    impl = _Stored
+
+    def __init__(self, codec: str = 'zlib', threshold: int = 512):
+        super().__init__()
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        self.codec = codecs[codec]
+        self.threshold = threshold
+
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return compress(value.encode('utf-8'), self.codec, self.threshold)
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        return decompress(value).decode('utf-8')
+
+    @staticmethod
+    def from_config(config) -> Any:
+        """The column type selected by JOURNAL_COMPRESSION: CompressedText, or Text when off."""
+        if not config['JOURNAL_COMPRESSION']:
+            return Text
+        return CompressedText(
+            config['JOURNAL_COMPRESSION'], config['JOURNAL_COMPRESSION_THRESHOLD']
+        )
+
+
+def compress(data: bytes, codec: Codec, threshold: int) -> bytes:
+    if len(data) < threshold:
+        return data
+    compressed = MARKER + codec.id + codec.compress(data)
+    # short or already dense text can come out larger
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress(data: bytes) -> bytes:
+    if data[:1] != MARKER:
+        return data
+    return _by_id[data[1:2]].decompress(data[2:])
+
+
+def migrate(batch: int = 500):
+    """Store journals.content as bytes, and compress the rows long enough to be.
+
+    Rows compressed with another codec are recompressed, so this also switches codecs.
+    """
+    from ESSBackend.app import db
+    from ESSBackend.models import JournalEntry
+
+    column_type = JournalEntry.__table__.c.content.type
+    if not isinstance(column_type, CompressedText):
+        raise SystemExit('Set JOURNAL_COMPRESSION to compress journal contents')
+
+    if db.get_bind().dialect.name == 'postgresql':
+        columns = inspect(db.get_bind()).get_columns('journals')
+        if not isinstance(next(c for c in columns if c['name'] == 'content')['type'], LargeBinary):
+            db.execute(
+                "ALTER TABLE journals ALTER COLUMN content TYPE bytea "
+                "USING convert_to(content, 'UTF8')"
+            )
+            db.commit()
+
+    table = JournalEntry.__table__
+    # the stored bytes, without the column type's decompression
+    stored = type_coerce(table.c.content, _Stored).label('stored')
+    current = MARKER + column_type.codec.id
+    after, compressed = None, 0
+    while True:
+        # keyset pagination over the primary key; each batch is its own transaction
+        query = select([table.c.email, table.c.title, stored])
+        if after:
+            query = query.where(
+                or_(
+                    table.c.email > after[0],
+                    and_(table.c.email == after[0], table.c.title > after[1])
+                )
+            )
+        rows = db.execute(query.order_by(table.c.email, table.c.title).limit(batch)).fetchall()
+        if not rows:
+            break
+        for email, title, value in rows:
+            value = value.encode('utf-8') if isinstance(value, str) else value
+            if value.startswith(current):
+                continue
+            packed = compress(decompress(value), column_type.codec, column_type.threshold)
+            if packed != value:
+                match = (table.c.email == email) & (table.c.title == title)
+                packed = type_coerce(packed, LargeBinary)  # already encoded
+                db.execute(table.update().where(match).values(content=packed))
+                compressed += 1
+        db.commit()
+        after = rows[-1][:2]
+    print(f'Compressed {compressed} journal entries')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=migrate.__doc__)
+    parser.add_argument('--batch', type=int, default=500, help='rows per transaction')
+    migrate(parser.parse_args().batch)
@@ -2,6 +2,8 @@
 
 import os
 
+from datetime import timedelta
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -9,7 +11,54 @@ class Config(object):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URI']
     SECRET_KEY = os.environ['ESS_SECRET']
-    TOKEN_TIMEOUT = "???"  # set this to a timedelta
+    # previous secrets, comma separated; tokens they signed stay valid until expiry
+    OLD_SECRET_KEYS = [key for key in os.environ.get('ESS_OLD_SECRETS', '').split(',') if key]
+    TOKEN_TIMEOUT = timedelta(days=30)
+    TOKEN_CACHE_SIZE = 4096  # verified tokens remembered per worker
+    TOKEN_REVOCATION_SYNC = 5  # seconds between re-reading revocations from the database
+
+    BCRYPT_ROUNDS = 12  # existing hashes are migrated to this cost on login
+    # hashes run at once across every uwsgi worker, beyond which logins get a 503; keep it below
+    # uwsgi's `processes`, so logins can't occupy every worker (see passwords.py)
+    BCRYPT_SLOTS = 2
+    # where the workers share those slots; None bounds each process on its own
+    BCRYPT_DIR = os.environ.get('ESS_BCRYPT_DIR')
+    BCRYPT_RETRY_AFTER = 2  # seconds
+
+    # batch window for concurrent water increments within a worker; 0 disables coalescing
+    WATER_COALESCE_MS = 0
+
+    # per-day read cache: 'local' (per process), 'uwsgi' (shared by the workers), or None
+    RESPONSE_CACHE = 'local'
+    RESPONSE_CACHE_NAME = 'responses'  # uwsgi cache name
+    RESPONSE_CACHE_SIZE = 10000  # entries, for the local cache
+    RESPONSE_CACHE_TTL = 300  # seconds
+
+    # journal contents stored compressed: 'zlib', 'zstd' (needs zstandard), or None for plain text.
+    # Turning it on changes the column type; run `python -m ESSBackend.compressed` to migrate.
+    JOURNAL_COMPRESSION = None
+    JOURNAL_COMPRESSION_THRESHOLD = 512  # bytes of UTF-8; shorter contents are stored as-is
+
+    # per-route request and database metrics, served at /api/metrics (see metrics.py)
+    METRICS = False
+    # when set, /api/metrics needs `Authorization: Bearer <key>`; otherwise it's served only
+    # to requests from this host
+    METRICS_KEY = os.environ.get('ESS_METRICS_KEY')
+    # where uwsgi workers write their metrics, to be added up; None serves just the answering one's
+    METRICS_DIR = os.environ.get('ESS_METRICS_DIR')
+    METRICS_FLUSH = 5  # seconds between a worker's writes
+
+    # where per-request profiles are written (see profiler.py); None turns profiling off
+    PROFILE_DIR = os.environ.get('ESS_PROFILE_DIR')
+    PROFILE_KEY = os.environ.get('ESS_PROFILE_KEY')  # profiles requests with `X-ESS-Profile: <key>`
+    PROFILE_SAMPLE = 0.0  # fraction of all requests profiled
+    PROFILE_KEEP = 200  # profiles kept; older ones are deleted
+
+    RANGE_LIMIT = 10000  # rows per page of a start/end range read
+    SEARCH_LIMIT = 50  # results per page of a journal search
+    SYNC_MAX_RECORDS = 500  # records accepted by one /api/sync request
+    IMPORT_CHUNK = 1000  # records written per transaction by an import (see importer.py)
+    IMPORT_MAX_ERRORS = 100  # rejected records an import reports
 
     # significant performance impact & not needed
     SQLALCHEMY_TRACK_MODIFICATIONS = False
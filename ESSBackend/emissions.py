@@ -0,0 +1,118 @@
+# Carbon footprint of commutes and food, in kg CO2e.
+#
+# Footprints are computed over whole columns at once: a query's rows are fetched as the
+# driver's plain tuples and turned into NumPy arrays, every row is priced with one coefficient
+# lookup per distinct label, and per-day totals come from a single bincount. The driver's
+# tuples are the only per-row Python objects; pricing and grouping are vectorized.
+
+from ESSBackend.app import db
+from ESSBackend.resources import resources
+from sqlalchemy import select
+from datetime import date
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# kg CO2e per mile of Commute.distance, per passenger
+COMMUTE_COEFFICIENTS = {
+    'car': 0.404,
+    'carpool': 0.202,
+    'motorcycle': 0.21,
+    'bus': 0.18,
+    'train': 0.14,
+    'subway': 0.10,
+    'plane': 0.25,
+    'scooter': 0.03,
+    'bike': 0.0,
+    'walk': 0.0,
+}
+COMMUTE_DEFAULT = COMMUTE_COEFFICIENTS['car']
+
+# kg CO2e per unit of Food.quantity, taken as one serving
+FOOD_COEFFICIENTS = {
+    'beef': 6.0,
+    'lamb': 2.4,
+    'cheese': 2.1,
+    'pork': 0.7,
+    'meat': 1.5,
+    'poultry': 0.6,
+    'fish': 0.5,
+    'seafood': 0.5,
+    'eggs': 0.45,
+    'dairy': 0.3,
+    'grains': 0.15,
+    'vegetables': 0.1,
+    'fruit': 0.1,
+    'legumes': 0.1,
+    'nuts': 0.05,
+}
+FOOD_DEFAULT = 0.5
+
+
+def coefficients(labels: Sequence, table: Dict[str, float], default: float) -> np.ndarray:
+    """A coefficient for every label, matched case-insensitively.
+
+    Only distinct labels are looked up; the rest is a vectorized gather.
+    """
+    distinct, inverse = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+    priced = np.array([table.get(label.lower(), default) for label in distinct], dtype=float)
+    return priced[inverse]
+
+
+def commute_emissions(methods: Sequence, distances: Sequence) -> np.ndarray:
+    return coefficients(methods, COMMUTE_COEFFICIENTS, COMMUTE_DEFAULT) * \
+        np.nan_to_num(np.asarray(distances, dtype=float))
+
+
+def food_emissions(categories: Sequence, quantities: Sequence) -> np.ndarray:
+    return coefficients(categories, FOOD_COEFFICIENTS, FOOD_DEFAULT) * \
+        np.nan_to_num(np.asarray(quantities, dtype=float))
+
+
+def totals_by(keys: List[np.ndarray], values: np.ndarray) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Sum `values` grouped by one or more key columns.
+
+    Returns the distinct key combinations (one array per key column) and their sums.
+    """
+    code = np.zeros(len(values), dtype=np.int64)
+    for key in keys:
+        distinct, inverse = np.unique(key, return_inverse=True)
+        code = code * len(distinct) + inverse
+    groups, first, inverse = np.unique(code, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(groups))
+    return [key[first] for key in keys], sums
+
+
+def _columns(query, count: int) -> List[np.ndarray]:
+    # straight from the DBAPI cursor, skipping SQLAlchemy's row objects and result processing
+    result = db.execute(query)
+    rows = result.cursor.fetchall()
+    result.close()
+    if not rows:
+        return [np.array([]) for _ in range(count)]
+    return [np.array(column) for column in zip(*rows)]
+
+
+def footprint(email: str, start: date, end: date) -> List[Dict]:
+    """Per-day commute and food emissions for a user between two inclusive dates."""
+    commute, food = resources['commute'], resources['food']
+    ct, ft = commute.model.__table__, food.model.__table__
+
+    query = select([commute.day(), ct.c.method, ct.c.distance])
+    days, methods, distances = _columns(query.where(commute.on_days(email, start, end)), 3)
+    (commute_days, ), commute_totals = totals_by([days], commute_emissions(methods, distances))
+
+    query = select([food.day(), ft.c.category, ft.c.quantity])
+    days, categories, quantities = _columns(query.where(food.on_days(email, start, end)), 3)
+    (food_days, ), food_totals = totals_by([days], food_emissions(categories, quantities))
+
+    by_day = {}
+    for day, total in zip(commute_days, commute_totals):
+        by_day.setdefault(str(day), {'commute': 0.0, 'food': 0.0})['commute'] = float(total)
+    for day, total in zip(food_days, food_totals):
+        by_day.setdefault(str(day), {'commute': 0.0, 'food': 0.0})['food'] = float(total)
+
+    return [
+        dict(date=day, total=totals['commute'] + totals['food'], **totals)
+        for day, totals in sorted(by_day.items())
+    ]
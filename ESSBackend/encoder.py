@@ -0,0 +1,171 @@
+# Encodings for request and response bodies.
+#
+# JSON is the default. Clients can ask for MessagePack or CBOR instead, which are smaller
+# and cheaper to parse, with `Accept: application/msgpack` or `application/cbor`, and send
+# bodies in them with the matching Content-Type. Each is offered only when its package
+# (msgpack, cbor2) is installed; JSON uses orjson when that is installed, and the json
+# module otherwise.
+#
+# Every format writes dates and datetimes as ISO 8601 strings ('2018-05-01',
+# '2018-05-01T08:30:00'), so read serializers can hand column values over as they come
+# out of a query, and clients parse the same values whatever the format.
+
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class Format(NamedTuple):
+    name: str
+    mimetype: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]  # raises ValueError for a malformed body
+    # (head, name, items, tail) -> the encoding of {**head, name: [*items], **tail()},
+    # produced piecewise as `items` is consumed; tail is called once they're exhausted
+    stream: Callable[[Dict, str, Iterable, Callable[[], Dict]], Iterator[bytes]]
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not serializable')
+
+
+def _pairs(dumps: Callable[[Any], bytes], mapping: Dict) -> bytes:
+    """A map's entries, as keys and values encoded one after the other."""
+    return b''.join(dumps(k) + dumps(v) for k, v in mapping.items())
+
+
+def _chunks(items: Iterable, size: int = 100) -> Iterator[List]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ----- JSON
+
+if orjson is not None:
+
+    def _json_dumps(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default)
+
+    _json_loads = orjson.loads
+
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def _json_dumps(value: Any) -> bytes:
+        return _encoder.encode(value).encode('utf-8')
+
+    _json_loads = json.loads
+
+
+def _json_stream(head, name, items, tail):
+    # the head object, reopened to add the list; each chunk is encoded as one array,
+    # without its brackets
+    yield _json_dumps(head)[:-1] + b',' + _json_dumps(name) + b':['
+    separator = b''
+    for chunk in _chunks(items):
+        yield separator + _json_dumps(chunk)[1:-1]
+        separator = b','
+    yield b']' + b''.join(b',' + _json_dumps({k: v})[1:-1] for k, v in tail().items()) + b'}'
+
+
+JSON = Format('json', 'application/json', _json_dumps, _json_loads, _json_stream)
+
+# ----- MessagePack
+
+if msgpack is not None:
+
+    def _msgpack_dumps(value: Any) -> bytes:
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    def _msgpack_loads(data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except msgpack.UnpackException as e:
+            raise ValueError(e)
+
+    def _msgpack_stream(head, name, items, tail):
+        # maps and arrays are prefixed with their length, so the items are encoded as they
+        # come but sent once they're all counted
+        encoded, count = [], 0
+        for chunk in _chunks(items):
+            encoded.extend(map(_msgpack_dumps, chunk))
+            count += len(chunk)
+        tail = tail()
+        packer = msgpack.Packer()
+        yield packer.pack_map_header(len(head) + 1 + len(tail)) + \
+            _pairs(_msgpack_dumps, head) + _msgpack_dumps(name) + packer.pack_array_header(count)
+        yield from encoded
+        yield _pairs(_msgpack_dumps, tail)
+
+
+# ----- CBOR
+
+if cbor2 is not None:
+
+    def _cbor_isoformat(encoder, value):
+        encoder.encode(value.isoformat())
+
+    # cbor2 has its own date tags, and refuses naive datetimes, before any default is tried
+    _cbor_encoders = {date: _cbor_isoformat, datetime: _cbor_isoformat}
+
+    def _cbor_dumps(value: Any) -> bytes:
+        return cbor2.dumps(value, encoders=_cbor_encoders)
+
+    def _cbor_loads(data: bytes) -> Any:
+        try:
+            return cbor2.loads(data)
+        except cbor2.CBORDecodeError as e:
+            raise ValueError(e)
+
+    def _cbor_stream(head, name, items, tail):
+        # an indefinite-length map and array (RFC 8949 3.2.2), each closed by a break byte
+        yield b'\xbf' + _pairs(_cbor_dumps, head) + _cbor_dumps(name) + b'\x9f'
+        for chunk in _chunks(items):
+            yield b''.join(map(_cbor_dumps, chunk))
+        yield b'\xff' + _pairs(_cbor_dumps, tail()) + b'\xff'
+
+
+# by mimetype, in order of preference when a client accepts several equally
+formats: Dict[str, Format] = {JSON.mimetype: JSON}
+if msgpack is not None:
+    formats['application/msgpack'] = Format(
+        'msgpack', 'application/msgpack', _msgpack_dumps, _msgpack_loads, _msgpack_stream
+    )
+if cbor2 is not None:
+    formats['application/cbor'] = Format(
+        'cbor', 'application/cbor', _cbor_dumps, _cbor_loads, _cbor_stream
+    )
+
+# request Content-Types, including the unregistered name msgpack was long sent under
+content_types: Dict[str, Format] = dict(formats)
+if msgpack is not None:
+    content_types['application/x-msgpack'] = formats['application/msgpack']
+
+
+def negotiate(accept) -> Format:
+    """The format to answer a request with, from its Accept header (a werkzeug MIMEAccept)."""
+    return formats[accept.best_match(formats, default=JSON.mimetype)]
@@ -0,0 +1,340 @@
+# Synthetic users and records at production-like scale, for capacity planning.
+#
+#   python -m ESSBackend.generate --users 30000 [--first 0] [--seed 0] [--processes 8]
+#
+# Each user gets a history of a long-tailed length (most users log for a few weeks, a few for
+# years), ending at --end, and habits of its own: how many meals it logs, how it commutes, how
+# often it writes in its journal, whether it smokes. It logs on most days of its history, and
+# each logged day gets its summary row, as the writers would leave it. 30000 users come to
+# about 10M rows. Users are named user<n>@example.com, with the password 'password'.
+#
+# A user's rows depend only on the seed, --end and its number, so a run is reproducible
+# whatever the number of processes, and --first adds users after the ones already generated.
+# Users are generated in blocks, spread over --processes processes, and their rows are written
+# a chunk at a time with COPY on postgres, or executemany elsewhere. Like any write, rows
+# are stamped with changeSeq and journals are indexed for search (see search.py).
+#
+# sqlite takes one writer at a time, and stamps changeSeq from a counter in the process, so
+# it's generated in a single process.
+
+from ESSBackend.app import db, db_init, engine
+from ESSBackend.changes import next_seqs
+from ESSBackend.config import Config
+from ESSBackend.models import AppUser, Commute, DailySummary, EntertainmentUsage, Food, Health, \
+JournalEntry, ShowerUsage, WaterCups
+from ESSBackend.resources import resources
+from ESSBackend.search import index
+from bcrypt import gensalt, hashpw
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from multiprocessing import Pool
+from sqlalchemy.types import TypeDecorator
+from typing import Dict, List, Tuple
+
+import argparse
+import io
+import json
+import os
+import random
+import time
+
+PASSWORD = 'password'
+
+# (name, category, calories per serving)
+FOODS = [
+    ('oatmeal', 'grains', 150), ('toast', 'grains', 80), ('bagel', 'grains', 280),
+    ('rice bowl', 'grains', 400), ('pasta', 'grains', 520), ('steak', 'beef', 680),
+    ('hamburger', 'beef', 550), ('lamb curry', 'lamb', 610), ('cheese pizza', 'cheese', 600),
+    ('grilled cheese', 'cheese', 440), ('pork chop', 'pork', 500), ('bacon', 'pork', 160),
+    ('chicken sandwich', 'poultry', 450), ('turkey wrap', 'poultry', 390), ('salmon', 'fish', 410),
+    ('tuna salad', 'fish', 320), ('shrimp tacos', 'seafood', 430), ('omelette', 'eggs', 300),
+    ('yogurt', 'dairy', 150), ('latte', 'dairy', 190), ('salad', 'vegetables', 120),
+    ('stir fry', 'vegetables', 350), ('veggie burger', 'vegetables', 420), ('apple', 'fruit', 95),
+    ('banana', 'fruit', 105), ('smoothie', 'fruit', 250), ('lentil soup', 'legumes', 230),
+    ('bean burrito', 'legumes', 480), ('hummus', 'legumes', 170), ('almonds', 'nuts', 170)
+]
+MEAL_HOURS = [7, 8, 10, 12, 13, 15, 18, 19, 21]
+# (method, typical one-way distance in miles)
+COMMUTES = [
+    ('car', 12), ('carpool', 14), ('motorcycle', 10), ('bus', 6), ('train', 18), ('subway', 5),
+    ('scooter', 2), ('bike', 4), ('walk', 1)
+]
+COMMUTE_WEIGHTS = [40, 6, 2, 12, 8, 8, 2, 10, 12]
+# (table, its column, the summary column, range of values)
+DAILY = [
+    ('waters', 'count', 'waterCups', (2, 12)),
+    ('showers', 'minutes', 'showerMinutes', (3, 25)),
+    ('entertainments', 'hours', 'entertainmentHours', (0, 8)),
+    ('health_logs', 'cigarettes', 'cigarettes', (1, 20)),
+]
+WORDS = '''
+    today walked biked drove bus train work home lunch dinner coffee friends family garden rain
+    sun cold warm market groceries recycled compost leftovers vegetarian meat tried skipped
+    thermostat heating shower laundry water bottle plastic bag reusable carpool weekend park
+    trail run gym tired happy goal week month again better worse less more local farm fresh
+'''.split()
+
+_tables = {
+    'users': AppUser.__table__,
+    'foods': Food.__table__,
+    'commutes': Commute.__table__,
+    'journals': JournalEntry.__table__,
+    'waters': WaterCups.__table__,
+    'showers': ShowerUsage.__table__,
+    'entertainments': EntertainmentUsage.__table__,
+    'health_logs': Health.__table__,
+    'daily_summaries': DailySummary.__table__,
+}
+# every table but these holds category rows, stamped with changeSeq
+_UNSTAMPED = {'users', 'daily_summaries'}
+
+
+def user_rows(n: int, seed: int, end: date, password_hash: str) -> Dict[str, List[Dict]]:
+    """Every row of user `n`, by table."""
+    rng = random.Random(f'{seed}:{n}')
+    email = f'user{n}@example.com'
+    rows = {name: [] for name in _tables}
+    rows['users'].append({'email': email, 'password_hash': password_hash})
+
+    # a median of about a month, and a long tail of users logging for years
+    days = min(int(rng.lognormvariate(3.4, 1.3)) + 1, 1500)
+    logging = rng.uniform(0.4, 0.95)  # chance of logging on a day
+    meals = rng.choice([1, 2, 3, 3, 3, 4, 4, 5])
+    favorites = rng.sample(FOODS, 8)
+    method, miles = rng.choices(COMMUTES, COMMUTE_WEIGHTS)[0]
+    miles *= rng.lognormvariate(0, 0.5)
+    commutes = rng.random() < 0.7
+    journaling = rng.random()**3  # most users rarely write
+    chances = {table: rng.uniform(0.3, 1.0) for table, *_ in DAILY}  # of logging on a day
+    chances['health_logs'] = 1.0 if rng.random() < 0.15 else 0.0  # smokers log every day
+    vocabulary = rng.sample(WORDS, 40)
+
+    for day in (end - timedelta(days=d) for d in range(days - 1, -1, -1)):
+        if rng.random() > logging:
+            continue
+        midnight = datetime.combine(day, datetime.min.time())
+        summary = {
+            'email': email,
+            'date': day,
+            'calories': 0,
+            'commuteDistance': 0.0,
+            'commuteByMethod': None,
+            'waterCups': 0,
+            'showerMinutes': 0,
+            'entertainmentHours': 0,
+            'cigarettes': 0
+        }
+        summarized = False  # a journal entry alone doesn't get a summary (see scorecard.py)
+
+        for hour in rng.sample(MEAL_HOURS, max(1, meals + rng.randint(-1, 1))):
+            name, category, calories = rng.choice(favorites)
+            quantity = rng.choice([0.5, 1.0, 1.0, 1.0, 1.5, 2.0])
+            rows['foods'].append(
+                {
+                    'email': email,
+                    'name': name,
+                    'mealTime': midnight + timedelta(hours=hour, minutes=rng.randint(0, 59)),
+                    'quantity': quantity,
+                    'quantityUnits': 'servings',
+                    'calories': int(calories * quantity),
+                    'category': category
+                }
+            )
+            summary['calories'] += int(calories * quantity)
+            summarized = True
+
+        if commutes and day.weekday() < 5 and rng.random() < 0.9:
+            distance = round(miles * rng.uniform(0.9, 1.1), 1)
+            for hour in (8, 17):
+                departure = midnight + timedelta(hours=hour, minutes=rng.randint(0, 30))
+                rows['commutes'].append(
+                    {
+                        'email': email,
+                        'arrival': departure + timedelta(minutes=int(distance * 3) + 5),
+                        'method': method,
+                        'distance': distance,
+                        'departure': departure
+                    }
+                )
+            summary['commuteDistance'] = distance * 2
+            summary['commuteByMethod'] = {method: distance * 2}
+            summarized = True
+
+        if rng.random() < journaling:
+            words = int(rng.lognormvariate(4.5, 0.8))  # a median of 90
+            rows['journals'].append(
+                {
+                    'email': email,
+                    'title': f'{day} {" ".join(rng.sample(vocabulary, 3))}',
+                    'created': midnight + timedelta(hours=21, minutes=rng.randint(0, 59)),
+                    'edited': None,
+                    'content': ' '.join(rng.choices(vocabulary, k=words))
+                }
+            )
+
+        for table, column, total, (low, high) in DAILY:
+            if rng.random() < chances[table]:
+                row = {'email': email, 'date': day, column: rng.randint(low, high)}
+                if table == 'showers':
+                    row['cold'] = rng.random() < 0.1
+                rows[table].append(row)
+                summary[total] = row[column]
+                summarized = True
+
+        if summarized:
+            rows['daily_summaries'].append(summary)
+
+    return rows
+
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _text(value) -> str:
+    """A value in COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()  # a bytea's hex form, its backslash escaped
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return str(value).translate(_ESCAPES)
+
+
+class _Writer(object):
+    """Buffers rows by table, and writes them a chunk at a time, a transaction per chunk."""
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.postgres = db.get_bind().dialect.name == 'postgresql'
+        self.rows = {name: [] for name in _tables}
+        self.buffered = 0
+        self.written = dict.fromkeys(_tables, 0)
+
+    def add(self, rows: Dict[str, List[Dict]]):
+        for name, table_rows in rows.items():
+            self.rows[name].extend(table_rows)
+            self.buffered += len(table_rows)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # fresh users have no concurrent writers, so no per-user locks are needed
+        stamped = [row for name in _tables if name not in _UNSTAMPED for row in self.rows[name]]
+        for row, seq in zip(stamped, next_seqs([], len(stamped))):
+            row['changeSeq'] = seq
+
+        # users first, for the foreign keys
+        for name, rows in self.rows.items():
+            if rows:
+                (self._copy if self.postgres else self._insert)(_tables[name], rows)
+                self.written[name] += len(rows)
+        for email, entries in groupby(self.rows['journals'], lambda row: row['email']):
+            index(resources['journal'], email, list(entries))
+        db.commit()
+
+        self.rows = {name: [] for name in _tables}
+        self.buffered = 0
+
+    def _insert(self, table, rows: List[Dict]):
+        db.execute(table.insert(), rows)
+
+    def _copy(self, table, rows: List[Dict]):
+        columns = list(rows[0])
+        dialect = db.get_bind().dialect
+        # values go to COPY as they are, so column types that convert them do so here
+        converters = [
+            (i, table.c[c].type) for i, c in enumerate(columns)
+            if isinstance(table.c[c].type, TypeDecorator)
+        ]
+        data = io.StringIO()
+        for row in rows:
+            values = [row[c] for c in columns]
+            for i, column_type in converters:
+                values[i] = column_type.process_bind_param(values[i], dialect)
+            data.write('\t'.join(map(_text, values)))
+            data.write('\n')
+        data.seek(0)
+
+        names = ', '.join(f'"{c}"' for c in columns)
+        cursor = db.connection().connection.cursor()
+        cursor.copy_expert(f'COPY {table.name} ({names}) FROM STDIN', data)
+
+
+def _generate(task: Tuple[int, int, int, date, str, int]) -> Dict[str, int]:
+    first, count, seed, end, password_hash, chunk_size = task
+    writer = _Writer(chunk_size)
+    for n in range(first, first + count):
+        writer.add(user_rows(n, seed, end, password_hash))
+    writer.flush()
+    db.remove()
+    return writer.written
+
+
+def generate(
+    users: int,
+    first: int = 0,
+    seed: int = 0,
+    end: date = None,
+    processes: int = 1,
+    chunk_size: int = 10000,
+    block: int = 500
+) -> Dict[str, int]:
+    """Generate users `first` to `first + users - 1`, returning the rows written per table."""
+    db_init()
+    end = end or date.today()
+    password_hash = hashpw(PASSWORD.encode('utf-8'), gensalt(Config.BCRYPT_ROUNDS)).decode('utf-8')
+    tasks = [
+        (start, min(block, first + users - start), seed, end, password_hash, chunk_size)
+        for start in range(first, first + users, block)
+    ]
+
+    written = dict.fromkeys(_tables, 0)
+    if processes > 1:
+        # workers open connections of their own; none may be inherited
+        db.remove()
+        engine.dispose()
+        with Pool(processes) as pool:
+            for counts in pool.imap_unordered(_generate, tasks):
+                for name, count in counts.items():
+                    written[name] += count
+    else:
+        for task in tasks:
+            for name, count in _generate(task).items():
+                written[name] += count
+
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute('ANALYZE')  # the planner's statistics are far off after a bulk load
+        db.commit()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic users and their records.')
+    parser.add_argument('--users', type=int, required=True, help='about 350 rows each')
+    parser.add_argument('--first', type=int, default=0, help='number of the first user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--end', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), default=date.today(),
+        help='last day of every history (YYYY-MM-DD); defaults to today'
+    )
+    parser.add_argument(
+        '--processes', type=int, help='defaults to one per CPU on postgres, 1 elsewhere'
+    )
+    parser.add_argument('--chunk', type=int, default=10000, help='rows per transaction')
+    args = parser.parse_args()
+
+    postgres = engine.dialect.name == 'postgresql'
+    processes = args.processes or (os.cpu_count() if postgres else 1)
+    if processes > 1 and not postgres:
+        parser.error(f'{engine.dialect.name} is generated in a single process')
+
+    start = time.perf_counter()
+    written = generate(args.users, args.first, args.seed, args.end, processes, args.chunk)
+    seconds = time.perf_counter() - start
+    rows = sum(written.values())
+    print(f'Wrote {rows} rows in {seconds:.1f}s ({rows / seconds:.0f} rows/s)')
+    for name, count in written.items():
+        print(f'  {name}: {count}')
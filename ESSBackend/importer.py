@@ -0,0 +1,198 @@
+# Bulk import of a user's history, from CSV or NDJSON (/api/import, and
+# `python -m ESSBackend.importer`).
+#
+# NDJSON files hold a record per line, as /api/sync takes them: {type, content, metadata}.
+# CSV files have a header row naming `type`, `timestamp` and the content fields of any of the
+# categories, and a record per row, with the fields of other categories left empty; cells are
+# converted to their field's type before the record is validated.
+#
+# Files are parsed as they're read, and their records are validated and written IMPORT_CHUNK
+# at a time, a transaction per chunk, so memory use doesn't depend on a file's size. Within a
+# chunk, records overwriting the same row are collapsed into the last one, as writing them in
+# turn would leave it; each category's rows then go to the database in multi-row upserts,
+# which update the rows already there, and are stamped, summarized, indexed and revised as
+# /api/sync's are (see app.write_batches).
+
+from ESSBackend.app import check_record, db, write_batches
+from ESSBackend.config import Config
+from ESSBackend.resources import resources
+from ESSBackend.schema import nullable
+from itertools import islice
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+HEADER = 'X-ESS-Token'  # carries /api/import's token, as its body is the file
+# /api/import's Content-Type -> the file's format
+FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+# (line, record, or the error that makes it unreadable)
+Parsed = Tuple[int, Any, Optional[str]]
+
+
+def _boolean(cell: str):
+    return {'true': True, 'false': False, '1': True, '0': False}.get(cell.lower(), cell)
+
+
+def _convert(convert):
+    def cell(value: str):
+        try:
+            return convert(value)
+        except ValueError:
+            return value  # rejected by the schema, with its usual message
+
+    return cell
+
+
+# CSV cells are strings; these turn them into the JSON values the schemas take
+_CELLS = {int: _convert(int), float: _convert(float), bool: _boolean}
+
+
+def read_ndjson(stream: BinaryIO) -> Iterator[Parsed]:
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text.decode('utf-8')), None
+        except ValueError:
+            yield line, None, 'Invalid JSON'
+
+
+def read_csv(stream: BinaryIO) -> Iterator[Parsed]:
+    # utf-8-sig drops the byte order mark spreadsheets start files with
+    reader = csv.DictReader(text.decode('utf-8-sig') for text in stream)
+    try:
+        for row in reader:
+            resource = resources.get(row.get('type'))
+            if resource is None:
+                yield reader.line_num, row, None  # rejected as an unknown type
+                continue
+            content = {}
+            for field, kind in resource.content.items():
+                if row.get(field):
+                    spec = kind.spec if isinstance(kind, nullable) else kind
+                    content[field] = _CELLS.get(spec, str)(row[field])
+                elif isinstance(kind, nullable) and field in row:
+                    content[field] = None  # an empty cell is null where the column allows it
+            record = {
+                'type': row['type'],
+                'content': content,
+                'metadata': {
+                    'timestamp': row.get('timestamp')
+                }
+            }
+            yield reader.line_num, record, None
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num, None, f'Invalid CSV: {e}'
+
+
+readers = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+class Progress(object):
+    def __init__(self):
+        self.records = 0
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0  # collapsed into a later record for the same row
+        self.rejected = 0
+        self.errors: List[Dict[str, Any]] = []  # the first IMPORT_MAX_ERRORS
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            'records': self.records,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected
+        }
+
+    def reject(self, line: int, message: str):
+        self.rejected += 1
+        if len(self.errors) < Config.IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+
+def write_chunk(email: str, chunk: List[Parsed], progress: Progress):
+    """Validate and write a chunk of parsed records, adding them up in `progress`.
+
+    The caller commits.
+    """
+    statements = {}  # resource name -> [(update, {primary key: (line, row)})]
+    for line, record, error in chunk:
+        progress.records += 1
+        if error is None:
+            record, errors = check_record(record, resources)
+            error = errors[0]['message'] if errors else None
+        if error:
+            progress.reject(line, error)
+            continue
+
+        resource = resources[record['type']]
+        row = resource.row(email, record['content'], record['metadata'])
+        update = resource.update(record['content'])
+        key = tuple(row[column.name] for column in resource.model.__table__.primary_key.columns)
+
+        pending = statements.setdefault(resource.name, [])
+        if pending and pending[-1][0] is update and key in pending[-1][1]:
+            if update is None:
+                # a plain overwrite, so only the last one counts
+                progress.duplicates += 1
+                pending[-1][1][key] = (line, row)
+                continue
+            # increments and journal edits depend on what they follow
+            pending.append((update, {}))
+        elif not pending or pending[-1][0] is not update:
+            pending.append((update, {}))
+        pending[-1][1][key] = (line, row)
+
+    for _, _, inserted in write_batches(email, statements):
+        if inserted:
+            progress.inserted += 1
+        else:
+            progress.updated += 1
+
+
+def run(email: str, records: Iterator[Parsed]) -> Iterator[Progress]:
+    """Import parsed records for a user, yielding the progress after each committed chunk."""
+    progress = Progress()
+    while True:
+        chunk = list(islice(records, Config.IMPORT_CHUNK))
+        if not chunk:
+            break
+        write_chunk(email, chunk, progress)
+        db.commit()
+        yield progress
+
+
+if __name__ == '__main__':
+    from ESSBackend.models import AppUser
+
+    parser = argparse.ArgumentParser(description='Import a history of records for a user.')
+    parser.add_argument('file', help='a .csv or .ndjson file, or - for standard input')
+    parser.add_argument('--email', required=True, help='the user the records belong to')
+    parser.add_argument(
+        '--format', choices=list(readers), help='defaults to csv for a .csv file, else ndjson'
+    )
+    args = parser.parse_args()
+
+    if not AppUser.query.filter_by(email=args.email).first():
+        parser.error(f'no such user: {args.email}')
+    read = readers[args.format or ('csv' if args.file.lower().endswith('.csv') else 'ndjson')]
+    start = time.perf_counter()
+    progress = Progress()
+    with (sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')) as f:
+        for progress in run(args.email, read(f)):
+            elapsed = time.perf_counter() - start
+            print(
+                f'{progress.records} records ({progress.records / elapsed:.0f}/s): '
+                f'{progress.inserted} inserted, {progress.updated} updated, '
+                f'{progress.duplicates} duplicates, {progress.rejected} rejected',
+                file=sys.stderr
+            )
+    for error in progress.errors:
+        print(f'line {error["line"]}: {error["message"]}', file=sys.stderr)
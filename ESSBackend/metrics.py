@@ -0,0 +1,307 @@
+# Request and database metrics, served at /api/metrics in the Prometheus text format.
+#
+# A WSGI middleware times each request until its body has been sent (reads stream theirs,
+# querying as they go), and counts the bytes sent; engine events time every statement
+# executed meanwhile, and count it and the rows it returned or changed. Each request is
+# then added to per-route histograms.
+#
+# Every uwsgi worker keeps its own totals. With METRICS_DIR set, each worker also writes them
+# to a file of its own there, at most every METRICS_FLUSH seconds (and on exit), and
+# /api/metrics adds up the files of every worker, including ones since recycled, so counts
+# never go backwards. Clear the directory when uwsgi is restarted, as its counts start over.
+#
+# The metrics name every route and how busy it is, so they aren't public: /api/metrics answers
+# requests bearing METRICS_KEY, or without one, only requests from this host.
+
+from flask import request
+from sqlalchemy import event
+from threading import Lock, local
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import atexit
+import hmac
+import json
+import os
+import tempfile
+import time
+
+_LOCAL = ('127.0.0.1', '::1')
+
+# (type, help, histogram buckets)
+METRICS = {
+    'ess_requests_total': ('counter', 'Requests answered, by route and status', None),
+    'ess_request_duration_seconds': (
+        'histogram', 'Time to answer a request, until its body was sent',
+        [.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+    ),
+    'ess_db_duration_seconds': (
+        'histogram', 'Time a request spent executing SQL statements',
+        [.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5]
+    ),
+    'ess_db_statements': (
+        'histogram', 'SQL statements executed by a request', [0, 1, 2, 3, 5, 8, 13, 21, 50, 100]
+    ),
+    'ess_db_rows': (
+        'histogram',
+        'Rows returned or changed by a request\'s statements, as the driver reports them '
+        '(psycopg2 does for buffered selects; sqlite only for writes)',
+        [0, 1, 10, 100, 1000, 10000, 100000]
+    ),
+    'ess_response_bytes': (
+        'histogram', 'Size of a response body', [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+    ),
+    'ess_response_cache_hits_total': ('counter', 'Per-day reads answered from the cache', None),
+    'ess_response_cache_misses_total': ('counter', 'Per-day reads missing from the cache', None),
+    'ess_response_cache_evictions_total':
+    ('counter', 'Entries evicted from local response caches', None),
+    'ess_water_increments_total': ('counter', 'Water increments coalesced', None),
+    'ess_water_flushes_total': ('counter', 'Statements writing coalesced increments', None),
+    'ess_water_rows_total': ('counter', 'Rows written by coalesced increments', None),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Request(object):
+    __slots__ = ('route', 'status', 'bytes', 'statements', 'rows', 'db_time')
+
+    def __init__(self):
+        self.route = 'unmatched'  # set once flask has matched a URL rule
+        self.status = ''
+        self.bytes = 0
+        self.statements = 0
+        self.rows = 0
+        self.db_time = 0.0
+
+
+class Metrics(object):
+    def __init__(self, directory: Optional[str], flush: float, key: Optional[str] = None):
+        self.directory = directory
+        self.flush = flush
+        self.key = key
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [count per bucket (the last one +Inf), sum]
+        self._histograms: Dict[Tuple[str, Labels], List] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+        self._lock = Lock()
+        self._current = local()  # the request being handled by this thread
+        self._pid, self._file = None, None
+        self._exported = time.monotonic()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.export)
+
+    def instrument(self, app, engine):
+        """Record the requests answered by a flask app, and the statements run on an engine."""
+        app.wsgi_app = _Middleware(app.wsgi_app, self)
+
+        @app.before_request
+        def route():
+            current = getattr(self._current, 'request', None)
+            if current is not None and request.url_rule is not None:
+                current.route = request.url_rule.rule
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+            current = getattr(self._current, 'request', None)
+            if current is not None:
+                current.statements += 1
+                current.db_time += elapsed
+                current.rows += max(cursor.rowcount, 0)
+
+    def collect(self, collector: Callable[[], Dict[str, float]]):
+        """Report counters kept elsewhere: `collector()` returns {metric name: total}."""
+        self._collectors.append(collector)
+
+    def begin(self) -> _Request:
+        self._current.request = _Request()
+        return self._current.request
+
+    def end(self, record: _Request, duration: float):
+        self._current.request = None
+        route = (('route', record.route), )
+        with self._lock:
+            key = ('ess_requests_total', route + (('status', record.status), ))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            self._observe('ess_request_duration_seconds', route, duration)
+            self._observe('ess_db_duration_seconds', route, record.db_time)
+            self._observe('ess_db_statements', route, record.statements)
+            self._observe('ess_db_rows', route, record.rows)
+            self._observe('ess_response_bytes', route, record.bytes)
+        if self.directory and time.monotonic() - self._exported >= self.flush:
+            self.export()
+
+    def _observe(self, name: str, labels: Labels, value: float):
+        buckets = METRICS[name][2]
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = [[0] * (len(buckets) + 1), 0]
+        i = 0
+        while i < len(buckets) and value > buckets[i]:
+            i += 1
+        histogram[0][i] += 1
+        histogram[1] += value
+
+    def snapshot(self) -> Dict[str, List]:
+        """This process's totals, in the form written to its file."""
+        with self._lock:
+            counters = [
+                [name, dict(labels), value] for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                [name, dict(labels), list(counts), total]
+                for (name, labels), (counts, total) in self._histograms.items()
+            ]
+        for collector in self._collectors:
+            counters.extend([name, {}, value] for name, value in collector().items())
+        return {'counters': counters, 'histograms': histograms}
+
+    def _own_file(self) -> str:
+        # named when first needed, since uwsgi loads the app before forking its workers;
+        # the time keeps it unique if a later worker gets the same pid
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file = f'{self._pid}-{int(time.time() * 1e6)}.json'
+        return self._file
+
+    def export(self):
+        """Write this process's totals to its file, replacing the last ones atomically."""
+        self._exported = time.monotonic()
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, os.path.join(self.directory, self._own_file()))
+
+    def allowed(self, environ) -> bool:
+        """Whether a request may read the metrics."""
+        if self.key:
+            # header values are latin-1, and compare_digest only takes ASCII str
+            given = environ.get('HTTP_AUTHORIZATION', '').encode('latin-1')
+            return hmac.compare_digest(given, f'Bearer {self.key}'.encode('utf-8'))
+        # nginx passes on the client's address, so this is only true for local requests
+        return environ.get('REMOTE_ADDR') in _LOCAL
+
+    def render(self) -> str:
+        """Every process's totals, added up, in the Prometheus text format."""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json') and name != self._own_file():
+                    try:
+                        with open(os.path.join(self.directory, name)) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue  # removed meanwhile
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total in snapshot['histograms']:
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+
+        lines = []
+        for name, (kind, help, buckets) in METRICS.items():
+            samples = [(labels, v) for (n, labels), v in sorted(counters.items()) if n == name]
+            samples += [(labels, v) for (n, labels), v in sorted(histograms.items()) if n == name]
+            if not samples:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip([_number(b) for b in buckets] + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound), ))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def from_config(config) -> Optional['Metrics']:
+        """The metrics selected by METRICS, or None when they're off."""
+        if not config['METRICS']:
+            return None
+        return Metrics(config['METRICS_DIR'], config['METRICS_FLUSH'], config['METRICS_KEY'])
+
+
+class _Middleware(object):
+    def __init__(self, wsgi_app, metrics: Metrics):
+        self.wsgi_app = wsgi_app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        record = self.metrics.begin()
+
+        def start_with_status(status, headers, exc_info=None):
+            record.status = status.split(' ', 1)[0]
+            return start_response(status, headers, exc_info)
+
+        def done():
+            self.metrics.end(record, time.perf_counter() - start)
+
+        try:
+            body = self.wsgi_app(environ, start_with_status)
+        except BaseException:
+            done()
+            raise
+        return _Body(body, record, done)
+
+
+class _Body(object):
+    """A response body that counts its bytes, and finishes the request once it's been sent.
+
+    Servers close a body once it's sent, but a body read to the end is taken as sent, for
+    clients (such as flask's test client) that don't close it.
+    """
+
+    def __init__(self, body, record: _Request, done: Callable[[], None]):
+        self.body = body
+        self.record = record
+        self.done = done
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.record.bytes += len(chunk)
+            yield chunk
+        self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self.done:
+            self.done, done = None, self.done
+            done()
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _number(value: Any) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -1,9 +1,14 @@
-from ESSBackend.app import db, Base
+from ESSBackend.app import app, db, Base
+from ESSBackend.compressed import CompressedText
 from sqlalchemy import Column, Integer, String, \
-ForeignKey, Date, DateTime, Float, Text, Boolean
+ForeignKey, Date, DateTime, Float, Text, Boolean, Index, JSON, BigInteger, Sequence
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 # from sqlalchemy.dialects.postgresq import JSON
 
+# Every write to a category table stamps its rows' changeSeq from this sequence (see changes.py)
+change_seq = Sequence('change_seq', metadata=Base.metadata)
+
 
 class AppUser(Base):
     __tablename__ = 'users'
@@ -19,6 +24,24 @@ class AppUser(Base):
         return f'<AppUser: {self.email}>'
 
 
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    hash = Column(String(64), primary_key=True)
+    revoked = Column(DateTime, nullable=False)
+    # the row can be dropped once its token has expired
+    expiry = Column(DateTime, nullable=False)
+
+    def __init__(self, email, hash, revoked, expiry):
+        self.email = email
+        self.hash = hash
+        self.revoked = revoked
+        self.expiry = expiry
+
+    def __repr__(self):
+        return f'<RevokedToken: {self.hash} for {self.email} ({self.revoked})>'
+
+
 class Food(Base):
     __tablename__ = 'foods'
     email = Column(ForeignKey(AppUser.email), primary_key=True)
@@ -29,6 +52,13 @@ class Food(Base):
     quantityUnits = Column(String(64))
     calories = Column(Integer)
     category = Column(String(64))
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+
+    # name sits between email and mealTime in the primary key, so it can't serve per-day reads
+    __table_args__ = (
+        Index('ix_foods_email_mealtime', 'email', 'mealTime'),
+        Index('ix_foods_email_change', 'email', 'changeSeq'),
+    )
 
     def __init__(
         self,
@@ -60,7 +90,15 @@ class JournalEntry(Base):
     created = Column(DateTime, nullable=False)
     edited = Column(DateTime)
 
-    content = Column(Text, nullable=False)
+    # stored compressed when JOURNAL_COMPRESSION is set (see compressed.py)
+    content = Column(CompressedText.from_config(app.config), nullable=False)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+
+    # journals are keyed by title, so per-day reads need their own (email, created) index
+    __table_args__ = (
+        Index('ix_journals_email_created', 'email', 'created'),
+        Index('ix_journals_email_change', 'email', 'changeSeq'),
+    )
 
     def __init__(self, email, title, created, content):
         self.email = email
@@ -72,6 +110,40 @@ class JournalEntry(Base):
         return f'<JournalEntry: {self.title} by {self.email} ({self.created})>'
 
 
+class JournalSearch(Base):
+    """A journal entry's search document, kept current by the writers (see search.py)."""
+    __tablename__ = 'journal_search'
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    title = Column(String(128), primary_key=True)
+    # only written on postgres; other dialects search journal_terms
+    document = Column(TSVECTOR().with_variant(Text, 'sqlite'), nullable=False)
+    __table_args__ = (Index('ix_journal_search_document', 'document', postgresql_using='gin'), )
+
+    def __repr__(self):
+        return f'<JournalSearch: {self.title} by {self.email}>'
+
+
+class JournalTerm(Base):
+    """A term of a journal entry, in the inverted index searched off postgres (see search.py)."""
+    __tablename__ = 'journal_terms'
+    # keyed by entry first, so re-indexing an entry finds its terms by the primary key
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    title = Column(String(128), primary_key=True)
+    term = Column(String(64), primary_key=True)
+    weight = Column(Float, nullable=False)  # its occurrences, weighted by where they are
+
+    def __repr__(self):
+        return f'<JournalTerm: {self.term} in {self.title} by {self.email}>'
+
+
+# a term's entries in rank order, covering searches: a one-word search reads just the page
+# it returns
+Index(
+    'ix_journal_terms_rank', JournalTerm.email, JournalTerm.term, JournalTerm.weight.desc(),
+    JournalTerm.title
+)
+
+
 class Commute(Base):
     __tablename__ = 'commutes'
     email = Column(ForeignKey(AppUser.email), primary_key=True)
@@ -80,6 +152,8 @@ class Commute(Base):
     method = Column(String(64), nullable=False)
     distance = Column(Float, nullable=False)
     departure = Column(DateTime, nullable=False)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+    __table_args__ = (Index('ix_commutes_email_change', 'email', 'changeSeq'), )
 
     def __init__(self, email, arrival, departure, method, distance):
         self.email = email
@@ -97,6 +171,8 @@ class WaterCups(Base):
     email = Column(ForeignKey(AppUser.email), primary_key=True)
     date = Column(Date, primary_key=True)
     count = Column(Integer, nullable=False)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+    __table_args__ = (Index('ix_waters_email_change', 'email', 'changeSeq'), )
 
     def __init__(self, email, date, count=0):
         self.email = email
@@ -113,6 +189,8 @@ class ShowerUsage(Base):
     date = Column(Date, primary_key=True)
     minutes = Column(Integer, nullable=False)
     cold = Column(Boolean, nullable=False)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+    __table_args__ = (Index('ix_showers_email_change', 'email', 'changeSeq'), )
 
     def __init__(self, email, date, minutes, cold=False):
         self.email = email
@@ -129,6 +207,8 @@ class EntertainmentUsage(Base):
     email = Column(ForeignKey(AppUser.email), primary_key=True)
     date = Column(Date, primary_key=True)
     hours = Column(Integer, nullable=False)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+    __table_args__ = (Index('ix_entertainments_email_change', 'email', 'changeSeq'), )
 
     def __init__(self, email, date, hours):
         self.email = email
@@ -144,6 +224,8 @@ class Health(Base):
     email = Column(ForeignKey(AppUser.email), primary_key=True)
     date = Column(Date, primary_key=True)
     cigarettes = Column(Integer, default=0)
+    changeSeq = Column(BigInteger, nullable=False, server_default='0')
+    __table_args__ = (Index('ix_health_logs_email_change', 'email', 'changeSeq'), )
 
     def __init__(self, email, date, cigarettes):
         self.email = email
@@ -154,6 +236,48 @@ class Health(Base):
         return f'<Health: {self.email} smoked {self.cigarettes} ({self.date})>'
 
 
+class DailySummary(Base):
+    """Per-day scorecard totals, kept current by the writers (see scorecard.py)."""
+    __tablename__ = 'daily_summaries'
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    date = Column(Date, primary_key=True)
+
+    calories = Column(Integer, nullable=False, default=0, server_default='0')
+    commuteDistance = Column(Float, nullable=False, default=0, server_default='0')
+    commuteByMethod = Column(JSON)  # {method: distance}
+    waterCups = Column(Integer, nullable=False, default=0, server_default='0')
+    showerMinutes = Column(Integer, nullable=False, default=0, server_default='0')
+    entertainmentHours = Column(Integer, nullable=False, default=0, server_default='0')
+    cigarettes = Column(Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<DailySummary: {self.email} ({self.date})>'
+
+
+class Tombstone(Base):
+    """A deleted category row, kept so /api/changes can report the delete."""
+    __tablename__ = 'tombstones'
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    resource = Column(String(32), primary_key=True)
+    key = Column(String(512), primary_key=True)  # JSON of the row's key (see Resource.encode_key)
+    changeSeq = Column(BigInteger, nullable=False)
+    __table_args__ = (Index('ix_tombstones_email_change', 'email', 'changeSeq'), )
+
+    def __repr__(self):
+        return f'<Tombstone: {self.resource} {self.key} for {self.email}>'
+
+
+class DayRevision(Base):
+    """A per-day counter bumped by every write to that day (see revisions.py)."""
+    __tablename__ = 'day_revisions'
+    email = Column(ForeignKey(AppUser.email), primary_key=True)
+    date = Column(Date, primary_key=True)
+    revision = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<DayRevision: {self.email} {self.revision} ({self.date})>'
+
+
 # class JournalAttachment(Base()):
 #     path = Column(String(256), primary_key=True)
 #     pass
@@ -0,0 +1,105 @@
+# Password hashing, bounded across every worker.
+#
+# bcrypt is deliberately slow (~250ms at cost 12), and a uwsgi worker can't serve anything
+# else while it hashes, so a burst of logins could otherwise occupy every worker and starve
+# the cheap data endpoints. At most BCRYPT_SLOTS hashes run at once across all the workers;
+# kept below uwsgi's `processes`, that always leaves workers free for other requests. Once
+# every slot is taken, further logins are turned away at once with PasswordPoolBusy (a 503)
+# rather than waiting, which would tie up their workers too.
+#
+# The slots are lock files in BCRYPT_DIR, each flock()ed while a hash runs, so a worker that
+# dies mid-hash gives its slot back as it goes. Without BCRYPT_DIR (or on a system without
+# fcntl) the slots are only shared by one process's threads, as when running locally.
+
+from ESSBackend.config import Config
+from bcrypt import checkpw, hashpw, gensalt
+from contextlib import contextmanager
+from threading import Lock
+from typing import List, Optional, Set
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class Slots(object):
+    def __init__(self, count: int, directory: Optional[str]):
+        self.count = count
+        self.directory = directory if fcntl else None
+        self._lock = Lock()
+        self._held: Set[int] = set()  # slots taken by this process
+        self._pid, self._files = None, []
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @contextmanager
+    def take(self):
+        """Hold a free slot for the duration; raises PasswordPoolBusy if there isn't one."""
+        slot = self._acquire()
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+    def _acquire(self) -> int:
+        with self._lock:
+            files = self._own_files()
+            for slot in range(self.count):
+                if slot in self._held:
+                    continue
+                if files:
+                    try:
+                        fcntl.flock(files[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # held by another worker
+                self._held.add(slot)
+                return slot
+        raise PasswordPoolBusy()
+
+    def _release(self, slot: int):
+        with self._lock:
+            if self._files:
+                fcntl.flock(self._files[slot], fcntl.LOCK_UN)
+            self._held.discard(slot)
+
+    def _own_files(self) -> List[int]:
+        # opened once per process, after uwsgi forks its workers: a lock belongs to an open
+        # file, so a file opened before forking would be one lock shared by every worker
+        if self.directory and self._pid != os.getpid():
+            self._pid, self._held = os.getpid(), set()
+            self._files = [
+                os.open(os.path.join(self.directory, f'slot-{i}'), os.O_RDWR | os.O_CREAT, 0o600)
+                for i in range(self.count)
+            ]
+        return self._files
+
+
+# BCRYPT_SLOTS = 0 leaves hashes unbounded
+_slots = Slots(Config.BCRYPT_SLOTS, Config.BCRYPT_DIR) if Config.BCRYPT_SLOTS else None
+
+
+def _run(fn, *args):
+    if _slots is None:
+        return fn(*args)
+    with _slots.take():
+        return fn(*args)
+
+
+def hash_password(password: str) -> str:
+    return _run(hashpw, password.encode('utf-8'), gensalt(Config.BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def check_password(password: str, pwhash: str) -> bool:
+    return _run(checkpw, password.encode('utf-8'), pwhash.encode('utf-8'))
+
+
+def needs_rehash(pwhash: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    return int(pwhash.split('$')[2]) != Config.BCRYPT_ROUNDS
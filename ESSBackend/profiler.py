@@ -0,0 +1,242 @@
+# Per-request profiles of live requests.
+#
+# With PROFILE_DIR set, a request is profiled when it carries `X-ESS-Profile: <PROFILE_KEY>`,
+# or when it's picked by PROFILE_SAMPLE (a fraction of all requests). Its call stacks are
+# recorded with cProfile, and the SQL statements it executes are timed (their text only, not
+# their parameters), until its body has been sent; the response says which profile it got
+# in its own X-ESS-Profile header.
+#
+# Each profile is written to PROFILE_DIR as <id>.prof (pstats) and <id>.json (the request and
+# its statements), and only the newest PROFILE_KEEP are kept.
+#
+# `python -m ESSBackend.profiler` adds up the profiles there into a report of the hottest
+# functions and statements, optionally for one route.
+
+from sqlalchemy import event
+from threading import local
+from typing import Any, Dict, List, Optional
+
+import argparse
+import cProfile
+import glob
+import hmac
+import json
+import os
+import pstats
+import random
+import sys
+import time
+
+HEADER = 'X-ESS-Profile'
+
+
+class _Profile(object):
+    def __init__(self, environ):
+        # sorts by time, and is unique across workers
+        self.id = f'{int(time.time() * 1e6)}-{os.getpid()}'
+        self.method = environ.get('REQUEST_METHOD', '')
+        self.path = environ.get('PATH_INFO', '')
+        self.status = ''
+        self.start = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.statements: List[Dict[str, Any]] = []
+
+
+class Profiler(object):
+    def __init__(self, directory: str, key: Optional[str], sample: float, keep: int):
+        self.directory = directory
+        self.key = key
+        self.sample = sample
+        self.keep = keep
+        self._current = local()  # the profile being recorded by this thread
+        os.makedirs(directory, exist_ok=True)
+
+    def instrument(self, app, engine):
+        """Profile requests answered by a flask app, and time the statements run on an engine."""
+        app.wsgi_app = _Middleware(app.wsgi_app, self)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(conn, cursor, statement, parameters, context, executemany):
+            if getattr(self._current, 'profile', None) is not None:
+                conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(conn, cursor, statement, parameters, context, executemany):
+            current = getattr(self._current, 'profile', None)
+            if current is not None and conn.info.get('profile_start'):
+                seconds = time.perf_counter() - conn.info['profile_start'].pop()
+                current.statements.append(
+                    {
+                        'statement': statement,
+                        'seconds': seconds,
+                        'rows': cursor.rowcount,
+                        'executemany': executemany
+                    }
+                )
+
+    def wanted(self, environ) -> bool:
+        requested = environ.get('HTTP_' + HEADER.upper().replace('-', '_'))
+        if requested is not None and self.key:
+            # as bytes: compare_digest raises on a str that isn't ASCII, and headers are latin-1
+            if hmac.compare_digest(requested.encode('latin-1'), self.key.encode('utf-8')):
+                return True
+        return self.sample > 0 and random.random() < self.sample
+
+    def begin(self, environ) -> _Profile:
+        self._current.profile = _Profile(environ)
+        return self._current.profile
+
+    def end(self, current: _Profile):
+        """Write a finished profile, and drop the oldest beyond PROFILE_KEEP."""
+        self._current.profile = None
+        seconds = time.perf_counter() - current.start
+        path = os.path.join(self.directory, current.id)
+        current.profile.dump_stats(path + '.prof')
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(
+                {
+                    'id': current.id,
+                    'method': current.method,
+                    'path': current.path,
+                    'status': current.status,
+                    'seconds': seconds,
+                    'statements': current.statements
+                }, f
+            )
+        os.replace(path + '.json.tmp', path + '.json')
+
+        profiles = sorted(glob.glob(os.path.join(self.directory, '*.json')))
+        for old in profiles[:max(len(profiles) - self.keep, 0)]:
+            for name in (old, old[:-len('.json')] + '.prof'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass  # removed by another worker
+
+    @staticmethod
+    def from_config(config) -> Optional['Profiler']:
+        """The profiler selected by PROFILE_DIR, or None when profiling is off."""
+        if not config['PROFILE_DIR']:
+            return None
+        return Profiler(
+            config['PROFILE_DIR'], config['PROFILE_KEY'], config['PROFILE_SAMPLE'],
+            config['PROFILE_KEEP']
+        )
+
+
+class _Middleware(object):
+    def __init__(self, wsgi_app, profiler: Profiler):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        if not self.profiler.wanted(environ):
+            return self.wsgi_app(environ, start_response)
+        current = self.profiler.begin(environ)
+
+        def start_with_id(status, headers, exc_info=None):
+            current.status = status.split(' ', 1)[0]
+            return start_response(status, headers + [(HEADER, current.id)], exc_info)
+
+        current.profile.enable()
+        try:
+            body = self.wsgi_app(environ, start_with_id)
+        except BaseException:
+            current.profile.disable()
+            self.profiler.end(current)
+            raise
+        current.profile.disable()
+        return _Body(body, current, self.profiler)
+
+
+class _Body(object):
+    """A response body profiled as it's produced, until it's been read or closed."""
+
+    def __init__(self, body, current: _Profile, profiler: Profiler):
+        self.body = body
+        self.current = current
+        self.profiler = profiler
+
+    def __iter__(self):
+        chunks = iter(self.body)
+        while True:
+            self.current.profile.enable()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                self.current.profile.disable()
+            yield chunk
+        self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.current.profile.enable()
+                try:
+                    self.body.close()
+                finally:
+                    self.current.profile.disable()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self.profiler:
+            self.profiler, profiler = None, self.profiler
+            profiler.end(self.current)
+
+
+def report(directory: str, route: str = None, top: int = 25, sort: str = 'cumulative'):
+    """Print the hottest functions and statements of the profiles in `directory`."""
+    requests = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as f:
+            request = json.load(f)
+        if route is None or request['path'] == route:
+            requests.append((path[:-len('.json')] + '.prof', request))
+    if not requests:
+        print('No profiles' + (f' of {route}' if route else ''))
+        return
+
+    print(f'{len(requests)} profiles')
+    by_path = {}
+    for _, request in requests:
+        by_path.setdefault((request['method'], request['path']), []).append(request['seconds'])
+    for (method, path), seconds in sorted(by_path.items(), key=lambda i: -sum(i[1])):
+        print(
+            f'  {method} {path}: {len(seconds)} profiled, '
+            f'mean {sum(seconds) / len(seconds) * 1000:.1f} ms, max {max(seconds) * 1000:.1f} ms'
+        )
+
+    print(f'\nHot functions (by {sort} time):')
+    stats = pstats.Stats(*[prof for prof, _ in requests], stream=sys.stdout)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+    statements = {}
+    for _, request in requests:
+        for s in request['statements']:
+            total = statements.setdefault(' '.join(s['statement'].split()), [0, 0.0])
+            total[0] += 1
+            total[1] += s['seconds']
+    print('Hot statements (by total time):')
+    print(f'{"calls":>7} {"total ms":>10} {"mean ms":>9}  statement')
+    for statement, (calls, seconds) in sorted(statements.items(), key=lambda i: -i[1][1])[:top]:
+        print(
+            f'{calls:>7} {seconds * 1000:>10.2f} {seconds / calls * 1000:>9.3f}  '
+            f'{statement[:120]}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=report.__doc__)
+    parser.add_argument(
+        '--dir', default=os.environ.get('ESS_PROFILE_DIR'), help='defaults to $ESS_PROFILE_DIR'
+    )
+    parser.add_argument('--route', help='only profiles of this path, e.g. /api/food')
+    parser.add_argument('--top', type=int, default=25, help='functions and statements listed')
+    parser.add_argument('--sort', default='cumulative', help='a pstats sort key, e.g. tottime')
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error('no profile directory: pass --dir, or set ESS_PROFILE_DIR')
+    report(args.dir, args.route, args.top, args.sort)
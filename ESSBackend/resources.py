@@ -0,0 +1,545 @@
+# The registry of record categories, which generates their endpoints (see category_routes).
+#
+# Each Resource knows how to turn a request's content/metadata into a row for its table,
+# which SET clause to use when that row already exists (see upsert.py),
+# and how to select and serialize a day's worth of rows.
+#
+# Reads go through a View: the fields a client asked for (all of them by default), and the
+# statements selecting just their columns, so unrequested columns (such as long journal
+# contents) are never read from the table. The statements are built once per view, with bound
+# parameters, so every request reuses the same statement objects and their compiled SQL.
+# Column values are passed through as they are; dates and datetimes are written as ISO 8601
+# by the response encoder (see encoder.py).
+
+from ESSBackend.app import METADATA, TOKEN, category_routes, db, parse_day, day_range
+from ESSBackend.models import Food, Commute, JournalEntry, WaterCups, ShowerUsage, \
+EntertainmentUsage, Health, Tombstone
+from ESSBackend.schema import Schema, nullable, string
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, timedelta
+from sqlalchemy import BigInteger, Date, DateTime, bindparam, case, cast, func, literal, null, \
+select, tuple_, union_all
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import binascii
+import json
+
+
+# waters.count is an Integer; totals are held within its range rather than overflowing it
+COUNT_MIN, COUNT_MAX = -2**31, 2**31 - 1
+
+
+def clamp_count(count: int) -> int:
+    return min(max(count, COUNT_MIN), COUNT_MAX)
+
+
+def increment_water(table, excluded):
+    # incremented in SQL, so concurrent taps can't overwrite each other; added up as a bigint,
+    # which the sum of two Integers always fits, then clamped back into the column's range
+    total = cast(table.c.count, BigInteger) + excluded['count']
+    clamped = case([(total > COUNT_MAX, COUNT_MAX), (total < COUNT_MIN, COUNT_MIN)], else_=total)
+    return {'count': clamped}
+
+
+def edit_journal(table, excluded):
+    # an edit keeps the original creation time; the request timestamp becomes the edit time
+    return {'content': excluded['content'], 'edited': excluded['created']}
+
+
+def _day(metadata: Dict[str, Any]):
+    return metadata['timestamp'].date()
+
+
+class Resource(NamedTuple):
+    name: str
+    path: str  # its endpoints are /api/<path>, /api/<path>/new, /batch and /delete
+    label: str  # used in write response messages
+    read_message: str  # read response message, formatted with the requested date
+    model: Any
+    content: Dict[str, Any]  # content fields and their types (see schema.py)
+    row: Callable[[str, Dict, Dict], Dict]  # (email, typed content, typed metadata) -> row
+    day_column: str  # the column a row is filed under a day by
+    fields: Dict[str, str]  # response content fields -> the columns they're read from, in order
+    order: List[str]  # range read order; unique per user, so it doubles as the keyset cursor
+    empty: Dict = None  # content for a day without a row; None if a day holds a list of rows
+    update: Callable[[Dict], Callable] = lambda content: None  # content -> upsert SET clause
+    constant: Dict = {}  # response content fields that aren't stored, with their values
+
+    def inserted_message(self, inserted: bool) -> str:
+        if inserted:
+            return f'Inserted new {self.label}.'
+        return f'Updated existing {self.label}.'
+
+    @property
+    def columns(self) -> List[str]:
+        """The columns read for a full response."""
+        return list(self.fields.values())
+
+    def view(self, fields: List[str] = None) -> 'View':
+        """A read of just the given response fields (all by default), in response order.
+
+        Raises ValueError naming the fields this resource doesn't have.
+        """
+        known = list(self.fields) + list(self.constant)
+        if fields is None:
+            fields = known
+        unknown = [f for f in fields if f not in known]
+        if unknown:
+            raise ValueError(', '.join(unknown))
+        key = (self.name, tuple(f for f in known if f in fields))
+        if key not in _views:
+            _views[key] = _build_view(self, key[1])
+        return _views[key]
+
+    def day(self):
+        """The day a row belongs to, as a SQL expression (for grouping by day)."""
+        column = self.model.__table__.c[self.day_column]
+        if not isinstance(column.type, DateTime):
+            return column
+        # sqlite would cast a timestamp string to its leading number, i.e. the year
+        return func.date(column) if db.get_bind().dialect.name == 'sqlite' else cast(column, Date)
+
+    def bounds(self, start: date, end: date) -> Tuple:
+        """Half-open [lower, upper) bounds on the day column for two inclusive dates."""
+        if isinstance(self.model.__table__.c[self.day_column].type, DateTime):
+            return day_range(start)[0], day_range(end)[1]
+        return start, end + timedelta(days=1)
+
+    def on_days(self, email: str, start: date, end: date):
+        """WHERE clause for this user's rows between two inclusive dates."""
+        table = self.model.__table__
+        column = table.c[self.day_column]
+        lower, upper = self.bounds(start, end)
+        return (table.c.email == email) & (column >= lower) & (column < upper)
+
+    def on_day(self, email: str, day: date):
+        return self.on_days(email, day, day)
+
+    @property
+    def key_columns(self) -> List[str]:
+        """The primary key columns identifying a row within a user's records."""
+        return [c.name for c in self.model.__table__.primary_key.columns if c.name != 'email']
+
+    def encode_key(self, row) -> Dict[str, Any]:
+        return {c: _CURSOR_TYPES[type(row[c])][0](row[c]) for c in self.key_columns}
+
+    def decode_key(self, key: Dict[str, Any]) -> Dict[str, Any]:
+        """Raises ValueError for a key missing a column or holding a malformed value."""
+        try:
+            table = self.model.__table__
+            return {
+                c: _CURSOR_TYPES[table.c[c].type.python_type][1](key[c])
+                for c in self.key_columns
+            }
+        except (TypeError, KeyError) as e:
+            raise ValueError(e)
+
+    def encode_cursor(self, row) -> str:
+        values = [_CURSOR_TYPES[type(row[c])][0](row[c]) for c in self.order]
+        return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor: str) -> List:
+        """Raises ValueError for a cursor that wasn't produced by encode_cursor."""
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if type(values) is not list or len(values) != len(self.order):
+                raise ValueError('expected a value for each of ' + ', '.join(self.order))
+            table = self.model.__table__
+            return [
+                _CURSOR_TYPES[table.c[c].type.python_type][1](v) for c, v in zip(self.order, values)
+            ]
+        except (TypeError, KeyError, UnicodeError, binascii.Error) as e:
+            raise ValueError(e)
+
+
+def _parse_string(value: str) -> str:
+    # a list or object would otherwise be stringified, and match nothing
+    if type(value) is not str:
+        raise TypeError(f'expected a string, not {value!r}')
+    return value
+
+
+def _parse_datetime(value: str) -> datetime:
+    # microseconds are optional, so a key can also be given as the timestamp the client wrote
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+
+_CURSOR_TYPES = {
+    datetime: (lambda v: v.strftime('%Y-%m-%dT%H:%M:%S.%f'), _parse_datetime),
+    date: (lambda v: v.isoformat(), parse_day),
+    str: (str, _parse_string),
+}
+
+
+class Statements(NamedTuple):
+    day: Any  # a day's rows; bound to email, lower and upper
+    range: Any  # a page of rows between two days; bound to email, lower, upper and limit
+    range_after: Any  # the page after a keyset cursor; also bound to after_0, after_1, ...
+
+
+class View(NamedTuple):
+    resource: Resource
+    name: str  # the resource's name, followed by the fields if not all of them (for ETags)
+    fields: Tuple[str, ...]  # the response content fields, in order
+    stored: Tuple[str, ...]  # those read from columns
+    columns: List[str]  # their columns, which come first in every row a view's statements read
+    constant: Dict  # the other fields, with their values
+    empty: Dict  # the resource's `empty`, with just these fields
+    statements: Statements
+
+    def fetch_day(self, email: str, day: date) -> List:
+        lower, upper = self.resource.bounds(day, day)
+        params = {'email': email, 'lower': lower, 'upper': upper}
+        return db.execute(self.statements.day, params).fetchall()
+
+    def fetch_range(self, email: str, start: date, end: date, after: List, limit: int):
+        """Streams rows between two dates, in `order`, starting after the cursor values `after`."""
+        lower, upper = self.resource.bounds(start, end)
+        params = {'email': email, 'lower': lower, 'upper': upper, 'limit': limit}
+        if not after:
+            return db.execute(self.statements.range, params)
+        params.update((f'after_{i}', value) for i, value in enumerate(after))
+        return db.execute(self.statements.range_after, params)
+
+    def values(self, row) -> Tuple:
+        """The values of `columns`, from a row that doesn't start with them (such as a UNION's)."""
+        return tuple(row[c] for c in self.columns)
+
+    def serialize(self, row) -> Dict:
+        """Response content from a row starting with the values of `columns`."""
+        content = dict(zip(self.stored, row))
+        if self.constant:
+            content.update(self.constant)
+        return content
+
+    def serialize_day(self, rows: List) -> Any:
+        """A list of serialized rows, or the content of the day's single row."""
+        if self.empty is None:
+            return [self.serialize(row) for row in rows]
+        return self.serialize(rows[0]) if rows else self.empty
+
+    def serialize_range(self, row) -> Dict:
+        content = self.serialize(self.values(row))
+        if self.empty is not None:
+            # one row per day, so range reads have to say which day it is
+            content['date'] = row[self.resource.day_column]
+        return content
+
+
+def _build_view(resource: Resource, fields: Tuple[str, ...]) -> View:
+    stored = tuple(f for f in fields if f in resource.fields)
+    columns = [resource.fields[f] for f in stored]
+    empty = None if resource.empty is None else {f: resource.empty[f] for f in fields}
+    constant = {f: resource.constant[f] for f in fields if f in resource.constant}
+    everything = len(fields) == len(resource.fields) + len(resource.constant)
+    name = resource.name if everything else f'{resource.name}({",".join(fields)})'
+    return View(
+        resource, name, fields, stored, columns, constant, empty,
+        _build_statements(resource, columns)
+    )
+
+
+def _build_statements(resource: Resource, columns: List[str]) -> Statements:
+    table = resource.model.__table__
+    column = table.c[resource.day_column]
+    where = (table.c.email == bindparam('email')) & \
+        (column >= bindparam('lower', type_=column.type)) & \
+        (column < bindparam('upper', type_=column.type))
+    # a day of a one-row-per-day resource still needs a column, to tell if its row exists
+    day = select([table.c[c] for c in columns or [resource.day_column]]).where(where)
+
+    order = [table.c[c] for c in resource.order]
+    extra = [c for c in [resource.day_column] + resource.order if c not in columns]
+    after = tuple_(*order) > tuple_(
+        *[bindparam(f'after_{i}', type_=c.type) for i, c in enumerate(order)]
+    )
+    page = select([table.c[c] for c in columns + extra]).where(where)
+    # streamed from a server-side cursor, so memory stays flat however long the range
+    page = page.order_by(*order).limit(bindparam('limit')).execution_options(stream_results=True)
+    return Statements(day, page, page.where(after))
+
+
+def _union_selects(branches: List[Tuple[Any, Dict[str, Any]]]) -> List:
+    """One SELECT per (resource expression, {label: column}) branch, padded for a UNION.
+
+    Every select has a `resource` column and every label of every branch, in the same order;
+    labels belonging to other branches are NULL.
+    """
+    types = {}
+    for _, columns in branches:
+        for label, column in columns.items():
+            types.setdefault(label, column.type)
+
+    return [
+        select(
+            [resource.label('resource')] + [
+                columns[label].label(label) if label in columns else cast(null(), type).label(label)
+                for label, type in types.items()
+            ]
+        ) for resource, columns in branches
+    ]
+
+
+def select_days(views: List[View], email: str, day: date):
+    """A single UNION ALL statement reading a day from several resources' views.
+
+    Rows carry a `resource` column naming their resource; columns belonging to
+    other resources are NULL.
+    """
+    resources = [v.resource for v in views]
+    selects = _union_selects(
+        [
+            # as in the view's day statement, always at least one column
+            (literal(r.name), {c: r.model.__table__.c[c] for c in v.columns or [r.day_column]})
+            for r, v in zip(resources, views)
+        ]
+    )
+    return union_all(*[s.where(r.on_day(email, day)) for s, r in zip(selects, resources)])
+
+
+def select_changes(resources: List[Resource], email: str, since: int, limit: int):
+    """The first `limit` rows and tombstones changed after `since`, in changeSeq order.
+
+    Tombstone rows have a `key` column; other rows are NULL there.
+    """
+    branches, wheres = [], []
+    for r in resources:
+        table = r.model.__table__
+        labels = r.columns + [c for c in r.key_columns + [r.day_column] if c not in r.columns]
+        branches.append(
+            (literal(r.name), dict({c: table.c[c] for c in labels}, changeSeq=table.c.changeSeq))
+        )
+        wheres.append((table.c.email == email) & (table.c.changeSeq > since))
+    tombstones = Tombstone.__table__
+    branches.append(
+        (tombstones.c.resource, {
+            'key': tombstones.c.key,
+            'changeSeq': tombstones.c.changeSeq
+        })
+    )
+    wheres.append((tombstones.c.email == email) & (tombstones.c.changeSeq > since))
+
+    # each branch is limited on its own (email, changeSeq) index before the rows are merged
+    branches = [
+        select([s.where(where).order_by('changeSeq').limit(limit).alias()])
+        for s, where in zip(_union_selects(branches), wheres)
+    ]
+    return union_all(*branches).order_by('changeSeq').limit(limit)
+
+
+resources: Dict[str, Resource] = {
+    resource.name: resource
+    for resource in [
+        Resource(
+            name='food',
+            path='food',
+            label='food',
+            read_message='Returning all commutes found for {date}',
+            model=Food,
+            content={
+                'name': str,
+                # nullable columns, which clients have always been able to send as null
+                'quantity': nullable(float),
+                'quantityUnits': nullable(str),
+                'calories': nullable(int),
+                'category': nullable(str),
+                'mealTime': datetime
+            },
+            row=lambda email, content, metadata: {
+                'email': email,
+                'name': content['name'],
+                'mealTime': content['mealTime'],
+                'quantity': content['quantity'],
+                'quantityUnits': content['quantityUnits'],
+                'calories': content['calories'],
+                'category': content['category']
+            },
+            day_column='mealTime',
+            order=['mealTime', 'name'],
+            fields={
+                'name': 'name',
+                'quantity': 'quantity',
+                'quantityUnits': 'quantityUnits',
+                'calories': 'calories',
+                'category': 'category',
+                'mealTime': 'mealTime'
+            }
+        ),
+        Resource(
+            name='commute',
+            path='commute',
+            label='commute',
+            read_message='Returning all commutes found for {date}',
+            model=Commute,
+            content={
+                'arrival': datetime,
+                'departure': datetime,
+                'method': str,
+                'distance': float
+            },
+            row=lambda email, content, metadata: {
+                'email': email,
+                'arrival': content['arrival'],
+                'departure': content['departure'],
+                'method': content['method'],
+                'distance': content['distance']
+            },
+            day_column='arrival',
+            order=['arrival'],
+            fields={
+                'method': 'method',
+                'distance': 'distance',
+                'departure': 'departure',
+                'arrival': 'arrival'
+            }
+        ),
+        Resource(
+            name='journal',
+            path='journal',
+            label='journal entry',
+            read_message='Returning all journals found for {date}',
+            model=JournalEntry,
+            content={
+                'title': str,
+                'contents': str
+            },
+            row=lambda email, content, metadata: {
+                'email': email,
+                'title': content['title'],
+                'created': metadata['timestamp'],
+                'content': content['contents']
+            },
+            day_column='created',
+            order=['created', 'title'],
+            fields={
+                'contents': 'content',
+                'title': 'title',
+                'created': 'created',
+                'edited': 'edited'
+            },
+            update=lambda content: edit_journal
+        ),
+        Resource(
+            name='water',
+            path='water',
+            label='water entry',
+            read_message='Returning water consumption for {date}',
+            model=WaterCups,
+            content={
+                'isIncrement': bool,
+                'cups': int
+            },
+            row=lambda email, content, metadata: {
+                'email': email,
+                'date': _day(metadata),
+                'count': content['cups']
+            },
+            day_column='date',
+            order=['date'],
+            fields={'cupsCount': 'count'},
+            empty={
+                'cupsCount': 0,
+                'isIncrement': False
+            },
+            update=lambda content: increment_water if content['isIncrement'] else None,
+            # reads report the day's total, never an increment
+            constant={'isIncrement': False}
+        ),
+        Resource(
+            name='shower',
+            path='showers',
+            label='shower entry',
+            read_message='Returning shower usage for {date}',
+            model=ShowerUsage,
+            content={
+                'cold': bool,
+                'minutes': int
+            },
+            row=lambda email, content, metadata: {
+                'email': email,
+                'date': _day(metadata),
+                'minutes': content['minutes'],
+                'cold': content['cold']
+            },
+            day_column='date',
+            order=['date'],
+            fields={
+                'minutes': 'minutes',
+                'cold': 'cold'
+            },
+            empty={
+                'minutes': 0,
+                'cold': False
+            }
+        ),
+        Resource(
+            name='entertainment',
+            path='entertainment',
+            label='entertainment entry',
+            read_message='Returning entertainment usage for {date}',
+            model=EntertainmentUsage,
+            content={'hours': int},
+            row=lambda email, content, metadata: {
+                'email': email,
+                'date': _day(metadata),
+                'hours': content['hours']
+            },
+            day_column='date',
+            order=['date'],
+            fields={'hours': 'hours'},
+            empty={'hours': 0}
+        ),
+        Resource(
+            name='health',
+            path='health',
+            label='health entry',
+            read_message='Returning health  for {date}',
+            model=Health,
+            content={'cigarettes': int},
+            row=lambda email, content, metadata: {
+                'email': email,
+                'date': _day(metadata),
+                'cigarettes': content['cigarettes']
+            },
+            day_column='date',
+            order=['date'],
+            fields={'cigarettes': 'cigarettes'},
+            empty={'cigarettes': 0}
+        ),
+    ]
+}
+
+def _bounded(resource: Resource) -> Dict[str, Any]:
+    """The resource's content spec, with strings limited to the length of their columns."""
+    content, table = dict(resource.content), resource.model.__table__
+    for field, spec in content.items():
+        kind = spec.spec if isinstance(spec, nullable) else spec
+        length = getattr(table.c[field].type, 'length', None) if field in table.c else None
+        if kind is str and length:
+            content[field] = nullable(string(length)) if kind is not spec else string(length)
+    return content
+
+
+# request schemas for each resource, compiled once at import
+write_schemas: Dict[str, Schema] = {
+    name: Schema({
+        'content': _bounded(resource),
+        'metadata': METADATA,
+        'token': TOKEN
+    })
+    for name, resource in resources.items()
+}
+record_schemas: Dict[str, Schema] = {
+    name: Schema({
+        'type': str,
+        'content': _bounded(resource),
+        'metadata': METADATA
+    })
+    for name, resource in resources.items()
+}
+
+# (resource name, fields) -> its View, built on first use
+_views: Dict[Tuple[str, Tuple[str, ...]], View] = {}
+
+for name, schema in write_schemas.items():
+    category_routes(resources[name], schema)
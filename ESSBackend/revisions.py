@@ -0,0 +1,40 @@
+# Per-day revision counters, stored in day_revisions.
+#
+# Writers bump the counter of every (email, date) they touch, in the same transaction as the
+# write. Per-day reads send it as an ETag, so a client polling an unchanged day gets a 304
+# after one indexed integer lookup, without any rows being loaded or serialized.
+
+from ESSBackend.app import db
+from ESSBackend.models import DayRevision
+from ESSBackend.upsert import upsert_many
+from datetime import date
+from sqlalchemy import bindparam, select
+from typing import Iterable, Tuple
+
+
+def _increment(table, excluded):
+    return {'revision': table.c.revision + 1}
+
+
+def bump(days: Iterable[Tuple[str, date]]):
+    """Bump the revision of each (email, day). The caller commits."""
+    # a fixed order, so concurrent writers lock the same rows in the same order
+    rows = [{'email': email, 'date': day, 'revision': 1} for email, day in sorted(set(days))]
+    if rows:
+        upsert_many(DayRevision, rows, _increment)
+
+
+_table = DayRevision.__table__
+_revision = select([_table.c.revision]) \
+    .where((_table.c.email == bindparam('email')) & (_table.c.date == bindparam('date')))
+
+
+def revision(email: str, day: date) -> int:
+    """The day's current revision; 0 for a day that has never been written."""
+    return db.execute(_revision, {'email': email, 'date': day}).scalar() or 0
+
+
+def etag(category: str, day: date, revision: int, format: str = 'json') -> str:
+    # each encoding of a response is a different representation, with its own tag
+    suffix = '' if format == 'json' else f'-{format}'
+    return f'{category}-{day.isoformat()}-{revision}{suffix}'
@@ -0,0 +1,152 @@
+# Per-day scorecard rollups, stored in daily_summaries.
+#
+# Writers call refresh() for each (resource, day) they touch, or refresh_days() for many, in
+# the same transaction, which recomputes just that resource's columns from those days' rows.
+# Reading a scorecard is then one indexed row per day, rather than a scan of every raw record.
+#
+# `python -m ESSBackend.scorecard` rebuilds the whole table from the raw tables.
+
+from ESSBackend.app import db, parse_day
+from ESSBackend.models import DailySummary
+from ESSBackend.resources import Resource, resources
+from ESSBackend.upsert import upsert, upsert_many
+from datetime import date, datetime
+from itertools import groupby, islice
+from sqlalchemy import func, or_, select
+from typing import Iterable, List
+
+# summary column -> aggregate over a resource's rows for one day
+AGGREGATES = {
+    'food': {
+        'calories': lambda table: func.sum(table.c.calories)
+    },
+    'water': {
+        'waterCups': lambda table: func.sum(table.c.count)
+    },
+    'shower': {
+        'showerMinutes': lambda table: func.sum(table.c.minutes)
+    },
+    'entertainment': {
+        'entertainmentHours': lambda table: func.sum(table.c.hours)
+    },
+    'health': {
+        'cigarettes': lambda table: func.sum(table.c.cigarettes)
+    },
+}
+# commutes are summarized per method, as commuteByMethod and its total commuteDistance
+SUMMARIZED = set(AGGREGATES) | {'commute'}
+
+
+def day_of(value) -> date:
+    """The day of a row's day column, whether it's still a request string or already parsed."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return parse_day(value[:10])
+
+
+def refresh(resource: Resource, email: str, day: date):
+    """Recompute `resource`'s summary columns for one user and day. The caller commits."""
+    if resource.name not in SUMMARIZED:
+        return
+
+    table = resource.model.__table__
+    where = resource.on_day(email, day)
+    row = {'email': email, 'date': day}
+    if resource.name == 'commute':
+        by_method = select([table.c.method, func.sum(table.c.distance)]).where(where)
+        row.update(_commute_columns(db.execute(by_method.group_by(table.c.method))))
+    else:
+        aggregates = AGGREGATES[resource.name]
+        totals = select([func.coalesce(f(table), 0).label(c) for c, f in aggregates.items()])
+        row.update(db.execute(totals.where(where)).first())
+
+    upsert(DailySummary, row)
+
+
+def refresh_days(resource: Resource, email: str, days: Iterable[date]):
+    """refresh() for several days of one user: one grouped query and one multi-row upsert.
+
+    The caller commits.
+    """
+    days = sorted(set(days))
+    if resource.name not in SUMMARIZED or not days:
+        return
+
+    table = resource.model.__table__
+    where = _on_days(resource, email, days)
+    day = resource.day().label('date')
+    # days left without rows get zeros, as refresh() gives them
+    rows = {d: {'email': email, 'date': d} for d in days}
+    if resource.name == 'commute':
+        by_method = select([day, table.c.method, func.sum(table.c.distance)]).where(where)
+        results = db.execute(by_method.group_by(day, table.c.method).order_by(day))
+        by_day = {
+            day_of(when): _commute_columns(r[1:] for r in group)
+            for when, group in groupby(results, lambda r: r[0])
+        }
+        for d, row in rows.items():
+            row.update(by_day.get(d) or _commute_columns([]))
+    else:
+        aggregates = AGGREGATES[resource.name]
+        totals = [func.coalesce(f(table), 0).label(c) for c, f in aggregates.items()]
+        totals = select([day] + totals).where(where).group_by(day)
+        by_day = {day_of(r.date): r for r in db.execute(totals)}
+        for d, row in rows.items():
+            row.update({c: by_day[d][c] if d in by_day else 0 for c in aggregates})
+
+    upsert_many(DailySummary, list(rows.values()))
+
+
+def _on_days(resource: Resource, email: str, days: List[date]):
+    """WHERE clause for this user's rows on the given sorted days, and none between them.
+
+    Each run of consecutive days is one indexed range, so a batch touching two days a year
+    apart reads those two days' rows, not the year's.
+    """
+    runs = groupby(enumerate(days), lambda pair: pair[1].toordinal() - pair[0])
+    runs = [[d for _, d in run] for _, run in runs]
+    return or_(*(resource.on_days(email, run[0], run[-1]) for run in runs))
+
+
+def _commute_columns(by_method):
+    by_method = {method: distance for method, distance in by_method}
+    return {'commuteDistance': sum(by_method.values()), 'commuteByMethod': by_method}
+
+
+def rebuild(chunk_size: int = 1000):
+    """Recompute every summary from the raw tables, streaming grouped aggregates in chunks."""
+    db.execute(DailySummary.__table__.delete())
+
+    for name in SUMMARIZED:
+        resource = resources[name]
+        table = resource.model.__table__
+        day = resource.day().label('date')
+
+        if name == 'commute':
+            query = select([table.c.email, day, table.c.method, func.sum(table.c.distance)])
+            query = query.group_by(table.c.email, day, table.c.method).order_by(table.c.email, day)
+            results = db.execute(query.execution_options(stream_results=True))
+            rows = (
+                dict(email=email, date=day_of(when), **_commute_columns(r[2:] for r in group))
+                for (email, when), group in groupby(results, lambda r: (r[0], r[1]))
+            )
+        else:
+            # a day whose rows are all null sums to 0, as in refresh()
+            columns = [func.coalesce(f(table), 0).label(c) for c, f in AGGREGATES[name].items()]
+            query = select([table.c.email, day] + columns).group_by(table.c.email, day)
+            results = db.execute(query.execution_options(stream_results=True))
+            rows = (dict(r, date=day_of(r.date)) for r in results)
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            upsert_many(DailySummary, chunk)
+
+    db.commit()
+
+
+if __name__ == '__main__':
+    rebuild()
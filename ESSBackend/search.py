@@ -0,0 +1,239 @@
+# Full-text search over journal entries (/api/journal/search).
+#
+# On postgres, each entry has a tsvector of its title and content in journal_search, under a
+# GIN index, and a search is a plainto_tsquery match ranked by ts_rank. The writers build the
+# tsvector from the text in the request, since journals.content may be stored compressed
+# (see compressed.py), where the database can't read it.
+#
+# Other dialects (sqlite, for local testing) have an inverted index instead: journal_terms
+# holds a row per (user, term, entry), tokenized and ranked here along the same lines (every
+# word must match; title words count for more), but without postgres's stemming. A search of
+# several words reads each one's postings best first, a batch at a time, looking up the other
+# words' weights for each entry it meets, and stops as soon as no entry it hasn't met could
+# rank on the page (Fagin's threshold algorithm), so common words aren't read to the end.
+#
+# Writers call index() for the journal rows they upsert, and unindex() for a deleted one, in
+# the same transaction. `python -m ESSBackend.search` rebuilds the index from the journals.
+
+from ESSBackend.app import db
+from ESSBackend.models import JournalEntry, JournalSearch, JournalTerm
+from ESSBackend.resources import Resource, resources
+from collections import defaultdict
+from itertools import groupby, islice
+from sqlalchemy import Integer, String, bindparam, func, select, text as sql_text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Any, Dict, List, Tuple
+
+import heapq
+import json
+import math
+import re
+
+CONFIG = 'english'  # postgres text search configuration
+# postgres's default weights for A (titles) and B (contents), which ts_rank uses
+WEIGHTS = {'title': 1.0, 'content': 0.4}
+
+# postgres's english stop words, which never match
+STOPWORDS = frozenset(
+    '''
+    a about above after again against all am an and any are as at be because been before being
+    below between both but by can did do does doing don down during each few for from further
+    had has have having he her here hers herself him himself his how i if in into is it its
+    itself just me more most my myself no nor not now of off on once only or other our ours
+    ourselves out over own s same she should so some such t than that the their theirs them
+    themselves then there these they this those through to too under until up very was we were
+    what when where which while who whom why will with you your yours yourself yourselves
+    '''.split()
+)
+_WORD = re.compile(r'\w+')
+
+_search = JournalSearch.__table__
+_terms = JournalTerm.__table__
+_TERM_LENGTH = _terms.c.term.type.length
+_BATCH = 100  # postings read from each word at a time
+
+# a word's postings, best first, from the rank index
+_postings = select([_terms.c.title, _terms.c.weight]).where(
+    (_terms.c.email == bindparam('email')) & (_terms.c.term == bindparam('term'))
+).order_by(_terms.c.weight.desc(), _terms.c.title)
+# some entries' postings for a word, given as a JSON list of titles. As `title IN (...)`,
+# sqlite reads these from the rank index, through every posting of the word; a CROSS JOIN
+# keeps the titles as the outer loop, so each is one lookup by primary key
+_lookup = sql_text(
+    f'SELECT t.title, t.weight FROM json_each(:titles) AS v CROSS JOIN {_terms.name} AS t '
+    'WHERE t.email = :email AND t.title = v.value AND t.term = :term'
+)
+
+_query = func.plainto_tsquery(CONFIG, bindparam('query', type_=String))
+_rank = func.ts_rank(_search.c.document, _query).label('rank')
+_ranked = select([_search.c.title, _rank]).where(
+    (_search.c.email == bindparam('email')) & _search.c.document.op('@@')(_query)
+).order_by(_rank.desc(), _search.c.title).offset(bindparam('offset', type_=Integer)) \
+    .limit(bindparam('limit', type_=Integer))
+
+
+def _postgres() -> bool:
+    return db.get_bind().dialect.name == 'postgresql'
+
+
+def terms(text: str) -> List[str]:
+    """The words of `text` that the fallback index holds, lowercased, in order."""
+    return [
+        word for word in _WORD.findall(text.lower())
+        if word not in STOPWORDS and len(word) <= _TERM_LENGTH
+    ]
+
+
+def _weights(title: str, content: str) -> Dict[str, float]:
+    weights = defaultdict(float)
+    for field, text in (('title', title), ('content', content)):
+        for term in terms(text):
+            weights[term] += WEIGHTS[field]
+    return weights
+
+
+def _document(title: str, content: str):
+    return func.setweight(func.to_tsvector(CONFIG, title), 'A') \
+        .op('||')(func.setweight(func.to_tsvector(CONFIG, content), 'B'))
+
+
+def index(resource: Resource, email: str, rows: List[Dict[str, Any]]):
+    """(Re-)index the given journal rows of one user, with distinct titles. The caller commits."""
+    if resource.name != 'journal' or not rows:
+        return
+
+    if _postgres():
+        stmt = pg_insert(_search).values(
+            [
+                {
+                    'email': email,
+                    'title': row['title'],
+                    'document': _document(row['title'], row['content'])
+                } for row in rows
+            ]
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['email', 'title'], set_={'document': stmt.excluded.document}
+            )
+        )
+        return
+
+    titles = [row['title'] for row in rows]
+    db.execute(_terms.delete().where((_terms.c.email == email) & _terms.c.title.in_(titles)))
+    postings = [
+        {
+            'email': email,
+            'term': term,
+            'title': row['title'],
+            'weight': weight
+        } for row in rows for term, weight in _weights(row['title'], row['content']).items()
+    ]
+    if postings:
+        db.execute(_terms.insert(), postings)
+
+
+def unindex(resource: Resource, email: str, key: Dict[str, Any]):
+    """Drop a deleted journal entry from the index. The caller commits."""
+    if resource.name != 'journal':
+        return
+    table = _search if _postgres() else _terms
+    db.execute(table.delete().where((table.c.email == email) & (table.c.title == key['title'])))
+
+
+def search(email: str, text: str, offset: int, limit: int) -> List[Tuple[str, float]]:
+    """A page of (title, rank) of the user's entries matching every word of `text`, best first."""
+    if _postgres():
+        params = {'email': email, 'query': text, 'offset': offset, 'limit': limit}
+        return [tuple(row) for row in db.execute(_ranked, params)]
+
+    words = sorted(set(terms(text)))
+    if not words:
+        return []
+    if len(words) > 1:
+        return _search_all(email, words, offset + limit)[offset:]
+
+    query = _postings.offset(offset).limit(limit)
+    params = {'email': email, 'term': words[0]}
+    return [(entry, round(rank, 6)) for entry, rank in db.execute(query, params)]
+
+
+def _search_all(email: str, words: List[str], count: int) -> List[Tuple[str, float]]:
+    """The first `count` entries matching all of several words, best first."""
+    lists = [db.execute(_postings, {'email': email, 'term': word}) for word in words]
+    met, ranks, best = set(), {}, []  # entries met, and the ranks of those matching every word
+    floors = [math.inf] * len(words)  # the lowest weight read of each word
+    try:
+        while True:
+            read, exhausted = defaultdict(dict), False  # entries met now -> {word: weight}
+            ceilings = list(floors)  # what they can weigh for the words they weren't read of
+            for i, postings in enumerate(lists):
+                rows = postings.fetchmany(_BATCH)
+                # every entry matching all the words is in this word's postings, now all met
+                exhausted = exhausted or len(rows) < _BATCH
+                if rows:
+                    floors[i] = rows[-1].weight
+                for title, weight in rows:
+                    if title not in met:
+                        read[title][i] = weight
+            met.update(read)
+
+            if len(best) == count:  # only look up entries that could still make the page
+                end = best[-1][1]
+                read = {
+                    title: weights
+                    for title, weights in read.items()
+                    if round(sum(weights.get(i, c) for i, c in enumerate(ceilings)), 6) >= end
+                }
+            ranks.update(_ranks(email, words, read))
+
+            best = heapq.nsmallest(count, ranks.items(), key=lambda entry: (-entry[1], entry[0]))
+            # an entry not met yet weighs no more than the floor for each word
+            if exhausted or len(best) == count and best[-1][1] > round(sum(floors), 6):
+                return best
+    finally:
+        for postings in lists:
+            postings.close()
+
+
+def _ranks(email: str, words: List[str], read: Dict[str, Dict[int, float]]) -> Dict[str, float]:
+    """The ranks of the entries matching every word, given the weights already read of them."""
+    for i, word in enumerate(words):
+        missing = [title for title, weights in read.items() if i not in weights]
+        if missing:
+            params = {'email': email, 'term': word, 'titles': json.dumps(missing)}
+            for title, weight in db.execute(_lookup, params):
+                read[title][i] = weight
+        # entries without this word don't match, so aren't looked up for the rest
+        read = {title: weights for title, weights in read.items() if i in weights}
+    return {title: round(sum(weights.values()), 6) for title, weights in read.items()}
+
+
+def entries(view, email: str, titles: List[str]) -> Dict[str, Any]:
+    """The rows of a journal view (see resources.py) for the given entries, by title."""
+    table = JournalEntry.__table__
+    query = select([table.c[c] for c in view.columns] + [table.c.title.label('entry')])
+    query = query.where((table.c.email == email) & table.c.title.in_(titles))
+    return {row.entry: row for row in db.execute(query)}
+
+
+def rebuild(chunk_size: int = 500):
+    """Index every journal entry from scratch."""
+    db.execute((_search if _postgres() else _terms).delete())
+
+    table = JournalEntry.__table__
+    query = select([table.c.email, table.c.title, table.c.content]).order_by(table.c.email)
+    results = db.execute(query.execution_options(stream_results=True))
+    for email, rows in groupby(results, lambda r: r.email):
+        rows = (dict(row) for row in rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            index(resources['journal'], email, chunk)
+
+    db.commit()
+
+
+if __name__ == '__main__':
+    rebuild()
@@ -0,0 +1,105 @@
+# Stateless login tokens.
+#
+# A token is {'email', 'expiry', 'hash'}, where hash is an HMAC-SHA256 of expiry + email.
+# The first key in the keyring signs new tokens; older keys are still accepted,
+# so ESS_SECRET can be rotated without logging everyone out.
+#
+# Verified tokens are kept in a small per-worker LRU so repeat requests skip the HMAC.
+# Revoked tokens (logout) are held in memory for O(1) checks,
+# persisted to the revoked_tokens table, and re-read from it every
+# TOKEN_REVOCATION_SYNC seconds so that every uwsgi worker eventually sees them.
+
+from ESSBackend.config import Config
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Optional
+
+import hashlib
+import hmac
+import time
+
+EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_keyring = [key.encode('utf-8') for key in [Config.SECRET_KEY] + Config.OLD_SECRET_KEYS]
+
+_lock = Lock()
+_verified: Dict[tuple, datetime] = OrderedDict()  # (hash, expiry, email) -> expiry
+_revoked_hashes: Dict[str, datetime] = {}  # hash -> expiry
+_synced_at = None
+
+
+def _sign(key: bytes, expiry: str, email: str) -> str:
+    return hmac.new(key, (expiry + email).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def issue_token(email: str) -> Dict[str, str]:
+    expiry = (datetime.utcnow() + Config.TOKEN_TIMEOUT).strftime(EXPIRY_FORMAT)
+    return {'hash': _sign(_keyring[0], expiry, email), 'email': email, 'expiry': expiry}
+
+
+def verify_token(token: Dict[str, str]) -> Optional[str]:
+    """Returns None for a valid token, otherwise the reason it was rejected."""
+    key = (token['hash'], token['expiry'], token['email'])
+    with _lock:
+        expiry = _verified.get(key)
+        if expiry:
+            _verified.move_to_end(key)
+
+    if not expiry:
+        try:
+            expiry = datetime.strptime(token['expiry'], EXPIRY_FORMAT)
+        except (TypeError, ValueError):
+            return 'Invalid Token'
+        # as bytes: compare_digest raises on a str that isn't ASCII
+        given = token['hash'].encode('utf-8')
+        if not any(
+            hmac.compare_digest(_sign(k, token['expiry'], token['email']).encode('ascii'), given)
+            for k in _keyring
+        ):
+            return 'Invalid Token'
+        with _lock:
+            _verified[key] = expiry
+            if len(_verified) > Config.TOKEN_CACHE_SIZE:
+                _verified.popitem(last=False)
+
+    if expiry <= datetime.utcnow():
+        return 'Token Expired'
+
+    _sync_revocations()
+    if token['hash'] in _revoked_hashes:
+        return 'Token Revoked'
+    return None
+
+
+def revoke_token(token: Dict[str, str]):
+    """Revoke a single token, e.g. on logout. The caller commits."""
+    expiry = datetime.strptime(token['expiry'], EXPIRY_FORMAT)
+    with _lock:
+        _revoked_hashes[token['hash']] = expiry
+    _store_revocation(token['email'], token['hash'], datetime.utcnow(), expiry)
+
+
+def _store_revocation(email: str, hash: str, revoked: datetime, expiry: datetime):
+    from ESSBackend.models import RevokedToken
+    from ESSBackend.upsert import upsert
+
+    RevokedToken.query.filter(RevokedToken.expiry < datetime.utcnow()).delete()
+    upsert(RevokedToken, {'email': email, 'hash': hash, 'revoked': revoked, 'expiry': expiry})
+
+
+def _sync_revocations():
+    global _synced_at
+    if _synced_at and time.monotonic() - _synced_at < Config.TOKEN_REVOCATION_SYNC:
+        return
+    _synced_at = time.monotonic()
+
+    from ESSBackend.models import RevokedToken
+
+    revocations = RevokedToken.query.filter(RevokedToken.expiry > datetime.utcnow()).all()
+    now = datetime.utcnow()
+    with _lock:
+        for revocation in revocations:
+            _revoked_hashes[revocation.hash] = revocation.expiry
+        for hash in [h for h, expiry in _revoked_hashes.items() if expiry <= now]:
+            del _revoked_hashes[hash]
@@ -0,0 +1,75 @@
+# Brings a database created by an earlier version up to date with models.py.
+#
+# db_init (create_all) creates the tables that are missing, but leaves the ones already there
+# as they are. On an existing database that misses what has since been added to them:
+# - the (email, day) read indexes on foods and journals
+# - changeSeq, and its (email, changeSeq) index, on every category table (delta sync)
+#
+# `python -m ESSBackend.upgrade` adds whatever columns, indexes and tables are missing, then
+# fills in what the new ones derive from the rows already there: change sequences, and, for
+# tables it just created, the daily summaries and the journal search index. It can be run
+# again safely. Stop the app while it runs: it rewrites those tables, and postgres blocks
+# writes to a table while indexing it. (JOURNAL_COMPRESSION has its own migration; see
+# compressed.py.)
+
+from ESSBackend.app import Base, engine
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from typing import List
+
+
+def add_missing(connection) -> List[str]:
+    """Create the tables, columns and indexes models.py has and the database doesn't.
+
+    Returns what was created, as 'table <name>', 'column <table>.<name>' or 'index <name>'.
+    """
+    import ESSBackend.models
+
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    added = [f'table {t.name}' for t in Base.metadata.sorted_tables if t.name not in existing]
+    Base.metadata.create_all(bind=connection)
+
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                # e.g. "changeSeq" BIGINT DEFAULT '0' NOT NULL, which fills in existing rows
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(
+                    f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}'
+                )
+                added.append(f'column {table.name}.{column.name}')
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=connection)
+                added.append(f'index {index.name}')
+    return added
+
+
+def upgrade():
+    from ESSBackend.changes import backfill
+    from ESSBackend.models import DailySummary, JournalSearch, JournalTerm
+    from ESSBackend import scorecard, search
+
+    with engine.begin() as connection:
+        added = add_missing(connection)
+    for what in added:
+        print(f'Added {what}')
+
+    # rows written before changeSeq existed are left at 0, which a full sync would skip
+    backfill()
+    if f'table {DailySummary.__tablename__}' in added:
+        scorecard.rebuild()
+        print('Rebuilt daily summaries')
+    if {f'table {JournalSearch.__tablename__}', f'table {JournalTerm.__tablename__}'} & set(added):
+        search.rebuild()
+        print('Rebuilt the journal search index')
+
+
+if __name__ == '__main__':
+    upgrade()
@@ -0,0 +1,98 @@
+# Single-statement insert-or-update for the /new endpoints.
+#
+# On postgres this is INSERT ... ON CONFLICT DO UPDATE, which both avoids the
+# SELECT-then-write round trips and can't race into an IntegrityError.
+# Other dialects (sqlite, for local testing) fall back to an UPDATE,
+# followed by an INSERT when no existing row matched.
+#
+# Single-row upserts reuse one statement per (table, SET clause, columns, returning),
+# executed with the row as its parameters, so postgres statements are compiled only once.
+
+from ESSBackend.app import db
+from sqlalchemy import and_, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Any, Callable, Dict, List, Sequence
+
+_statements = {}  # (table, update, columns, returning) -> single-row upsert statement
+
+
+def upsert(model, row: Dict[str, Any], update: Callable = None, returning: Sequence[str] = ()):
+    """Insert `row` into the model's table, or update the row sharing its primary key.
+
+    `update(table, excluded)` returns the SET clause used on conflict,
+    where `excluded` maps column names to the values proposed in `row`.
+    By default every non-key column in `row` is overwritten.
+
+    Returns True if a new row was inserted, False if an existing one was updated.
+    If `returning` names columns, returns (inserted, *values of those columns) instead.
+    Runs inside the current session transaction; the caller commits.
+    """
+    if db.get_bind().dialect.name != 'postgresql':
+        return upsert_many(model, [row], update, returning)[0]
+
+    table = model.__table__
+    key = (table, update, tuple(sorted(row)), tuple(returning))
+    stmt = _statements.get(key)
+    if stmt is None:
+        # no VALUES: the insert takes its columns from the parameters it's executed with
+        stmt = _statements[key] = _pg_upsert(pg_insert(table), table, row, update, returning)
+    result = db.execute(stmt, row).first()
+    return tuple(result) if returning else result[0]
+
+
+def upsert_many(
+    model, rows: List[Dict[str, Any]], update: Callable = None, returning: Sequence[str] = ()
+) -> List:
+    """Multi-row `upsert`, returning a result for each row, in the order of `rows`.
+
+    All rows must set the same columns, and no two rows may share a primary key.
+    """
+    if not rows:
+        return []
+
+    table = model.__table__
+    keys = [column.name for column in table.primary_key.columns]
+    if db.get_bind().dialect.name == 'postgresql':
+        # RETURNING rows come back in no documented order, so each also returns its key
+        stmt = _pg_upsert(
+            pg_insert(table).values(rows), table, rows[0], update, list(returning) + keys
+        )
+        results = _by_key(rows, keys, db.execute(stmt))
+        return [tuple(result) if returning else result[0] for result in results]
+
+    update = update or _overwrite(keys, rows[0])
+    return [_upsert_fallback(table, keys, row, update, returning) for row in rows]
+
+
+def _by_key(rows: List[Dict[str, Any]], keys: List[str], results) -> List[Sequence]:
+    """RETURNING results, ending with the key columns, matched up with the rows they're for."""
+    returned = {}
+    for result in results:
+        result = tuple(result)
+        returned[result[-len(keys):]] = result[:-len(keys)]
+    return [returned[tuple(row[k] for k in keys)] for row in rows]
+
+
+def _overwrite(keys: List[str], row: Dict[str, Any]) -> Callable:
+    return lambda table, excluded: {c: excluded[c] for c in row if c not in keys}
+
+
+def _pg_upsert(stmt, table, row: Dict[str, Any], update: Callable, returning):
+    keys = [column.name for column in table.primary_key.columns]
+    update = update or _overwrite(keys, row)
+    stmt = stmt.on_conflict_do_update(index_elements=keys, set_=update(table, stmt.excluded))
+    # xmax is only zero for a row version created by an insert
+    return stmt.returning(literal_column('(xmax = 0)'), *[table.c[c] for c in returning])
+
+
+def _upsert_fallback(table, keys: List[str], row: Dict[str, Any], update: Callable, returning):
+    excluded = {c: literal(v, type_=table.c[c].type) for c, v in row.items()}
+    match = and_(*[table.c[k] == row[k] for k in keys])
+    inserted = not db.execute(table.update().where(match).values(update(table, excluded))).rowcount
+    if inserted:
+        db.execute(table.insert().values(**row))
+
+    if not returning:
+        return inserted
+    values = db.execute(select([table.c[c] for c in returning]).where(match)).first()
+    return (inserted, ) + tuple(values)
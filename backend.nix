@@ -111,6 +111,7 @@
                 self.flask
                 self.flask_migrate
                 self.flask_sqlalchemy
+                self.numpy
                 self.psycopg2
                 self.sqlalchemy
                 ESSBackend
@@ -121,7 +122,16 @@
               # module = "ESSBackend.wsgi";
               socket = "/run/uwsgi/ESSBackend.sock";
               chmod-socket = "666";
-              env = [ "ESS_SECRET=${secret}" ];
+              # each worker serves one request at a time; at most 2 of them hash passwords at once
+              # (BCRYPT_SLOTS), so logins never occupy all 4
+              processes = 4;
+              # the workers add up their /api/metrics counts through files in one directory,
+              # and share the password hashing slots through lock files in the other
+              env = [
+                "ESS_SECRET=${secret}"
+                "ESS_METRICS_DIR=/run/uwsgi/ESSBackend-metrics"
+                "ESS_BCRYPT_DIR=/run/uwsgi/ESSBackend-bcrypt"
+              ];
             };
           };
         };
@@ -134,6 +144,7 @@
             ps.flask
             ps.flask_migrate
             ps.flask_sqlalchemy
+            ps.numpy
             ps.psycopg2
             ps.sqlalchemy
             ESSBackend
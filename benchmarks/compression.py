@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Storage and latency of compressed journal contents (ESSBackend/compressed.py)
+# on a synthetic corpus of journal entries.
+#
+#   python benchmarks/compression.py [--entries 5000] [--threshold 512]
+#
+# Entries are Zipf-distributed made-up words with a long-tailed length distribution (median
+# around 1 KB, a few of 20 KB or more); real prose, with its repeated phrases, compresses
+# somewhat better. For each codec, the corpus is written to a fresh sqlite table using the
+# CompressedText column type; the table's file size and the time to read every entry back
+# (decompressed) are reported, as well as the codec's own compress/decompress cost per entry.
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+from ESSBackend.compressed import CompressedText, codecs, zstandard
+from sqlalchemy import Column, Integer, MetaData, Table, Text, create_engine, select
+
+
+def corpus(entries: int, rng: random.Random):
+    letters = 'etaoinshrdlucmfwypvbgkjqxz'
+    vocabulary = [
+        ''.join(rng.choice(letters[:rng.randint(8, 26)]) for _ in range(rng.randint(1, 10)))
+        for _ in range(3000)
+    ]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    texts = []
+    for _ in range(entries):
+        words = rng.choices(vocabulary, weights, k=max(5, int(rng.lognormvariate(5.2, 1.0))))
+        sentences = [
+            ' '.join(words[i:i + 12]).capitalize() + '.' for i in range(0, len(words), 12)
+        ]
+        texts.append(' '.join(sentences))
+    return texts
+
+
+def run(name, column_type, texts):
+    _, path = tempfile.mkstemp(suffix='.db')
+    try:
+        engine = create_engine(f'sqlite:///{path}')
+        table = Table(
+            'journals', MetaData(), Column('id', Integer, primary_key=True),
+            Column('content', column_type)
+        )
+        table.create(engine)
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(table.insert(), [{'content': text} for text in texts])
+        write = time.perf_counter() - start
+
+        engine.execute('VACUUM')
+        start = time.perf_counter()
+        # row values are converted (here, decompressed) as they're accessed
+        contents = [content for content, in engine.execute(select([table.c.content]))]
+        read = time.perf_counter() - start
+        assert contents == texts
+
+        return {
+            'name': name,
+            'fileBytes': os.path.getsize(path),
+            'writeMicrosecondsPerEntry': round(write / len(texts) * 1e6, 1),
+            'readMicrosecondsPerEntry': round(read / len(texts) * 1e6, 1)
+        }
+    finally:
+        os.remove(path)
+
+
+def codec_cost(name, texts, threshold):
+    codec = codecs[name]
+    data = [text.encode('utf-8') for text in texts]
+    data = [d for d in data if len(d) >= threshold]
+
+    start = time.perf_counter()
+    compressed = [codec.compress(d) for d in data]
+    compress = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for c in compressed:
+        codec.decompress(c)
+    decompress = time.perf_counter() - start
+
+    return {
+        'name': name,
+        'entries': len(data),
+        'ratio': round(sum(map(len, data)) / sum(map(len, compressed)), 2),
+        'compressMicroseconds': round(compress / len(data) * 1e6, 1),
+        'decompressMicroseconds': round(decompress / len(data) * 1e6, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--threshold', type=int, default=512)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = corpus(args.entries, random.Random(args.seed))
+    sizes = sorted(len(text.encode('utf-8')) for text in texts)
+    names = ['zlib'] + (['zstd'] if zstandard else [])
+
+    results = {
+        'corpus': {
+            'entries': len(texts),
+            'bytes': sum(sizes),
+            'medianBytes': sizes[len(sizes) // 2],
+            'maxBytes': sizes[-1]
+        },
+        'codecs': [codec_cost(name, texts, args.threshold) for name in names],
+        'tables': [run('text', Text, texts)] +
+        [run(name, CompressedText(name, args.threshold), texts) for name in names]
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Latency of emissions.footprint() (ESSBackend/emissions.py), queries included, for one user
+# with years of commutes and meals.
+#
+#   python benchmarks/emissions.py [--days 1095] [--commutes 2] [--meals 3] [--repeat 20]
+#
+# Runs against a temporary sqlite database; set DATABASE_URI to an empty postgres database to
+# measure that instead. Footprints are timed over a week, a month, a year and every seeded day,
+# both as a footprint() call alone and as a full /api/scorecard/emissions request.
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+_, DATABASE = tempfile.mkstemp(suffix='.db')
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{DATABASE}')
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+import ESSBackend.app as backend
+from ESSBackend.emissions import COMMUTE_COEFFICIENTS, FOOD_COEFFICIENTS, footprint
+from ESSBackend.models import Commute, Food
+
+EMAIL = 'benchmark@example.com'
+START = date(2018, 1, 1)
+
+
+def populate(days: int, commutes: int, meals: int, rng: random.Random):
+    methods, categories = list(COMMUTE_COEFFICIENTS), list(FOOD_COEFFICIENTS)
+    for first in range(0, days, 100):
+        commute_rows, food_rows = [], []
+        for day in range(first, min(first + 100, days)):
+            midnight = datetime.combine(START + timedelta(days=day), datetime.min.time())
+            for i in range(commutes):
+                departure = midnight + timedelta(hours=7 + 10 * i)
+                commute_rows.append(
+                    {
+                        'email': EMAIL,
+                        'arrival': departure + timedelta(minutes=40),
+                        'departure': departure,
+                        'method': rng.choice(methods),
+                        'distance': rng.expovariate(1 / 5)
+                    }
+                )
+            for i in range(meals):
+                food_rows.append(
+                    {
+                        'email': EMAIL,
+                        'name': f'meal {i}',
+                        'mealTime': midnight + timedelta(hours=8 + 5 * i),
+                        'quantity': float(rng.randint(1, 3)),
+                        'category': rng.choice(categories)
+                    }
+                )
+        backend.db.execute(Commute.__table__.insert(), commute_rows)
+        backend.db.execute(Food.__table__.insert(), food_rows)
+        backend.db.commit()
+
+
+def timed(f, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, times
+
+
+def run(client, token, name: str, days: int, per_day: int, repeat: int):
+    end = START + timedelta(days=days - 1)
+    result, alone = timed(lambda: footprint(EMAIL, START, end), repeat)
+    backend.db.remove()
+
+    def request():
+        body = {'start': START.isoformat(), 'end': end.isoformat(), 'token': token}
+        response = client.post('/api/scorecard/emissions', json=body)
+        assert response.status_code == 200
+        return response.get_json()
+
+    _, full = timed(request, repeat)
+    return {
+        'name': name,
+        'days': len(result),
+        'records': days * per_day,
+        'footprintMs': {
+            'median': round(statistics.median(alone), 2),
+            'max': round(max(alone), 2)
+        },
+        'requestMs': {
+            'median': round(statistics.median(full), 2),
+            'max': round(max(full), 2)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=1095)
+    parser.add_argument('--commutes', type=int, default=2, help='commutes per day')
+    parser.add_argument('--meals', type=int, default=3, help='meals per day')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    backend.response_cache = None
+    backend.db_init()
+    client = backend.app.test_client()
+    credentials = {'email': EMAIL, 'password': 'benchmark'}
+    token = client.post('/api/register', json=credentials).get_json()['token']
+    populate(args.days, args.commutes, args.meals, random.Random(args.seed))
+
+    per_day = args.commutes + args.meals
+    spans = [('week', 7), ('month', 30), ('year', 365), ('everything', args.days)]
+    results = [
+        run(client, token, name, min(days, args.days), per_day, args.repeat)
+        for name, days in spans
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        os.remove(DATABASE)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Payload size and encode/decode time of read responses in each available encoding
+# (ESSBackend/encoder.py: JSON, and MessagePack and CBOR when msgpack/cbor2 are installed).
+#
+#   python benchmarks/encodings.py [--repeat 200]
+#
+# Responses are built from the category serializers with synthetic rows, so only the
+# encoding is timed. Sizes are also given gzipped, as a proxy sending them compressed would.
+
+import argparse
+import gzip
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+from ESSBackend.encoder import formats
+from ESSBackend.resources import resources
+
+FOODS = ['apple', 'oatmeal', 'chicken sandwich', 'coffee', 'pasta', 'yogurt']
+METHODS = ['car', 'bus', 'bike', 'walk']
+MORNING = datetime(2018, 5, 1, 7)
+
+
+def food(rng, i):
+    return resources['food'].view().serialize(
+        (
+            rng.choice(FOODS), float(rng.randint(1, 3)), 'servings', rng.randint(50, 900),
+            'grains', MORNING + timedelta(minutes=7 * i)
+        )
+    )
+
+
+def commute(rng, i):
+    departure = MORNING + timedelta(minutes=31 * i)
+    return resources['commute'].view().serialize(
+        (
+            rng.choice(METHODS), round(rng.uniform(0.5, 20), 2), departure,
+            departure + timedelta(minutes=rng.randint(5, 60))
+        )
+    )
+
+
+def journal(rng, i):
+    created = MORNING + timedelta(minutes=13 * i)
+    contents = ' '.join(rng.choice(FOODS + METHODS) for _ in range(rng.randint(20, 200)))
+    return resources['journal'].view().serialize((contents, f'entry {i}', created, created))
+
+
+def day(name, serialize, rows, rng):
+    return {
+        'name': name,
+        'response': {
+            'result': True,
+            'message': f'Returning all {name} found for 2018-05-01',
+            'list': [serialize(rng, i) for i in range(rows)]
+        }
+    }
+
+
+def run(case, format, repeat):
+    response = case['response']
+    encoded = format.dumps(response)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        format.dumps(response)
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        format.loads(encoded)
+    decode = time.perf_counter() - start
+
+    return {
+        'name': case['name'],
+        'format': format.name,
+        'bytes': len(encoded),
+        'gzipBytes': len(gzip.compress(encoded)),
+        'encodeMicroseconds': round(encode / repeat * 1e6, 1),
+        'decodeMicroseconds': round(decode / repeat * 1e6, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [
+        day('food (typical day)', food, 6, rng),
+        day('commute (typical day)', commute, 4, rng),
+        day('food (500 rows)', food, 500, rng),
+        day('commute (500 rows)', commute, 500, rng),
+        day('journal (50 entries)', journal, 50, rng),
+    ]
+    results = [run(case, format, args.repeat) for case in cases for format in formats.values()]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# Latency and throughput of every endpoint, as a baseline to compare changes against.
+#
+#   python benchmarks/load.py [--users 10] [--days 30] [--requests 200] [--concurrency 8]
+#                             [--mode client|http|both] [--output run.json]
+#   python benchmarks/load.py --compare base.json run.json [--tolerance 0.2]
+#
+# Runs against a temporary sqlite database by default. --postgres runs against a throwaway
+# postgres server of its own instead (initdb and pg_ctl must be on PATH, and it can't run as
+# root), and setting DATABASE_URI runs against that (empty) database.
+#
+# Users are registered and seeded through /api/sync with a realistic mix of records: a few
+# meals and two commutes a day, a journal entry, water, showers, screen time and cigarettes.
+# Then every endpoint is driven, one at a time, through Flask's test client (`client`: one
+# request at a time, no HTTP), and through a load generator of --concurrency threads sending
+# HTTP requests (`http`) to an in-process threaded werkzeug server. That server shares the
+# GIL with the load generator; pass --url to load a running deployment (such as uwsgi) instead,
+# which is seeded through its API. Logins are timed at the deployment's bcrypt cost, so they
+# get --logins requests rather than --requests. Logging out and registering aren't driven.
+#
+# Each endpoint's latency percentiles (p50/p95/p99) and throughput are printed as JSON; a
+# request answered with a 4xx/5xx status or `"result": false` counts as an error. --compare
+# lists the endpoints that got slower or failed more between two such runs, and exits with 1
+# if there are any.
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+FIRST_DAY = date(2018, 4, 1)
+DELETE_DAY = FIRST_DAY - timedelta(days=1)  # rows seeded for the delete endpoint, never read
+WARMUP = 5
+
+FOODS = [
+    ('oatmeal', 'grains', 150), ('steak', 'beef', 680), ('salad', 'vegetables', 120),
+    ('chicken sandwich', 'poultry', 450), ('cheese pizza', 'cheese', 600), ('apple', 'fruit', 95),
+    ('lentil soup', 'legumes', 230), ('salmon', 'fish', 410), ('yogurt', 'dairy', 150),
+    ('almonds', 'nuts', 170)
+]
+METHODS = ['car', 'car', 'bus', 'train', 'bike', 'walk', 'carpool']
+WORDS = '''
+    bus train rain garden market lunch coffee friends recycle commute walked biked compost
+    leftovers farmers vegetarian thermostat shower laundry groceries carpool weekend park
+'''.split()
+
+# (status, content type, body)
+Reply = Tuple[int, str, bytes]
+Send = Callable[[str, str, Optional[Dict]], Reply]
+
+
+class User(NamedTuple):
+    email: str
+    password: str
+    token: Dict[str, str]
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    path: str
+    body: Callable[[User, int], Optional[Dict]]  # (user, request number) -> request body
+    requests: int
+
+
+# ----- Synthetic data
+
+
+def timestamp(day: date, hour: int, minute: int = 0) -> str:
+    return datetime(day.year, day.month, day.day, hour, minute).isoformat()
+
+
+def record(type: str, content: Dict[str, Any], at: str) -> Dict[str, Any]:
+    return {'type': type, 'content': content, 'metadata': {'timestamp': at}}
+
+
+def food(name: str, category: str, calories: int, at: str) -> Dict[str, Any]:
+    return {
+        'name': name,
+        'quantity': 1.0,
+        'quantityUnits': 'servings',
+        'calories': calories,
+        'category': category,
+        'mealTime': at
+    }
+
+
+def day_records(rng: random.Random, day: date) -> List[Dict[str, Any]]:
+    """A day of one user's records, as /api/sync takes them."""
+    noon = timestamp(day, 12)
+    records = []
+    for hour in rng.sample([7, 8, 12, 13, 16, 19, 21], rng.randint(3, 5)):
+        name, category, calories = rng.choice(FOODS)
+        at = timestamp(day, hour, rng.randint(0, 59))
+        records.append(record('food', food(name, category, calories, at), at))
+    distance = round(rng.uniform(1, 25), 1)
+    method = rng.choice(METHODS)
+    for hour in (8, 17):
+        commute = {
+            'departure': timestamp(day, hour),
+            'arrival': timestamp(day, hour, rng.randint(10, 50)),
+            'method': method,
+            'distance': distance
+        }
+        records.append(record('commute', commute, commute['arrival']))
+    journal = {
+        'title': f'{day} {" ".join(rng.sample(WORDS, 2))}',
+        'contents': ' '.join(rng.choices(WORDS, k=rng.randint(30, 200)))
+    }
+    records.append(record('journal', journal, timestamp(day, 22)))
+    records.append(record('water', {'isIncrement': False, 'cups': rng.randint(2, 10)}, noon))
+    shower = {'cold': rng.random() < .2, 'minutes': rng.randint(3, 20)}
+    records.append(record('shower', shower, noon))
+    records.append(record('entertainment', {'hours': rng.randint(0, 6)}, noon))
+    records.append(record('health', {'cigarettes': rng.choice([0, 0, 0, 0, 2, 5])}, noon))
+    return records
+
+
+def deletable(n: int) -> Dict[str, Any]:
+    """The n-th food seeded for the delete endpoint to remove."""
+    return food(f'leftovers {n}', 'vegetables', 100, timestamp(DELETE_DAY, 12))
+
+
+# ----- Clients
+
+
+def test_client_sender(app) -> Send:
+    client = app.test_client()
+
+    def send(method: str, path: str, body: Optional[Dict]) -> Reply:
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.content_type, response.get_data()
+
+    return send
+
+
+def http_sender(url: str) -> Send:
+    """A sender with a connection of its own, reopened when the server closes it."""
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    prefix = parts.path.rstrip('/')
+
+    def send(method: str, path: str, body: Optional[Dict]) -> Reply:
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, prefix + path, data, headers)
+            response = connection.getresponse()
+            reply = response.read()
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            raise
+        return response.status, response.getheader('Content-Type', ''), reply
+
+    return send
+
+
+def succeeded(reply: Reply) -> bool:
+    status, content_type, data = reply
+    if status >= 400:
+        return False
+    if content_type.startswith('application/json'):
+        body = json.loads(data)
+        return not isinstance(body, dict) or body.get('result', True) is not False
+    return True
+
+
+# ----- Seeding
+
+
+def seed(send: Send, users: int, days: int, deletes: int, random_seed: int) -> List[User]:
+    """Register (or log in) the benchmark users, and sync their records."""
+    rng = random.Random(random_seed)
+    seeded = []
+    for i in range(users):
+        email, password = f'load-{i}@example.com', f'password {i}'
+        credentials = {'email': email, 'password': password}
+        status, _, data = send('POST', '/api/register', credentials)
+        if json.loads(data).get('message') == 'User already exists':
+            status, _, data = send('POST', '/api/login', credentials)
+        body = json.loads(data)
+        if status != 200 or 'token' not in body:
+            sys.exit(f'Could not log in {email}: {body.get("message")}')
+        seeded.append(User(email, password, body['token']))
+
+    for i, user in enumerate(seeded):
+        records = [r for d in range(days) for r in day_records(rng, FIRST_DAY + timedelta(days=d))]
+        records += [
+            record('food', deletable(n), timestamp(DELETE_DAY, 12))
+            for n in range(i, deletes, users)
+        ]
+        for start in range(0, len(records), 500):
+            body = {'records': records[start:start + 500], 'token': user.token}
+            reply = send('POST', '/api/sync', body)
+            if not succeeded(reply):
+                sys.exit(f'Could not seed {user.email}: {reply[2][:200]}')
+    return seeded
+
+
+# ----- Scenarios
+
+
+def scenarios(days: int, requests: int, logins: int) -> List[Scenario]:
+    """Every endpoint, reads first, then writes and deletes."""
+    last_day = FIRST_DAY + timedelta(days=days - 1)
+    rng = random.Random(0)
+    # prepared up front, so generating them isn't timed
+    syncs = [day_records(rng, last_day + timedelta(days=1 + n)) for n in range(WARMUP + requests)]
+
+    def day(n: int) -> str:
+        return str(FIRST_DAY + timedelta(days=n % days))
+
+    def on_day(**body):
+        return lambda user, n: dict(body, date=day(n), token=user.token)
+
+    def span(**body):
+        return lambda user, n: dict(
+            body, start=str(FIRST_DAY), end=str(last_day), token=user.token
+        )
+
+    def written_at(n: int) -> str:
+        return timestamp(FIRST_DAY + timedelta(days=n % days), 12, n % 60)
+
+    def write(content: Callable[[int], Dict]):
+        return lambda user, n: {
+            'content': content(n),
+            'metadata': {'timestamp': written_at(n)},
+            'token': user.token
+        }
+
+    reads = ['food', 'commute', 'journal', 'water', 'showers', 'entertainment', 'health']
+    return [
+        Scenario('status', 'GET', '/api/status', lambda user, n: None, requests),
+        Scenario(
+            'login', 'POST', '/api/login',
+            lambda user, n: {'email': user.email, 'password': user.password}, logins
+        ),
+    ] + [
+        Scenario(f'read {path}', 'POST', f'/api/{path}', on_day(), requests) for path in reads
+    ] + [
+        Scenario(
+            'read journal titles', 'POST', '/api/journal', on_day(fields=['title', 'created']),
+            requests
+        ),
+        Scenario('read food range', 'POST', '/api/food', span(), requests),
+        Scenario('day', 'POST', '/api/day', on_day(), requests),
+        Scenario('scorecard', 'POST', '/api/scorecard', span(), requests),
+        Scenario('emissions', 'POST', '/api/scorecard/emissions', span(), requests),
+        Scenario(
+            'changes', 'POST', '/api/changes',
+            lambda user, n: {'since': 0, 'limit': 1000, 'token': user.token}, requests
+        ),
+        Scenario(
+            'search', 'POST', '/api/journal/search',
+            lambda user, n: {'query': WORDS[n % len(WORDS)], 'limit': 20, 'token': user.token},
+            requests
+        ),
+        Scenario('metrics', 'GET', '/api/metrics', lambda user, n: None, requests),
+        Scenario(
+            'write food', 'POST', '/api/food/new',
+            write(lambda n: food(f'snack {n}', 'fruit', 95, written_at(n))), requests
+        ),
+        Scenario(
+            'write commute', 'POST', '/api/commute/new',
+            write(
+                lambda n: {
+                    'departure': written_at(n),
+                    'arrival': written_at(n),
+                    'method': 'bus',
+                    'distance': 4.5
+                }
+            ), requests
+        ),
+        Scenario(
+            'write journal', 'POST', '/api/journal/new',
+            write(lambda n: {
+                'title': f'note {n}',
+                'contents': ' '.join(WORDS)
+            }), requests
+        ),
+        Scenario(
+            'write water', 'POST', '/api/water/new',
+            write(lambda n: {
+                'isIncrement': True,
+                'cups': 1
+            }), requests
+        ),
+        Scenario(
+            'write shower', 'POST', '/api/showers/new',
+            write(lambda n: {
+                'cold': False,
+                'minutes': 8
+            }), requests
+        ),
+        Scenario(
+            'write entertainment', 'POST', '/api/entertainment/new',
+            write(lambda n: {'hours': 2}), requests
+        ),
+        Scenario(
+            'write health', 'POST', '/api/health/new',
+            write(lambda n: {'cigarettes': 0}), requests
+        ),
+        Scenario(
+            'sync', 'POST', '/api/sync',
+            lambda user, n: {'records': syncs[n % len(syncs)], 'token': user.token}, requests
+        ),
+        Scenario(
+            'batch food', 'POST', '/api/food/batch',
+            lambda user, n: {'records': [r for r in syncs[n % len(syncs)] if r['type'] == 'food'],
+                             'token': user.token}, requests
+        ),
+        Scenario(
+            'delete food', 'POST', '/api/food/delete', lambda user, n: {
+                'key': {c: deletable(n)[c] for c in ('name', 'mealTime')},
+                'token': user.token
+            }, requests
+        ),
+    ]
+
+
+# ----- Measurement
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """The nearest-rank percentile of sorted values."""
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summary(scenario: Scenario, times: List[float], errors: int, seconds: float) -> Dict:
+    ordered = sorted(times)
+    return {
+        'name': scenario.name,
+        'path': scenario.path,
+        'requests': len(times),
+        'errors': errors,
+        'p50Ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95Ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99Ms': round(percentile(ordered, 99) * 1000, 3),
+        'meanMs': round(sum(times) / len(times) * 1000, 3),
+        'requestsPerSecond': round(len(times) / seconds, 1)
+    }
+
+
+def sequential(send: Send, users: List[User], scenario: Scenario, numbers) -> Dict:
+    """Send a scenario's requests one at a time."""
+    for n in itertools.islice(numbers, WARMUP):
+        send(scenario.method, scenario.path, scenario.body(users[n % len(users)], n))
+
+    times, errors = [], 0
+    started = time.perf_counter()
+    for n in itertools.islice(numbers, scenario.requests):
+        body = scenario.body(users[n % len(users)], n)
+        start = time.perf_counter()
+        reply = send(scenario.method, scenario.path, body)
+        times.append(time.perf_counter() - start)
+        errors += not succeeded(reply)
+    return summary(scenario, times, errors, time.perf_counter() - started)
+
+
+def concurrent(
+    senders: List[Send], users: List[User], scenario: Scenario, numbers
+) -> Dict:
+    """Send a scenario's requests from as many threads as there are senders."""
+    for n in itertools.islice(numbers, WARMUP):
+        senders[0](scenario.method, scenario.path, scenario.body(users[n % len(users)], n))
+
+    first = next(numbers)
+    last = first + scenario.requests
+    numbers = itertools.count(first)  # taking the next number is atomic under the GIL
+    times, errors = [], []
+
+    def worker(send: Send):
+        for n in numbers:
+            if n >= last:
+                return
+            body = scenario.body(users[n % len(users)], n)
+            start = time.perf_counter()
+            try:
+                reply = send(scenario.method, scenario.path, body)
+            except (OSError, http.client.HTTPException):
+                reply = (599, '', b'')
+            times.append(time.perf_counter() - start)
+            errors.append(not succeeded(reply))
+
+    threads = [threading.Thread(target=worker, args=(send, )) for send in senders]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summary(scenario, times, sum(errors), time.perf_counter() - started)
+
+
+def serve(app):
+    """Serve a flask app from a threaded werkzeug server; returns its URL and a stop function."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+
+def throwaway_postgres(directory: str) -> Tuple[str, Callable[[], None]]:
+    """Start a postgres server of its own in `directory`; returns its URI and a stop function."""
+    initdb, pg_ctl = shutil.which('initdb'), shutil.which('pg_ctl')
+    if not initdb or not pg_ctl:
+        sys.exit('--postgres needs initdb and pg_ctl on PATH')
+    data = os.path.join(directory, 'data')
+    quiet = {'stdout': subprocess.DEVNULL, 'check': True}
+    subprocess.run([initdb, '-D', data, '-A', 'trust', '-U', 'postgres'], **quiet)
+    # listens on a unix socket in `directory` only
+    options = f"-k {directory} -c listen_addresses='' -c fsync=off"
+    log = os.path.join(directory, 'postgres.log')
+    subprocess.run([pg_ctl, '-D', data, '-l', log, '-o', options, '-w', 'start'], **quiet)
+
+    def stop():
+        subprocess.run([pg_ctl, '-D', data, '-m', 'fast', '-w', 'stop'], stdout=subprocess.DEVNULL)
+
+    return f'postgresql://postgres@/postgres?host={directory}', stop
+
+
+# ----- Comparison
+
+
+def compare(base: Dict, run: Dict, tolerance: float, floor_ms: float) -> Dict:
+    """The endpoints whose latency or throughput got worse by more than `tolerance`, or whose
+    errors went up. Latencies must also have grown by more than `floor_ms`, as sub-millisecond
+    differences are mostly noise."""
+    regressions, improvements = [], []
+    for mode in ('client', 'http'):
+        before = {s['name']: s for s in base.get(mode, [])}
+        for after in run.get(mode, []):
+            old = before.get(after['name'])
+            if old is None:
+                continue
+            changes = []
+            for stat in ('p50Ms', 'p95Ms', 'p99Ms'):
+                if abs(after[stat] - old[stat]) > floor_ms:
+                    changes.append((stat, old[stat], after[stat], after[stat] > old[stat]))
+            changes.append(
+                (
+                    'requestsPerSecond', old['requestsPerSecond'], after['requestsPerSecond'],
+                    after['requestsPerSecond'] < old['requestsPerSecond']
+                )
+            )
+            for stat, a, b, worse in changes:
+                if a and abs(b - a) / a > tolerance:
+                    (regressions if worse else improvements).append(
+                        {
+                            'mode': mode,
+                            'name': after['name'],
+                            'stat': stat,
+                            'base': a,
+                            'run': b,
+                            'change': f'{(b - a) / a:+.0%}'
+                        }
+                    )
+            if after['errors'] > old['errors']:
+                regressions.append(
+                    {
+                        'mode': mode,
+                        'name': after['name'],
+                        'stat': 'errors',
+                        'base': old['errors'],
+                        'run': after['errors']
+                    }
+                )
+    return {'tolerance': tolerance, 'regressions': regressions, 'improvements': improvements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30, help='days of records per user')
+    parser.add_argument('--requests', type=int, default=200, help='per endpoint and mode')
+    parser.add_argument('--logins', type=int, default=20, help='login requests per mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads sending HTTP requests')
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='both')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--postgres', action='store_true', help='run a throwaway postgres')
+    parser.add_argument('--url', help='load a running server instead, e.g. http://localhost:8080')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'RUN'), help='compare two results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change flagged')
+    parser.add_argument('--floor', type=float, default=0.5, help='latency change (ms) ignored')
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f))
+        result = compare(*runs, args.tolerance, args.floor)
+        print(json.dumps(result, indent=2))
+        sys.exit(1 if result['regressions'] else 0)
+
+    directory = tempfile.mkdtemp()
+    stop_postgres = None
+    try:
+        if args.postgres:
+            os.environ['DATABASE_URI'], stop_postgres = throwaway_postgres(directory)
+        os.environ.setdefault('DATABASE_URI', f'sqlite:///{os.path.join(directory, "load.db")}')
+        os.environ.setdefault('ESS_SECRET', 'benchmark')
+        run(args)
+    finally:
+        if stop_postgres:
+            stop_postgres()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(args):
+    modes = ['client', 'http'] if args.mode == 'both' else [args.mode]
+    if args.url:
+        modes = ['http']
+    plan = scenarios(args.days, args.requests, args.logins)
+    # every mode sends its warmup and timed deletes to rows of their own
+    deletes = (WARMUP + args.requests) * len(modes) + 1
+
+    results = {'users': args.users, 'days': args.days, 'concurrency': args.concurrency}
+    if args.url:
+        results['url'] = args.url
+        send, url, stop = http_sender(args.url), args.url, None
+    else:
+        from ESSBackend.config import Config
+
+        Config.METRICS = True  # off by default; /api/metrics is driven, and collecting them timed
+        import ESSBackend.app as backend
+
+        backend.db_init()
+        if not args.cache:
+            backend.response_cache = None
+        results['database'] = backend.engine.dialect.name
+        send = test_client_sender(backend.app)
+
+    start = time.perf_counter()
+    users = seed(send, args.users, args.days, deletes, args.seed)
+    results['seedSeconds'] = round(time.perf_counter() - start, 1)
+
+    numbers = {scenario.name: itertools.count() for scenario in plan}
+    if 'client' in modes:
+        results['client'] = [
+            sequential(send, users, scenario, numbers[scenario.name]) for scenario in plan
+        ]
+    if 'http' in modes:
+        if not args.url:
+            url, stop = serve(backend.app)
+        try:
+            senders = [http_sender(url) for _ in range(args.concurrency)]
+            results['http'] = [
+                concurrent(senders, users, scenario, numbers[scenario.name]) for scenario in plan
+            ]
+        finally:
+            if stop:
+                stop()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
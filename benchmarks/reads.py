@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Per-request cost of reading one day of many rows through the HTTP API.
+#
+#   python benchmarks/reads.py [--rows 500] [--requests 200] [--json] [--output run.json]
+#   python benchmarks/reads.py --compare base.json run.json
+#
+# Runs against a throwaway sqlite database through Flask's test client, with the response
+# cache disabled so every request queries, serializes and encodes the day. Reports process
+# CPU time per request and the peak memory allocated (via tracemalloc) while serving one.
+# The last case reads just the journal fields a list of entries shows.
+#
+# Responses are encoded with orjson when it's installed; --json hides it, to measure the
+# json module fallback. To compare two versions of the backend, run this script against each
+# with --output, e.g. for a base commit checked out with `git worktree add ../base <commit>`:
+#
+#   PYTHONPATH=../base python benchmarks/reads.py --output base.json
+#   PYTHONPATH=. python benchmarks/reads.py --output run.json
+#
+# and then --compare the two files, which gives each case's after/before ratios.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_, DATABASE = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URI'] = f'sqlite:///{DATABASE}'
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+DAY = '2018-05-01'
+CONTENT = {
+    'food': lambda i: {
+        'name': f'food {i}',
+        'quantity': 1.5,
+        'quantityUnits': 'cups',
+        'calories': 120,
+        'category': 'grains',
+        'mealTime': f'{DAY}T{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02}'
+    },
+    'commute': lambda i: {
+        'arrival': f'{DAY}T{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02}',
+        'departure': f'{DAY}T00:00:00',
+        'method': 'bus',
+        'distance': 3.25
+    },
+    'journal': lambda i: {
+        'title': f'entry {i}',
+        'contents': 'Took the bus and skipped the steak. ' * 8
+    },
+}
+
+
+def populate(client, token, rows):
+    for name, content in CONTENT.items():
+        records = [
+            {
+                'type': name,
+                'content': content(i),
+                'metadata': {
+                    'timestamp': f'{DAY}T12:00:00'
+                }
+            } for i in range(rows)
+        ]
+        for start in range(0, rows, 500):
+            client.post('/api/sync', json={'records': records[start:start + 500], 'token': token})
+
+
+def run(client, token, name, requests, fields=None):
+    body = {'date': DAY, 'token': token}
+    if fields:
+        body['fields'] = fields
+    for _ in range(5):
+        response = client.post(f'/api/{name}', json=body)
+
+    start = time.process_time()
+    for _ in range(requests):
+        client.post(f'/api/{name}', json=body)
+    elapsed = time.process_time() - start
+
+    tracemalloc.start()
+    client.post(f'/api/{name}', json=body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'name': name if fields is None else f'{name} ({", ".join(fields)})',
+        'rows': len(json.loads(response.get_data())['list']),
+        'cpuMsPerRequest': round(elapsed / requests * 1000, 2),
+        'peakKiBPerRequest': round(peak / 1024, 1),
+        'responseBytes': len(response.get_data())
+    }
+
+
+def compare(base, run):
+    """The cases of `run` that `base` has too, with each measure before and after, and their
+    ratio."""
+    before = {case['name']: case for case in base}
+    results = []
+    for case in run:
+        old = before.get(case['name'])
+        if old is None:
+            continue
+        results.append({'name': case['name']})
+        for m in ('cpuMsPerRequest', 'peakKiBPerRequest', 'responseBytes'):
+            ratio = round(case[m] / old[m], 2)
+            results[-1][m] = {'before': old[m], 'after': case[m], 'ratio': ratio}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='encode without orjson')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'RUN'), help='compare two results')
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f))
+        print(json.dumps(compare(*runs), indent=2))
+        os.remove(DATABASE)
+        return
+
+    if args.json:
+        sys.modules['orjson'] = None  # makes `import orjson` raise ImportError
+    import ESSBackend.app as backend
+
+    backend.db_init()
+    backend.response_cache = None
+    client = backend.app.test_client()
+    token = client.post(
+        '/api/register', json={
+            'email': 'benchmark@example.com',
+            'password': 'benchmark'
+        }
+    ).get_json()['token']
+    populate(client, token, args.rows)
+
+    try:
+        results = [run(client, token, name, args.requests) for name in CONTENT]
+        results.append(run(client, token, 'journal', args.requests, ['title', 'created']))
+        print(json.dumps(results, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        os.remove(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
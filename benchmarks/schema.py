@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Request validation cost: the compiled schemas (ESSBackend/schema.py) against the
+# check_requirements function they replaced.
+#
+#   python benchmarks/schema.py [--number 100000]
+#
+# check_requirements only checked that fields were present; "+ strptime" adds the
+# datetime.strptime calls it would have taken to type the same body's timestamps,
+# which the schema does as part of validating.
+
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+from datetime import datetime
+from ESSBackend.resources import write_schemas
+
+BODY = {
+    'content': {
+        'name': 'apple',
+        'quantity': 1,
+        'quantityUnits': 'UNIT',
+        'calories': 95,
+        'category': 'fruit',
+        'mealTime': '2018-05-01T08:00:00'
+    },
+    'metadata': {
+        'timestamp': '2018-05-01T08:01:30.250'
+    },
+    'token': {
+        'hash': '0' * 64,
+        'expiry': '2018-06-01T00:00:00',
+        'email': 'someone@example.com'
+    }
+}
+REQUIREMENTS = [
+    ('content', ['name', 'quantity', 'quantityUnits', 'calories', 'category', 'mealTime']),
+    ('metadata', ['timestamp']),
+    ('token', ['hash', 'expiry', 'email']),
+]
+
+
+class Request(object):
+    json = BODY
+
+
+def check_requirements(requirements, request):
+    # as it was in app.py, minus the error responses (never built for a valid body)
+    if not request.json:
+        return (False, None)
+    for req in requirements:
+        if req[0] not in request.json:
+            return (False, None)
+        for subreq in req[1]:
+            if subreq not in request.json[req[0]]:
+                return (False, None)
+    return (True, None)
+
+
+def check_and_parse(requirements, request):
+    check = check_requirements(requirements, request)
+    datetime.strptime(request.json['content']['mealTime'], '%Y-%m-%dT%H:%M:%S')
+    datetime.strptime(request.json['metadata']['timestamp'], '%Y-%m-%dT%H:%M:%S.%f')
+    return check
+
+
+def run(name, function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=5))
+    return {'name': name, 'nsPerCall': round(seconds / number * 1e9)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    schema = write_schemas['food']
+    invalid = dict(BODY, content=dict(BODY['content'], quantity='1', mealTime='yesterday'))
+    results = [
+        run('check_requirements', lambda: check_requirements(REQUIREMENTS, Request), args.number),
+        run('check_requirements + strptime', lambda: check_and_parse(REQUIREMENTS, Request),
+            args.number),
+        run('schema', lambda: schema.validate(BODY), args.number),
+        run('schema, invalid body', lambda: schema.validate(invalid), args.number),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
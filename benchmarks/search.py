@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Latency of /api/journal/search (ESSBackend/search.py) for one user with many journal entries.
+#
+#   python benchmarks/search.py [--entries 100000] [--repeat 20]
+#
+# Runs against a temporary sqlite database, so it measures the inverted-index fallback; set
+# DATABASE_URI to an empty postgres database to measure the tsvector index instead. Entries
+# are Zipf-distributed made-up words, and queries are single words of decreasing frequency
+# and several words at once; each is timed as a search alone and as a full request.
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_, DATABASE = tempfile.mkstemp(suffix='.db')
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{DATABASE}')
+os.environ.setdefault('ESS_SECRET', 'benchmark')
+
+import ESSBackend.app as backend
+from ESSBackend.models import JournalEntry
+from ESSBackend.resources import resources
+from ESSBackend.search import index, search
+
+EMAIL = 'benchmark@example.com'
+
+
+def vocabulary(rng: random.Random):
+    letters = 'etaoinshrdlucmfwypvbgkjqxz'
+    words = {''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(6000)}
+    return sorted(words)
+
+
+def populate(entries: int, words, rng: random.Random, chunk_size: int = 2000):
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    start = datetime(2018, 1, 1)
+    table = JournalEntry.__table__
+    for first in range(0, entries, chunk_size):
+        rows = []
+        for i in range(first, min(first + chunk_size, entries)):
+            title = f'{" ".join(rng.choices(words, weights, k=3))} {i}'
+            content = ' '.join(rng.choices(words, weights, k=rng.randint(20, 150)))
+            created = start + timedelta(minutes=37 * i)
+            rows.append({'email': EMAIL, 'title': title, 'created': created, 'content': content})
+        backend.db.execute(table.insert(), rows)
+        index(resources['journal'], EMAIL, rows)
+        backend.db.commit()
+
+
+def timed(f, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, times
+
+
+def run(client, token, name: str, query: str, repeat: int):
+    matches, _ = timed(lambda: search(EMAIL, query, 0, 1000000), 1)
+    _, alone = timed(lambda: search(EMAIL, query, 0, 20), repeat)
+    backend.db.remove()
+
+    def request():
+        body = {'query': query, 'limit': 20, 'fields': ['title', 'created'], 'token': token}
+        response = client.post('/api/journal/search', json=body)
+        assert response.status_code == 200
+        return response.get_json()
+
+    page, full = timed(request, repeat)
+    return {
+        'name': name,
+        'query': query,
+        'matches': len(matches),
+        'returned': len(page['list']),
+        'searchMs': {'median': round(statistics.median(alone), 2), 'max': round(max(alone), 2)},
+        'requestMs': {'median': round(statistics.median(full), 2), 'max': round(max(full), 2)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    backend.response_cache = None
+    backend.db_init()
+    client = backend.app.test_client()
+    credentials = {'email': EMAIL, 'password': 'benchmark'}
+    token = client.post('/api/register', json=credentials).get_json()['token']
+
+    rng = random.Random(args.seed)
+    words = vocabulary(rng)
+    start = time.perf_counter()
+    populate(args.entries, words, rng)
+    setup = time.perf_counter() - start
+
+    results = {
+        'entries': args.entries,
+        'indexMicrosecondsPerEntry': round(setup / args.entries * 1e6, 1),
+        'queries': [
+            run(client, token, name, query, args.repeat) for name, query in [
+                ('common word', words[2]),
+                ('frequent word', words[30]),
+                ('uncommon word', words[1000]),
+                ('rare word', words[5000]),
+                ('two words', f'{words[30]} {words[100]}'),
+                ('two common words', f'{words[2]} {words[5]}'),
+                ('rare and common word', f'{words[5000]} {words[2]}'),
+                ('three words', f'{words[2]} {words[5]} {words[30]}'),
+            ]
+        ]
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        os.remove(DATABASE)
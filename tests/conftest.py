@@ -0,0 +1,48 @@
+# The app under test runs against a throwaway sqlite database, or the database named by
+# ESS_TEST_DATABASE_URI (e.g. a scratch postgres database). Run from the repository root:
+#
+#     python -m pytest tests
+#
+# Config is read as ESSBackend is imported, so the environment is set up before that.
+
+import os
+import tempfile
+import uuid
+
+_directory = tempfile.mkdtemp(prefix='ess-tests-')
+os.environ['DATABASE_URI'] = os.environ.get(
+    'ESS_TEST_DATABASE_URI', f'sqlite:///{os.path.join(_directory, "ess.db")}'
+)
+os.environ.setdefault('ESS_SECRET', 'test secret')
+
+from ESSBackend.app import app, db, db_init
+from ESSBackend.config import Config
+
+import pytest
+
+# hashing at the production cost would make every registration take a quarter second
+Config.BCRYPT_ROUNDS = 4
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    db_init()
+    yield
+    db.remove()
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def email():
+    # every test gets a user of its own, so tests sharing the database can't see each other's rows
+    return f'{uuid.uuid4().hex}@example.com'
+
+
+@pytest.fixture
+def token(client, email):
+    response = client.post('/api/register', json={'email': email, 'password': 'password'})
+    return response.get_json()['token']
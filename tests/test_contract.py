@@ -0,0 +1,885 @@
+# The URL and JSON contract of every endpoint: the statuses, messages and body shapes clients
+# depend on. A change that makes one of these fail is a change to the API.
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+
+import json
+import pytest
+
+MORNING = {'timestamp': '2018-05-01T10:00:00'}
+NEXT_DAY = {'timestamp': '2018-05-02T11:00:00'}
+
+
+class Category(object):
+    def __init__(self, name, path, label, message, records, day, range, empty, key):
+        self.name = name  # the resource name, as /api/day and /api/sync know it
+        self.path = path
+        self.label = label  # as write messages name it
+        self.message = message  # a day read's message, formatted with the date
+        self.records = records  # [(content, metadata)], the first on 2018-05-01, the next on 05-02
+        self.day = day  # the content 2018-05-01 reads back as
+        self.range = range  # the range read items of the records
+        self.empty = empty  # what an empty day reads as
+        self.key = key  # the first record's key, for deletes
+
+
+CATEGORIES = [
+    Category(
+        'food', 'food', 'food', 'Returning all commutes found for {}', [
+            (
+                {
+                    'name': 'apple',
+                    'quantity': 1,
+                    'quantityUnits': 'u',
+                    'calories': 95,
+                    'category': 'fruit',
+                    'mealTime': '2018-05-01T08:00:00'
+                }, MORNING
+            ),
+            (
+                {
+                    'name': 'bread',
+                    'quantity': 2,
+                    'quantityUnits': 'slice',
+                    'calories': 160,
+                    'category': 'grain',
+                    'mealTime': '2018-05-02T12:00:00'
+                }, NEXT_DAY
+            )
+        ], [
+            {
+                'name': 'apple',
+                'quantity': 1.0,
+                'quantityUnits': 'u',
+                'calories': 95,
+                'category': 'fruit',
+                'mealTime': '2018-05-01T08:00:00'
+            }
+        ], [
+            {
+                'name': 'apple',
+                'quantity': 1.0,
+                'quantityUnits': 'u',
+                'calories': 95,
+                'category': 'fruit',
+                'mealTime': '2018-05-01T08:00:00'
+            }, {
+                'name': 'bread',
+                'quantity': 2.0,
+                'quantityUnits': 'slice',
+                'calories': 160,
+                'category': 'grain',
+                'mealTime': '2018-05-02T12:00:00'
+            }
+        ], [], {
+            'name': 'apple',
+            'mealTime': '2018-05-01T08:00:00'
+        }
+    ),
+    Category(
+        'commute', 'commute', 'commute', 'Returning all commutes found for {}', [
+            (
+                {
+                    'arrival': '2018-05-01T09:00:00',
+                    'departure': '2018-05-01T08:30:00',
+                    'method': 'bike',
+                    'distance': 7
+                }, MORNING
+            ),
+            (
+                {
+                    'arrival': '2018-05-02T18:00:00',
+                    'departure': '2018-05-02T17:15:00',
+                    'method': 'bus',
+                    'distance': 12.5
+                }, NEXT_DAY
+            )
+        ], [
+            {
+                'arrival': '2018-05-01T09:00:00',
+                'departure': '2018-05-01T08:30:00',
+                'method': 'bike',
+                'distance': 7.0
+            }
+        ], [
+            {
+                'arrival': '2018-05-01T09:00:00',
+                'departure': '2018-05-01T08:30:00',
+                'method': 'bike',
+                'distance': 7.0
+            }, {
+                'arrival': '2018-05-02T18:00:00',
+                'departure': '2018-05-02T17:15:00',
+                'method': 'bus',
+                'distance': 12.5
+            }
+        ], [], {'arrival': '2018-05-01T09:00:00'}
+    ),
+    Category(
+        'journal', 'journal', 'journal entry', 'Returning all journals found for {}', [
+            ({
+                'title': 'monday',
+                'contents': 'hello'
+            }, MORNING),
+            ({
+                'title': 'tuesday',
+                'contents': 'world'
+            }, NEXT_DAY),
+        ], [{
+            'title': 'monday',
+            'contents': 'hello',
+            'created': '2018-05-01T10:00:00',
+            'edited': None
+        }], [
+            {
+                'title': 'monday',
+                'contents': 'hello',
+                'created': '2018-05-01T10:00:00',
+                'edited': None
+            }, {
+                'title': 'tuesday',
+                'contents': 'world',
+                'created': '2018-05-02T11:00:00',
+                'edited': None
+            }
+        ], [], {'title': 'monday'}
+    ),
+    Category(
+        'water', 'water', 'water entry', 'Returning water consumption for {}', [
+            ({
+                'isIncrement': False,
+                'cups': 3
+            }, MORNING),
+            ({
+                'isIncrement': False,
+                'cups': 5
+            }, NEXT_DAY),
+        ], {
+            'cupsCount': 3,
+            'isIncrement': False
+        }, [
+            {
+                'cupsCount': 3,
+                'isIncrement': False,
+                'date': '2018-05-01'
+            }, {
+                'cupsCount': 5,
+                'isIncrement': False,
+                'date': '2018-05-02'
+            }
+        ], {
+            'cupsCount': 0,
+            'isIncrement': False
+        }, {'date': '2018-05-01'}
+    ),
+    Category(
+        'shower', 'showers', 'shower entry', 'Returning shower usage for {}', [
+            ({
+                'cold': True,
+                'minutes': 5
+            }, MORNING),
+            ({
+                'cold': False,
+                'minutes': 12
+            }, NEXT_DAY),
+        ], {
+            'cold': True,
+            'minutes': 5
+        }, [
+            {
+                'cold': True,
+                'minutes': 5,
+                'date': '2018-05-01'
+            }, {
+                'cold': False,
+                'minutes': 12,
+                'date': '2018-05-02'
+            }
+        ], {
+            'cold': False,
+            'minutes': 0
+        }, {'date': '2018-05-01'}
+    ),
+    Category(
+        'entertainment', 'entertainment', 'entertainment entry',
+        'Returning entertainment usage for {}', [
+            ({
+                'hours': 2
+            }, MORNING),
+            ({
+                'hours': 3
+            }, NEXT_DAY),
+        ], {'hours': 2}, [{
+            'hours': 2,
+            'date': '2018-05-01'
+        }, {
+            'hours': 3,
+            'date': '2018-05-02'
+        }], {'hours': 0}, {'date': '2018-05-01'}
+    ),
+    Category(
+        'health', 'health', 'health entry', 'Returning health  for {}', [
+            ({
+                'cigarettes': 1
+            }, MORNING),
+            ({
+                'cigarettes': 0
+            }, NEXT_DAY),
+        ], {'cigarettes': 1}, [{
+            'cigarettes': 1,
+            'date': '2018-05-01'
+        }, {
+            'cigarettes': 0,
+            'date': '2018-05-02'
+        }], {'cigarettes': 0}, {'date': '2018-05-01'}
+    ),
+]
+
+categories = pytest.mark.parametrize('category', CATEGORIES, ids=[c.name for c in CATEGORIES])
+
+
+def post(client, url, body, headers=None):
+    response = client.post(url, json=body, headers=headers)
+    assert response.content_type == 'application/json' or response.status_code == 304
+    return response
+
+
+def write(client, token, category, index=0):
+    content, metadata = category.records[index]
+    body = {'content': content, 'metadata': metadata, 'token': token}
+    return post(client, f'/api/{category.path}/new', body).get_json()
+
+
+def day_field(category):
+    return 'list' if isinstance(category.day, list) else 'content'
+
+
+# ----- Accounts
+
+
+def test_register_login_logout(client, email):
+    credentials = {'email': email, 'password': 'password'}
+    response = post(client, '/api/register', credentials).get_json()
+    assert response['result'] is True and response['message'] == 'Successful Login'
+    assert set(response['token']) == {'hash', 'expiry', 'email'}
+    assert response['token']['email'] == email
+
+    assert post(client, '/api/register', credentials).get_json() == {
+        'result': False,
+        'message': 'User already exists'
+    }
+
+    response = post(client, '/api/login', credentials).get_json()
+    assert response['result'] is True and response['message'] == 'Successful Login'
+    token = response['token']
+
+    wrong = dict(credentials, password='wrong')
+    assert post(client, '/api/login', wrong).get_json() == {
+        'result': False,
+        'message': 'Incorrect Password'
+    }
+    unknown = dict(credentials, email='nobody@example.com')
+    assert post(client, '/api/login', unknown).get_json() == {
+        'result': False,
+        'message': 'User not found'
+    }
+
+    assert post(client, '/api/logout', {'token': token}).get_json() == {
+        'result': True,
+        'message': 'Logged out'
+    }
+    assert post(client, '/api/food', {'date': '2018-05-01', 'token': token}).get_json() == {
+        'result': False,
+        'message': 'Token Revoked'
+    }
+
+
+def test_missing_body(client):
+    response = client.post('/api/login')
+    assert response.status_code == 400
+    assert response.get_json() == {
+        'result': False,
+        'message': 'Where\'s the JSON?',
+        'errors': [{
+            'field': '',
+            'message': 'Where\'s the JSON?'
+        }]
+    }
+
+
+def test_not_found(client):
+    response = client.get('/api/nothing')
+    assert response.status_code == 404
+    assert response.get_json() == {'result': False, 'message': 'Not found'}
+
+
+def test_status(client):
+    response = client.get('/api/status').get_json()
+    assert response['result'] is True and response['message'] == 'Server status normal'
+
+
+# ----- Category Endpoints
+
+
+@categories
+def test_write_inserts_then_updates(client, token, category):
+    assert write(client, token, category) == {
+        'result': True,
+        'message': f'Inserted new {category.label}.'
+    }
+    assert write(client, token, category) == {
+        'result': True,
+        'message': f'Updated existing {category.label}.'
+    }
+
+
+@categories
+def test_write_rejects_missing_fields(client, token, category):
+    content, metadata = category.records[0]
+    response = post(
+        client, f'/api/{category.path}/new', {
+            'content': {},
+            'metadata': metadata,
+            'token': token
+        }
+    )
+    assert response.status_code == 400
+    errors = [
+        {
+            'field': f'content.{field}',
+            'message': f'Missing required field: content.{field}'
+        } for field in content
+    ]
+    assert response.get_json() == {
+        'result': False,
+        'message': errors[0]['message'],
+        'errors': errors
+    }
+
+    response = post(client, f'/api/{category.path}/new', {'metadata': metadata, 'token': token})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [
+        {
+            'field': 'content',
+            'message': 'Missing required field: content'
+        }
+    ]
+
+
+@categories
+def test_write_rejects_invalid_token(client, token, category):
+    content, metadata = category.records[0]
+    body = {'content': content, 'metadata': metadata, 'token': dict(token, hash='x')}
+    response = post(client, f'/api/{category.path}/new', body)
+    assert response.status_code == 200
+    assert response.get_json() == {'result': False, 'message': 'Invalid Token'}
+
+
+@categories
+def test_read_day(client, token, category):
+    write(client, token, category)
+    body = {'date': '2018-05-01', 'token': token}
+    response = post(client, f'/api/{category.path}', body)
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'result': True,
+        'message': category.message.format('2018-05-01'),
+        day_field(category): category.day
+    }
+
+    # an unchanged day answers a conditional read with 304 and no body
+    etag = response.headers['ETag']
+    response = post(client, f'/api/{category.path}', body, {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    response = post(client, f'/api/{category.path}', dict(body, date='2018-05-03'))
+    assert response.get_json() == {
+        'result': True,
+        'message': category.message.format('2018-05-03'),
+        day_field(category): category.empty
+    }
+
+
+@categories
+def test_read_rejects_bad_dates(client, token, category):
+    response = post(client, f'/api/{category.path}', {'date': 'bad', 'token': token})
+    assert response.status_code == 400
+    message = 'Invalid field: date (expected a date (YYYY-MM-DD))'
+    assert response.get_json() == {
+        'result': False,
+        'message': message,
+        'errors': [{
+            'field': 'date',
+            'message': message
+        }]
+    }
+
+    response = post(client, f'/api/{category.path}', {'token': token})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Missing required field: date'
+
+
+@categories
+def test_read_range(client, token, category):
+    write(client, token, category, 0)
+    write(client, token, category, 1)
+    body = {'start': '2018-04-01', 'end': '2018-05-30', 'token': token}
+    message = f'Returning {category.name} records from 2018-04-01 to 2018-05-30'
+
+    response = post(client, f'/api/{category.path}', body).get_json()
+    assert response == {'result': True, 'message': message, 'list': category.range, 'cursor': None}
+
+    # a full page carries a cursor to the next
+    pages, cursor = [], None
+    for _ in range(3):
+        page = dict(body, limit=1, cursor=cursor) if cursor else dict(body, limit=1)
+        response = post(client, f'/api/{category.path}', page).get_json()
+        assert response['result'] is True and response['message'] == message
+        pages.append(response['list'])
+        cursor = response['cursor']
+    assert pages == [category.range[:1], category.range[1:], []]
+    assert cursor is None
+
+    # limits below 1 are read as 1
+    for limit in (0, -1):
+        response = post(client, f'/api/{category.path}', dict(body, limit=limit)).get_json()
+        assert response['list'] == category.range[:1] and response['cursor'] is not None
+
+    response = post(client, f'/api/{category.path}', dict(body, cursor='zzz'))
+    assert response.get_json() == {'result': False, 'message': 'Invalid cursor'}
+
+    # a cursor must hold one value for each column the range is ordered by
+    cursor = post(client, f'/api/{category.path}', dict(body, limit=1)).get_json()['cursor']
+    valid = json.loads(urlsafe_b64decode(cursor))
+    for values in (valid[:-1], valid + valid[-1:], {'a': 1}):
+        cursor = urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+        response = post(client, f'/api/{category.path}', dict(body, cursor=cursor))
+        assert response.get_json() == {'result': False, 'message': 'Invalid cursor'}
+
+
+@categories
+def test_read_fields(client, token, category):
+    write(client, token, category)
+    field = next(iter(category.range[0]))
+    body = {'date': '2018-05-01', 'fields': [field], 'token': token}
+    response = post(client, f'/api/{category.path}', body).get_json()
+    day = category.day
+    expected = [{field: r[field]} for r in day] if isinstance(day, list) else {field: day[field]}
+    assert response[day_field(category)] == expected
+
+    response = post(client, f'/api/{category.path}', dict(body, fields=['nope']))
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['field'] == 'fields'
+
+
+@categories
+def test_batch(client, token, category):
+    content, metadata = category.records[0]
+    body = {'records': [{'content': content, 'metadata': metadata}, 'junk'], 'token': token}
+    response = post(client, f'/api/{category.path}/batch', body).get_json()
+    assert response == {
+        'result': True,
+        'message': 'Synced 2 records',
+        'list': [
+            {
+                'result': True,
+                'message': f'Inserted new {category.label}.'
+            }, {
+                'result': False,
+                'message': 'Unknown record type',
+                'errors': [{
+                    'field': 'type',
+                    'message': 'Unknown record type'
+                }]
+            }
+        ]
+    }
+
+
+@categories
+def test_delete(client, token, category):
+    write(client, token, category)
+    body = {'key': category.key, 'token': token}
+    response = post(client, f'/api/{category.path}/delete', body).get_json()
+    assert response == {'result': True, 'message': f'Deleted {category.label}.'}
+    response = post(client, f'/api/{category.path}/delete', body).get_json()
+    assert response == {'result': False, 'message': f'No such {category.label}'}
+    response = post(client, f'/api/{category.path}/delete', dict(body, key={})).get_json()
+    assert response == {'result': False, 'message': 'Invalid key'}
+    for column, value in category.key.items():
+        for malformed in ([value], {'value': value}, 1):
+            key = dict(category.key, **{column: malformed})
+            response = post(client, f'/api/{category.path}/delete', dict(body, key=key))
+            assert response.get_json() == {'result': False, 'message': 'Invalid key'}
+
+    response = post(client, f'/api/{category.path}', {'date': '2018-05-01', 'token': token})
+    assert response.get_json()[day_field(category)] == category.empty
+
+
+def test_water_increments(client, token):
+    body = {'content': {'isIncrement': True, 'cups': 2}, 'metadata': MORNING, 'token': token}
+    assert post(client, '/api/water/new', body).get_json()['message'] == 'Inserted new water entry.'
+    assert post(client, '/api/water/new', body).get_json()['message'] == \
+        'Updated existing water entry.'
+    response = post(client, '/api/water', {'date': '2018-05-01', 'token': token}).get_json()
+    assert response['content'] == {'cupsCount': 4, 'isIncrement': False}
+
+
+def test_write_rejects_numbers_out_of_range(client, token):
+    for cups in (10**30, 2**31, 1e30):
+        body = {'content': {'isIncrement': True, 'cups': cups}, 'metadata': MORNING, 'token': token}
+        response = post(client, '/api/water/new', body)
+        assert response.status_code == 400
+        assert response.get_json()['errors'] == [
+            {
+                'field': 'content.cups',
+                'message': 'Invalid field: content.cups '
+                '(expected a whole number from -2147483648 to 2147483647)'
+            }
+        ]
+
+
+def test_water_totals_stay_in_range(client, token):
+    from ESSBackend.app import flush_water
+
+    content = {'isIncrement': True, 'cups': 2**31 - 1}
+    body = {'content': content, 'metadata': MORNING, 'token': token}
+    for _ in range(3):
+        assert post(client, '/api/water/new', body).get_json()['result'] is True
+    response = post(client, '/api/water', {'date': '2018-05-01', 'token': token}).get_json()
+    assert response['content'] == {'cupsCount': 2**31 - 1, 'isIncrement': False}
+
+    # a coalesced batch is summed before it reaches the database
+    email = token['email']
+    with client.application.app_context():
+        flush_water({(email, date(2018, 5, 2)): 2**33, (email, date(2018, 5, 3)): -2**33})
+    for day, count in (('2018-05-02', 2**31 - 1), ('2018-05-03', -2**31)):
+        response = post(client, '/api/water', {'date': day, 'token': token}).get_json()
+        assert response['content'] == {'cupsCount': count, 'isIncrement': False}
+
+
+def test_write_rejects_strings_too_long_for_their_columns(client, token):
+    for category, field, length in (
+        (CATEGORIES[0], 'name', 128),
+        (CATEGORIES[0], 'category', 64),
+        (CATEGORIES[1], 'method', 64),
+    ):
+        content = dict(category.records[0][0], **{field: 'x' * (length + 1)})
+        body = {'content': content, 'metadata': MORNING, 'token': token}
+        response = post(client, f'/api/{category.path}/new', body)
+        assert response.status_code == 400
+        assert response.get_json()['errors'] == [
+            {
+                'field': f'content.{field}',
+                'message': f'Invalid field: content.{field} '
+                f'(expected a string of at most {length} characters)'
+            }
+        ]
+        content[field] = 'x' * length
+        assert post(client, f'/api/{category.path}/new', body).get_json()['result'] is True
+
+    credentials = {'email': 'x' * 117 + '@example.com', 'password': 'password'}
+    response = post(client, '/api/register', credentials)
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['field'] == 'email'
+
+
+def test_food_takes_null_for_nullable_columns(client, token):
+    content = {
+        'name': 'mystery',
+        'quantity': None,
+        'quantityUnits': None,
+        'calories': None,
+        'category': None,
+        'mealTime': '2018-05-01T08:00:00'
+    }
+    body = {'content': content, 'metadata': MORNING, 'token': token}
+    assert post(client, '/api/food/new', body).get_json() == {
+        'result': True,
+        'message': 'Inserted new food.'
+    }
+    response = post(client, '/api/food', {'date': '2018-05-01', 'token': token}).get_json()
+    assert response['list'] == [content]
+
+    # a day whose calories are all null adds up to 0, however the summary is computed
+    from ESSBackend import scorecard
+    scorecard.rebuild()
+    body = {'start': '2018-05-01', 'end': '2018-05-01', 'token': token}
+    assert post(client, '/api/scorecard', body).get_json()['list'][0]['calories'] == 0
+
+    # the fields are still required
+    missing = {k: v for k, v in content.items() if k != 'calories'}
+    body = {'content': missing, 'metadata': MORNING, 'token': token}
+    response = post(client, '/api/food/new', body)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Missing required field: content.calories'
+
+    # and an empty CSV cell is null too
+    data = 'type,name,quantity,quantityUnits,calories,category,mealTime,timestamp\n' \
+        'food,toast,2,,150,,2018-05-01T09:00:00,2018-05-01T09:00:00\n'
+    headers = {'X-ESS-Token': json.dumps(token), 'Content-Type': 'text/csv'}
+    assert client.post('/api/import', data=data, headers=headers).get_json()['inserted'] == 1
+
+    body = {'start': '2018-05-01', 'end': '2018-05-01', 'token': token}
+    response = post(client, '/api/scorecard', body).get_json()
+    assert response['list'][0]['calories'] == 150
+
+
+def test_journal_edit_keeps_creation_time(client, token):
+    for metadata in (MORNING, NEXT_DAY):
+        body = {'content': {'title': 't', 'contents': 'hello'}, 'metadata': metadata}
+        post(client, '/api/journal/new', dict(body, token=token))
+    response = post(client, '/api/journal', {'date': '2018-05-01', 'token': token}).get_json()
+    assert response['list'] == [
+        {
+            'title': 't',
+            'contents': 'hello',
+            'created': '2018-05-01T10:00:00',
+            'edited': '2018-05-02T11:00:00'
+        }
+    ]
+
+
+# ----- Cross-category Endpoints
+
+
+def test_day(client, token):
+    for category in CATEGORIES:
+        write(client, token, category)
+
+    response = post(client, '/api/day', {'date': '2018-05-01', 'token': token}).get_json()
+    expected = {c.name: c.day for c in CATEGORIES}
+    message = 'Returning all categories for 2018-05-01'
+    assert response == dict(expected, result=True, message=message)
+
+    body = {
+        'date': '2018-05-01',
+        'categories': ['food', 'water'],
+        'fields': {
+            'food': ['name']
+        },
+        'token': token
+    }
+    response = post(client, '/api/day', body).get_json()
+    assert response == {
+        'result': True,
+        'message': 'Returning all categories for 2018-05-01',
+        'food': [{
+            'name': 'apple'
+        }],
+        'water': expected['water']
+    }
+
+    response = post(client, '/api/day', dict(body, categories=['food', 'nope'])).get_json()
+    assert response == {'result': False, 'message': 'Unknown categories: nope'}
+
+    response = post(client, '/api/day', dict(body, categories=['food', 'food'])).get_json()
+    assert response['food'] == [{'name': 'apple'}]
+
+    response = post(client, '/api/day', dict(body, categories=[])).get_json()
+    assert response == {'result': True, 'message': message}
+
+
+def test_sync(client, token):
+    body = {
+        'records': [
+            {
+                'type': 'water',
+                'content': {
+                    'isIncrement': True,
+                    'cups': 2
+                },
+                'metadata': MORNING
+            },
+            {
+                'type': 'nope'
+            },
+            {
+                'type': 'shower',
+                'content': {
+                    'cold': 1,
+                    'minutes': 3
+                },
+                'metadata': {}
+            },
+        ],
+        'token': token
+    }
+    response = post(client, '/api/sync', body).get_json()
+    assert response == {
+        'result': True,
+        'message': 'Synced 3 records',
+        'list': [
+            {
+                'result': True,
+                'message': 'Inserted new water entry.'
+            },
+            {
+                'result': False,
+                'message': 'Unknown record type',
+                'errors': [{
+                    'field': 'type',
+                    'message': 'Unknown record type'
+                }]
+            },
+            {
+                'result': False,
+                'message': 'Invalid field: content.cold (expected true or false)',
+                'errors': [
+                    {
+                        'field': 'content.cold',
+                        'message': 'Invalid field: content.cold (expected true or false)'
+                    }, {
+                        'field': 'metadata.timestamp',
+                        'message': 'Missing required field: metadata.timestamp'
+                    }
+                ]
+            },
+        ]
+    }
+
+
+def test_scorecard(client, token):
+    for category in CATEGORIES:
+        write(client, token, category)
+    body = {'start': '2018-05-01', 'end': '2018-05-03', 'token': token}
+    response = post(client, '/api/scorecard', body).get_json()
+    assert response == {
+        'result': True,
+        'message': 'Returning scorecard from 2018-05-01 to 2018-05-03',
+        'list': [
+            {
+                'date': '2018-05-01',
+                'calories': 95,
+                'commuteDistance': 7.0,
+                'commuteByMethod': {
+                    'bike': 7.0
+                },
+                'waterCups': 3,
+                'showerMinutes': 5,
+                'entertainmentHours': 2,
+                'cigarettes': 1
+            }
+        ]
+    }
+
+    response = post(client, '/api/scorecard/emissions', body).get_json()
+    assert response['result'] is True
+    assert response['message'] == 'Returning emissions from 2018-05-01 to 2018-05-03'
+    assert [set(day) for day in response['list']] == [{'date', 'total', 'commute', 'food'}]
+
+
+def test_changes(client, token):
+    water, health = CATEGORIES[3], CATEGORIES[6]
+    write(client, token, water)
+    write(client, token, health)
+
+    response = post(client, '/api/changes', {'token': token}).get_json()
+    changes = response['list']
+    assert [(c['type'], c['key'], c['content']) for c in changes] == [
+        ('water', {
+            'date': '2018-05-01'
+        }, dict(water.day, date='2018-05-01')),
+        ('health', {
+            'date': '2018-05-01'
+        }, dict(health.day, date='2018-05-01')),
+    ]
+    assert changes[0]['seq'] < changes[1]['seq']
+    assert response == {
+        'result': True,
+        'message': 'Returning changes since 0',
+        'list': changes,
+        'since': changes[1]['seq'],
+        'more': False
+    }
+
+    body = {'type': 'water', 'key': {'date': '2018-05-01'}, 'token': token}
+    assert post(client, '/api/delete', body).get_json() == {
+        'result': True,
+        'message': 'Deleted water entry.'
+    }
+    assert post(client, '/api/delete', dict(body, type='nope')).get_json() == {
+        'result': False,
+        'message': 'Unknown record type'
+    }
+
+    since = changes[0]['seq']
+    response = post(client, '/api/changes', {'since': since, 'token': token}).get_json()
+    assert response['message'] == f'Returning changes since {since}'
+    assert [c['type'] for c in response['list']] == ['health', 'water']
+    tombstone = response['list'][1]
+    assert tombstone == {
+        'type': 'water',
+        'seq': tombstone['seq'],
+        'key': {
+            'date': '2018-05-01'
+        },
+        'deleted': True
+    }
+    assert response['since'] == tombstone['seq'] and response['more'] is False
+
+    response = post(client, f'/api/changes?since={since}', {'token': token}).get_json()
+    assert response['message'] == f'Returning changes since {since}'
+    for since in ('x', 2**63, -2**63 - 1):
+        response = post(client, f'/api/changes?since={since}', {'token': token})
+        assert response.status_code == 400
+        assert response.get_json()['errors'][0]['field'] == 'since'
+    response = post(client, '/api/changes', {'since': 2**63, 'token': token})
+    assert response.status_code == 400
+
+    # limits below 1 are read as 1, so paging always makes progress
+    for limit in (1, 0, -1):
+        response = post(client, '/api/changes', {'token': token, 'limit': limit}).get_json()
+        assert len(response['list']) == 1 and response['more'] is True
+
+
+def test_search(client, token):
+    write(client, token, CATEGORIES[2], 0)
+    write(client, token, CATEGORIES[2], 1)
+    response = post(client, '/api/journal/search', {'query': 'hello', 'token': token}).get_json()
+    assert response['result'] is True
+    assert response['message'] == 'Returning journal entries matching "hello"'
+    assert [dict(r, rank=None) for r in response['list']] == [
+        dict(CATEGORIES[2].range[0], rank=None)
+    ]
+    assert response['offset'] is None
+
+
+def test_import(client, token):
+    records = [
+        {
+            'type': 'water',
+            'content': {
+                'isIncrement': False,
+                'cups': 3
+            },
+            'metadata': MORNING
+        },
+        {
+            'type': 'nope'
+        },
+    ]
+    data = '\n'.join(json.dumps(r) for r in records) + '\nnot json\n'
+    headers = {'X-ESS-Token': json.dumps(token), 'Content-Type': 'application/x-ndjson'}
+    response = client.post('/api/import', data=data, headers=headers)
+    assert response.content_type == 'application/json'
+    counts = {'records': 3, 'inserted': 1, 'updated': 0, 'duplicates': 0, 'rejected': 2}
+    assert response.get_json() == dict(
+        counts,
+        result=True,
+        message='Importing ndjson records',
+        list=[counts],
+        errors=[{
+            'line': 2,
+            'message': 'Unknown record type'
+        }, {
+            'line': 3,
+            'message': 'Invalid JSON'
+        }]
+    )
+
+    response = client.post('/api/import', data=data, headers=dict(headers, **{'Content-Type': 'x'}))
+    assert response.status_code == 415
+    assert response.get_json()['result'] is False
@@ -0,0 +1,44 @@
+from ESSBackend.emissions import footprint
+from datetime import date
+
+import pytest
+
+METADATA = {'metadata': {'timestamp': '2018-05-01T10:00:00'}}
+
+
+def test_footprint_sums_each_label_per_day(client, token):
+    commutes = [('01', '08', 'car', 10), ('01', '12', 'car', 5), ('01', '17', 'bus', 10),
+                ('02', '08', 'car', 100)]
+    for day, hour, method, distance in commutes:
+        content = {
+            'arrival': f'2018-05-{day}T{hour}:30:00',
+            'departure': f'2018-05-{day}T{hour}:00:00',
+            'method': method,
+            'distance': distance
+        }
+        body = dict(METADATA, content=content, token=token)
+        assert client.post('/api/commute/new', json=body).get_json()['result'] is True
+    foods = [('steak', 'beef', 2), ('burger', 'Beef', 1), ('stew', None, 1), ('soup', None, None)]
+    for name, category, quantity in foods:
+        content = {
+            'name': name,
+            'quantity': quantity,
+            'quantityUnits': None,
+            'calories': None,
+            'category': category,
+            'mealTime': '2018-05-01T12:00:00'
+        }
+        body = dict(METADATA, content=content, token=token)
+        assert client.post('/api/food/new', json=body).get_json()['result'] is True
+
+    [first, second] = footprint(token['email'], date(2018, 5, 1), date(2018, 5, 2))
+    assert first['date'] == '2018-05-01' and second['date'] == '2018-05-02'
+    assert first['commute'] == pytest.approx(0.404 * 15 + 0.18 * 10)
+    assert first['food'] == pytest.approx(6.0 * 3 + 0.5)
+    assert first['total'] == pytest.approx(first['commute'] + first['food'])
+    assert second == {
+        'date': '2018-05-02',
+        'commute': pytest.approx(40.4),
+        'food': 0.0,
+        'total': pytest.approx(40.4)
+    }
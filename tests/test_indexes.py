@@ -0,0 +1,76 @@
+# Per-day reads must find a user's rows through an index leading with (email, day column),
+# bounded on both sides of the day, rather than scanning the table, so they cost the same
+# however much history the user has.
+
+from ESSBackend.app import db
+from ESSBackend.resources import resources, select_days
+from datetime import date
+
+import pytest
+
+
+def explain(statement, params=None):
+    """The plan of a statement, as lines of text."""
+    dialect = db.get_bind().dialect
+    compiled = statement.compile(dialect=dialect)
+    values = compiled.construct_params(params)
+    if dialect.positional:
+        values = [values[name] for name in compiled.positiontup]
+    cursor = db.connection().connection.cursor()
+    if dialect.name == 'postgresql':
+        # the test tables are tiny, and a scan of a tiny table is cheaper than any index
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + str(compiled), values)
+        return [line for line, in cursor.fetchall()]
+    cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), values)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def day_indexes(resource):
+    """The names of the resource's indexes that lead with (email, day column)."""
+    table = resource.model.__table__
+    leading = ['email', resource.day_column]
+    names = {i.name for i in table.indexes if [c.name for c in i.columns][:2] == leading}
+    if [c.name for c in table.primary_key.columns][:2] == leading:
+        names.update([f'sqlite_autoindex_{table.name}_1', f'{table.name}_pkey'])
+    return names
+
+
+def assert_indexed(plan, resource):
+    table = resource.model.__table__.name
+    column = resource.day_column
+    indexes = day_indexes(resource)
+    text = '\n'.join(plan)
+    if db.get_bind().dialect.name == 'postgresql':
+        assert 'Seq Scan' not in text, text
+        assert any(f' {name} ' in f'{line} ' for line in plan for name in indexes), text
+        return
+
+    # e.g. SEARCH foods USING INDEX ix_foods_email_mealtime (email=? AND mealTime>? AND ...)
+    lines = [line for line in plan if f' {table} ' in f'{line} ']
+    assert lines, text
+    for line in lines:
+        assert line.startswith(f'SEARCH {table} USING'), text
+        assert any(f'INDEX {name} ' in line for name in indexes), text
+        assert f'(email=? AND {column}>? AND {column}<?)' in line, text
+
+
+@pytest.fixture(autouse=True)
+def rollback():
+    yield
+    db.rollback()
+
+
+@pytest.mark.parametrize('name', list(resources))
+def test_day_read_uses_index(name):
+    resource = resources[name]
+    lower, upper = resource.bounds(date(2018, 5, 1), date(2018, 5, 1))
+    params = {'email': 'someone@example.com', 'lower': lower, 'upper': upper}
+    assert_indexed(explain(resource.view().statements.day, params), resource)
+
+
+def test_day_union_uses_indexes():
+    views = [resource.view() for resource in resources.values()]
+    plan = explain(select_days(views, 'someone@example.com', date(2018, 5, 1)))
+    for resource in resources.values():
+        assert_indexed(plan, resource)
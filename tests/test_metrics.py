@@ -0,0 +1,34 @@
+from ESSBackend import app as backend
+from ESSBackend.metrics import Metrics
+
+import pytest
+
+PUBLIC = {'REMOTE_ADDR': '203.0.113.7'}
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    def serve(key):
+        monkeypatch.setattr(backend, 'metrics', Metrics(None, 5, key))
+
+    return serve
+
+
+def test_metrics_are_off_by_default(client):
+    assert backend.app.config['METRICS'] is False
+    assert client.get('/api/metrics').status_code == 404
+
+
+def test_metrics_without_a_key_are_local_only(client, metrics):
+    metrics(None)
+    assert client.get('/api/metrics').status_code == 200
+    assert client.get('/api/metrics', environ_base=PUBLIC).status_code == 404
+
+
+def test_metrics_with_a_key_need_it(client, metrics):
+    metrics('s3cret')
+    assert client.get('/api/metrics').status_code == 404
+    for given in ('Bearer nope', 'Bearer s3crét', 's3cret'):
+        assert client.get('/api/metrics', headers={'Authorization': given}).status_code == 404
+    headers = {'Authorization': 'Bearer s3cret'}
+    assert client.get('/api/metrics', headers=headers, environ_base=PUBLIC).status_code == 200
@@ -0,0 +1,59 @@
+from ESSBackend import passwords
+from ESSBackend.passwords import PasswordPoolBusy, Slots
+
+import multiprocessing
+import os
+import pytest
+
+
+def hold(slots, taken, done):
+    with slots.take():
+        taken.set()
+        done.wait(10)
+        os._exit(0)  # dies holding the slot, as a killed worker would
+
+
+def test_slots_are_shared_by_processes(tmp_path):
+    slots = Slots(1, str(tmp_path))
+    with slots.take():
+        pass  # the files are opened before forking, as by a uwsgi master
+
+    fork = multiprocessing.get_context('fork')
+    taken, done = fork.Event(), fork.Event()
+    worker = fork.Process(target=hold, args=(slots, taken, done))
+    worker.start()
+    try:
+        assert taken.wait(10)
+        with pytest.raises(PasswordPoolBusy):
+            with slots.take():
+                pass
+    finally:
+        done.set()
+        worker.join(10)
+
+    # the slot went with the process that held it
+    with slots.take():
+        pass
+
+
+def test_slots_are_shared_by_threads():
+    slots = Slots(2, None)
+    with slots.take(), slots.take():
+        with pytest.raises(PasswordPoolBusy):
+            with slots.take():
+                pass
+    with slots.take():
+        pass
+
+
+def test_busy_logins_get_503(client, email, token, monkeypatch):
+    slots = Slots(1, None)
+    monkeypatch.setattr(passwords, '_slots', slots)
+    with slots.take():
+        response = client.post('/api/login', json={'email': email, 'password': 'password'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+    assert response.get_json() == {'result': False, 'message': 'Server busy, try again shortly'}
+
+    response = client.post('/api/login', json={'email': email, 'password': 'password'})
+    assert response.get_json()['result'] is True
@@ -0,0 +1,19 @@
+from ESSBackend.profiler import Profiler
+
+
+def requesting(key: str):
+    # WSGI servers decode header bytes as latin-1
+    return {'HTTP_X_ESS_PROFILE': key.encode('utf-8').decode('latin-1')}
+
+
+def test_profiles_requests_with_the_key(tmp_path):
+    profiler = Profiler(str(tmp_path), 'clé', 0.0, 10)
+    assert profiler.wanted(requesting('clé'))
+    assert not profiler.wanted(requesting('cle'))
+    assert not profiler.wanted(requesting('ключ'))
+    assert not profiler.wanted({})
+
+
+def test_ignores_the_header_without_a_key(tmp_path):
+    profiler = Profiler(str(tmp_path), None, 0.0, 10)
+    assert not profiler.wanted(requesting('ключ'))
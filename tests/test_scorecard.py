@@ -0,0 +1,26 @@
+from ESSBackend.app import db
+from ESSBackend.resources import resources
+from ESSBackend.scorecard import _on_days
+from datetime import date
+from sqlalchemy import select
+
+
+def test_only_the_touched_days_are_read(client, token):
+    for day in range(1, 8):
+        content = {
+            'name': 'apple',
+            'quantity': 1,
+            'quantityUnits': 'u',
+            'calories': day,
+            'category': 'fruit',
+            'mealTime': f'2018-05-0{day}T08:00:00'
+        }
+        body = {'content': content, 'metadata': {'timestamp': content['mealTime']}, 'token': token}
+        assert client.post('/api/food/new', json=body).get_json()['result'] is True
+
+    resource = resources['food']
+    table = resource.model.__table__
+    days = [date(2018, 5, 1), date(2018, 5, 2), date(2018, 5, 5), date(2018, 5, 7)]
+    query = select([table.c.calories]).where(_on_days(resource, token['email'], days))
+    assert sorted(calories for calories, in db.execute(query)) == [1, 2, 5, 7]
+    db.rollback()
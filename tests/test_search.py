@@ -0,0 +1,79 @@
+from ESSBackend import search as fallback
+from ESSBackend.app import db
+from ESSBackend.resources import resources
+from ESSBackend.search import index, search, terms
+from sqlalchemy import text
+
+import pytest
+import random
+
+WORDS = ['apple', 'berry', 'cherry', 'date', 'elder', 'fig', 'grape']
+
+
+@pytest.fixture
+def entries(email):
+    rng = random.Random(0)
+    # few distinct weights, so plenty of entries tie, and are ranked by title
+    rows = [
+        {
+            'title': f'{rng.choice(WORDS) if i % 4 == 0 else "entry"} {i}',
+            'content': ' '.join(rng.choices(WORDS, [30, 20, 10, 5, 3, 2, 1], k=rng.randint(1, 6)))
+        } for i in range(300)
+    ]
+    index(resources['journal'], email, rows)
+    db.commit()
+    return rows
+
+
+def ranked(rows, query):
+    """Every entry matching all the words of `query`, best first, worked out the long way."""
+    words = set(terms(query))
+    matches = []
+    for row in rows:
+        weights = fallback._weights(row['title'], row['content'])
+        if words <= set(weights):
+            matches.append((row['title'], round(sum(weights[w] for w in words), 6)))
+    return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+
+@pytest.mark.skipif(fallback._postgres(), reason='searches the sqlite fallback')
+@pytest.mark.parametrize('batch', [1, 7, 100])
+@pytest.mark.parametrize('query', ['apple berry', 'fig apple', 'cherry date berry', 'grape elder'])
+def test_pages_of_several_words(entries, email, monkeypatch, batch, query):
+    # small batches take many rounds, and skip looking up entries that can't make the page
+    monkeypatch.setattr(fallback, '_BATCH', batch)
+    expected = ranked(entries, query)
+    assert expected
+    for offset, limit in [(0, 5), (5, 5), (0, 50), (len(expected) - 2, 10)]:
+        assert search(email, query, offset, limit) == expected[offset:offset + limit]
+
+
+@pytest.mark.skipif(fallback._postgres(), reason='searches the sqlite fallback')
+def test_one_word_and_no_match(entries, email):
+    assert search(email, 'cherry', 3, 10) == ranked(entries, 'cherry')[3:13]
+    assert search(email, 'apple nope', 0, 10) == []
+    assert search(email, 'the', 0, 10) == []
+
+
+@pytest.mark.skipif(fallback._postgres(), reason='searches the sqlite fallback')
+def test_ties_at_the_end_of_a_page(email, monkeypatch):
+    monkeypatch.setattr(fallback, '_BATCH', 1)
+    contents = {
+        'k': 'apple apple apple berry',
+        'b': 'apple apple berry berry',
+        'bb': 'apple berry berry',
+        'c': 'apple apple berry berry'
+    }
+    index(resources['journal'], email, [{'title': t, 'content': c} for t, c in contents.items()])
+    db.commit()
+    # c ties with k, and comes first, though it's only met once the bound has fallen to its rank
+    assert search(email, 'apple berry', 0, 2) == [('b', 1.6), ('c', 1.6)]
+
+
+@pytest.mark.skipif(fallback._postgres(), reason='searches the sqlite fallback')
+def test_lookups_use_the_primary_key(email):
+    # one lookup per title, rather than a read of every posting of the word
+    params = {'email': email, 'term': 'apple', 'titles': '["apple 0"]'}
+    explain = text('EXPLAIN QUERY PLAN ' + fallback._lookup.text)
+    plan = [row[-1] for row in db.execute(explain, params)]
+    assert any('(email=? AND title=? AND term=?)' in line for line in plan), plan
@@ -0,0 +1,29 @@
+from ESSBackend import tokens
+from ESSBackend.config import Config
+from datetime import timedelta
+
+
+def test_logout_revokes_only_that_token(client, token, monkeypatch):
+    other = client.post('/api/register', json={'email': 'x' + token['email'], 'password': 'p'})
+    other = other.get_json()['token']
+    assert client.post('/api/logout', json={'token': token}).get_json()['result'] is True
+
+    # revocations don't depend on the configured lifetime of tokens
+    monkeypatch.setattr(Config, 'TOKEN_TIMEOUT', timedelta(days=1))
+    assert tokens.verify_token(token) == 'Token Revoked'
+    assert tokens.verify_token(other) is None
+
+
+def test_revocations_reach_other_workers(client, token, monkeypatch):
+    assert client.post('/api/logout', json={'token': token}).get_json()['result'] is True
+    # a worker that didn't handle the logout learns of it from the database
+    monkeypatch.setattr(tokens, '_revoked_hashes', {})
+    monkeypatch.setattr(tokens, '_synced_at', None)
+    assert tokens.verify_token(token) == 'Token Revoked'
+
+
+def test_non_ascii_hash_is_invalid(client, token):
+    forged = dict(token, hash='é' * 64)
+    assert tokens.verify_token(forged) == 'Invalid Token'
+    response = client.post('/api/water', json={'date': '2018-05-01', 'token': forged})
+    assert response.get_json() == {'result': False, 'message': 'Invalid Token'}
@@ -0,0 +1,46 @@
+# Upgrading a database created by the first version of models.py.
+
+from ESSBackend.upgrade import add_missing
+from sqlalchemy import create_engine, inspect
+
+# the tables as the first version created them
+BASELINE = [
+    'CREATE TABLE users (email VARCHAR(128) NOT NULL, password_hash VARCHAR(64) NOT NULL, '
+    'PRIMARY KEY (email))',
+    'CREATE TABLE foods (email VARCHAR(128) NOT NULL, name VARCHAR(128) NOT NULL, '
+    '"mealTime" DATETIME NOT NULL, quantity FLOAT, "quantityUnits" VARCHAR(64), '
+    'calories INTEGER, category VARCHAR(64), PRIMARY KEY (email, name, "mealTime"), '
+    'FOREIGN KEY(email) REFERENCES users (email))',
+    'CREATE TABLE waters (email VARCHAR(128) NOT NULL, date DATE NOT NULL, '
+    'count INTEGER NOT NULL, PRIMARY KEY (email, date), '
+    'FOREIGN KEY(email) REFERENCES users (email))',
+]
+
+
+def test_add_missing(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as connection:
+        for statement in BASELINE:
+            connection.execute(statement)
+        connection.execute("INSERT INTO users VALUES ('a@example.com', 'x')")
+        connection.execute(
+            "INSERT INTO foods VALUES ('a@example.com', 'apple', '2018-05-01 08:00:00.000000', "
+            "1, 'u', 95, 'fruit')"
+        )
+
+    with engine.begin() as connection:
+        added = add_missing(connection)
+    assert 'column foods.changeSeq' in added and 'column waters.changeSeq' in added
+    assert 'index ix_foods_email_mealtime' in added and 'index ix_foods_email_change' in added
+    assert 'table tombstones' in added and 'table daily_summaries' in added
+    assert 'table journals' in added and 'index ix_journals_email_created' not in added
+
+    inspector = inspect(engine)
+    assert 'changeSeq' in [c['name'] for c in inspector.get_columns('foods')]
+    assert 'ix_foods_email_mealtime' in [i['name'] for i in inspector.get_indexes('foods')]
+    assert 'ix_journals_email_created' in [i['name'] for i in inspector.get_indexes('journals')]
+    # existing rows are kept, with the new column's default until they're backfilled
+    assert engine.execute('SELECT name, "changeSeq" FROM foods').fetchall() == [('apple', 0)]
+
+    with engine.begin() as connection:
+        assert add_missing(connection) == []
@@ -0,0 +1,38 @@
+from ESSBackend.models import WaterCups
+from ESSBackend.upsert import _by_key, _pg_upsert
+from datetime import date
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+ROWS = [
+    {
+        'email': 'a@example.com',
+        'date': date(2018, 5, 1),
+        'count': 1
+    },
+    {
+        'email': 'a@example.com',
+        'date': date(2018, 5, 2),
+        'count': 2
+    },
+    {
+        'email': 'b@example.com',
+        'date': date(2018, 5, 1),
+        'count': 3
+    },
+]
+
+
+def test_returning_includes_the_key():
+    table = WaterCups.__table__
+    keys = [column.name for column in table.primary_key.columns]
+    stmt = _pg_upsert(pg_insert(table).values(ROWS), table, ROWS[0], None, ['count'] + keys)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert sql.endswith('RETURNING (xmax = 0), waters.count, waters.email, waters.date')
+
+
+def test_results_are_matched_by_key():
+    # (inserted, count, *key), in an order other than the rows'
+    results = [(row['count'] % 2 == 1, row['count'], row['email'], row['date']) for row in ROWS]
+    matched = _by_key(ROWS, ['email', 'date'], reversed(results))
+    assert matched == [(True, 1), (False, 2), (True, 3)]